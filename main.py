@@ -4,6 +4,189 @@ Entry point to run the CLI application
 This script allows the user to interact with the CLI application.
 It provides various commands and options to perform different tasks.
 
+Commands:
+    import-users FILE: Imports users from a CSV or JSON Lines file, in batches.
+    export-users FILE: Exports users to a CSV or JSON Lines file ("-" for stdout).
+    bench-build DIR: Generates a synthetic benchmark dataset.
+    bench-run DIR: Benchmarks the hot operations against a dataset, optionally saving the
+        results as JSON and comparing them with an earlier run.
+
 Functions:
     main(): The main function that sets up and runs the CLI application.
-"""
\ No newline at end of file
+"""
+import argparse
+import os
+import sys
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), "src"))
+
+from auth import AUTH_FILE, AuthManager
+from benchmark import (MODES, OPERATIONS, STORES as BENCHMARK_STORES, build_dataset, compare_results,
+                       load_results, run_benchmarks, save_results)
+from bulk import FORMATS, export_users, import_users, read_users, write_users
+from storage import JournalBackend, MappedFileBackend, SQLiteBackend
+
+STORES = {"journal": JournalBackend, "mapped": MappedFileBackend, "sqlite": SQLiteBackend}
+
+
+def build_parser():
+    """Build the command line parser
+
+    Returns:
+        argparse.ArgumentParser: parser for every command
+    """
+    parser = argparse.ArgumentParser(description="User authentication and RBAC administration")
+    parser.add_argument("--auth-file", default=AUTH_FILE, help=f"user data store (default: {AUTH_FILE})")
+    parser.add_argument("--store", choices=sorted(STORES), default="journal",
+                        help="storage backend of the user data store (default: journal, "
+                             "which keeps the JSON file format)")
+    commands = parser.add_subparsers(dest="command", required=True)
+
+    import_parser = commands.add_parser("import-users", help="import users from a CSV or JSON Lines file")
+    import_parser.add_argument("file", help='file to read, "-" for stdin')
+    import_parser.add_argument("--format", choices=FORMATS, help="file format (default: from the file extension)")
+    import_parser.add_argument("--batch-size", type=int, default=1000,
+                               help="records validated, hashed and stored together (default: 1000)")
+
+    export_parser = commands.add_parser("export-users", help="export users to a CSV or JSON Lines file")
+    export_parser.add_argument("file", help='file to write, "-" for stdout')
+    export_parser.add_argument("--format", choices=FORMATS, help="file format (default: from the file extension)")
+
+    bench_build_parser = commands.add_parser("bench-build", help="generate a synthetic benchmark dataset")
+    bench_build_parser.add_argument("directory", help="dataset directory")
+    bench_build_parser.add_argument("--users", type=int, default=10000, help="number of users (default: 10000)")
+    bench_build_parser.add_argument("--roles", type=int, default=200, help="number of roles (default: 200)")
+    bench_build_parser.add_argument("--permissions", type=int, default=2000, help="number of permissions (default: 2000)")
+    bench_build_parser.add_argument("--permissions-per-role", type=int, default=20,
+                                    help="permissions assigned to each role (default: 20)")
+    bench_build_parser.add_argument("--dataset-store", choices=sorted(BENCHMARK_STORES), default="mapped",
+                                    help="storage backend of the dataset (default: mapped)")
+    bench_build_parser.add_argument("--seed", type=int, default=0, help="generator seed (default: 0)")
+    bench_build_parser.add_argument("--scrypt-n", type=int, default=2 ** 14,
+                                    help="scrypt cost of the password hashes (default: 16384)")
+
+    run_parser = commands.add_parser("bench-run", help="benchmark the hot operations against a dataset")
+    run_parser.add_argument("directory", help="dataset directory written by bench-build")
+    run_parser.add_argument("--operations", nargs="+", choices=OPERATIONS, default=list(OPERATIONS),
+                            help="operations to run (default: all)")
+    run_parser.add_argument("--modes", nargs="+", choices=MODES, default=["single", "threads"],
+                            help="modes to run them in (default: single threads)")
+    run_parser.add_argument("--workers", type=int, default=4, help="threads or processes (default: 4)")
+    run_parser.add_argument("--duration", type=float, default=2.0, help="seconds measured per run (default: 2)")
+    run_parser.add_argument("--max-ops", type=int, help="operations after which a worker stops early")
+    run_parser.add_argument("--output", help="JSON file to save the results to")
+    run_parser.add_argument("--compare", help="results JSON of an earlier run to compare with")
+    run_parser.add_argument("--threshold", type=float, default=0.1,
+                            help="relative change reported as a regression (default: 0.1)")
+    return parser
+
+
+def main(argv=None):
+    """Set up and run the CLI application
+
+    Args:
+        argv (list, optional): command line arguments. Defaults to sys.argv[1:].
+
+    Returns:
+        int: exit status
+    """
+    parser = build_parser()
+    args = parser.parse_args(argv)
+    if args.command == "bench-build":
+        manifest = build_dataset(args.directory, args.users, args.roles, args.permissions,
+                                 args.permissions_per_role, args.dataset_store, args.seed, args.scrypt_n)
+        print(f"Built {manifest['users']} users in {manifest['build_seconds']} s.", file=sys.stderr)
+        return 0
+    if args.command == "bench-run":
+        return _run_benchmarks(args)
+
+    file_format = args.format or _format_from_path(args.file)
+    if file_format is None:
+        parser.error(f"cannot tell the format of '{args.file}', use --format")
+
+    storage = STORES[args.store](args.auth_file, {"users": {}})
+    if args.command == "export-users":
+        try: # Streamed from the backend, no manager loads the store
+            with _open(args.file, 'w') as file:
+                count = write_users(export_users(storage), file, file_format)
+        finally:
+            storage.close()
+        print(f"Exported {count} users.", file=sys.stderr)
+        return 0
+
+    manager = AuthManager(storage)
+    try:
+        with _open(args.file, 'r') as file:
+            summary = import_users(manager, read_users(file, file_format), args.batch_size)
+        if isinstance(storage, JournalBackend):
+            storage.compact()
+        print(f"Imported {summary['imported']} users, skipped {summary['skipped']} existing or rejected "
+              f"and {summary['invalid']} invalid records.", file=sys.stderr)
+        return 1 if summary["invalid"] else 0
+    finally:
+        manager.close()
+
+
+def _run_benchmarks(args):
+    """Run the bench-run command
+
+    Args:
+        args (argparse.Namespace): parsed command line
+
+    Returns:
+        int: exit status, 1 if a regression was found against --compare
+    """
+    results = run_benchmarks(args.directory, args.operations, args.modes, args.workers, args.duration, args.max_ops)
+    print(f"{'operation':<24}{'mode':<11}{'workers':>8}{'ops/s':>14}{'p50 us':>11}{'p99 us':>11}")
+    for row in results["results"]:
+        if "skipped" in row:
+            print(f"{row['operation']:<24}{row['mode']:<11}{row['workers']:>8}  skipped: {row['skipped']}")
+            continue
+        print(f"{row['operation']:<24}{row['mode']:<11}{row['workers']:>8}{row['throughput']:>14.1f}"
+              f"{row['p50'] * 1e6:>11.1f}{row['p99'] * 1e6:>11.1f}")
+    if args.output:
+        save_results(results, args.output)
+    if not args.compare:
+        return 0
+    regressions = 0
+    for row in compare_results(load_results(args.compare), results, args.threshold):
+        regressions += row["regression"]
+        print(f"{row['operation']} {row['mode']} x{row['workers']}: throughput {row['throughput_change']:+.1%}, "
+              f"p99 {row['p99_change']:+.1%}{'  REGRESSION' if row['regression'] else ''}")
+    return 1 if regressions else 0
+
+
+def _format_from_path(path: str):
+    """Guess a file format from its extension
+
+    Args:
+        path (str): file path
+
+    Returns:
+        str: "csv" or "jsonl", None if the extension is unknown
+    """
+    extension = os.path.splitext(path)[1].lower()
+    if extension == ".csv":
+        return "csv"
+    if extension in (".jsonl", ".ndjson"):
+        return "jsonl"
+    return None
+
+
+def _open(path: str, mode: str):
+    """Open a file for the CLI, "-" stands for stdin or stdout
+
+    Args:
+        path (str): file path or "-"
+        mode (str): "r" or "w"
+
+    Returns:
+        file object: text file, the standard streams are not closed on exit
+    """
+    if path == "-":
+        return os.fdopen(os.dup((sys.stdin if mode == 'r' else sys.stdout).fileno()), mode, newline="")
+    return open(path, mode, newline="")
+
+
+if __name__ == "__main__":
+    sys.exit(main())
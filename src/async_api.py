@@ -0,0 +1,358 @@
+"""
+Asyncio API for authentication, sessions and RBAC
+
+This module wraps SessionManager and RBACManager for use from asyncio code.
+Nothing that touches storage or hashes a password runs on the event loop:
+
+    - password hashing runs on the manager's HashingPool,
+    - storage I/O and every mutation run on a single worker thread per
+      manager, which also serializes access to the manager's data,
+    - permission checks are pure in-memory lookups and answer on the loop
+      without printing anything, changes made by other processes are picked
+      up on the worker thread before answering, and before reading the users
+      of a login.
+
+The wrapped manager is loaded on first use in the worker thread, concurrent
+callers awaiting the first load all share the same one.
+
+Classes:
+    AsyncSessionManager:
+        Async counterpart of SessionManager (account, login and session methods).
+    AsyncRBACManager:
+        Async counterpart of RBACManager.
+"""
+import asyncio
+from concurrent.futures import ThreadPoolExecutor
+from events import INFO, WARNING
+from hashing import verify_password
+from rbac import RBACManager
+from session import SessionManager
+
+
+class _AsyncManager:
+    """Shared plumbing: lazy coalesced loading and the worker thread"""
+
+    def __init__(self, factory):
+        """
+        Args:
+            factory (callable): builds the wrapped manager, called once in the worker thread
+        """
+        self._factory = factory
+        self._executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix=type(self).__name__)
+        self._manager = None
+        self._loading = None
+
+    async def _get_manager(self):
+        """Get the wrapped manager, loading it on first use
+
+        Returns:
+            the wrapped manager
+        """
+        if self._manager is None:
+            if self._loading is None:
+                self._loading = asyncio.get_running_loop().run_in_executor(self._executor, self._factory)
+            try:
+                self._manager = await asyncio.shield(self._loading)
+            except BaseException:
+                if self._loading.done():
+                    self._loading = None # Let the next caller retry a failed load
+                raise
+        return self._manager
+
+    async def _get_checked_manager(self):
+        """Get the wrapped manager, first picking up changes of other processes on the worker thread
+
+        The refresh can wait for the store's file lock, so it never runs on the loop.
+
+        Returns:
+            the wrapped manager
+        """
+        manager = await self._get_manager()
+        if manager.storage.refresh_due():
+            await asyncio.get_running_loop().run_in_executor(self._executor, manager._refresh_data)
+        return manager
+
+    async def _call(self, method_name: str, *args):
+        """Run a manager method on the worker thread
+
+        Args:
+            method_name (str): name of the manager method
+            *args: arguments of the method
+
+        Returns:
+            the method's result
+        """
+        manager = await self._get_manager()
+        method = getattr(manager, method_name)
+        return await asyncio.get_running_loop().run_in_executor(self._executor, method, *args)
+
+    @staticmethod
+    def _emit(manager, event: str, level: int, **fields):
+        """Record an event of a step run on the loop, which never prints
+
+        Args:
+            manager: the wrapped manager
+            event (str): event name
+            level (int): event level
+            **fields: details of the event
+        """
+        if manager.events is not None:
+            manager.events.emit(event, level, **fields)
+
+    async def flush(self):
+        """Make sure every change made so far has been persisted"""
+        await self._call("flush")
+
+    async def close(self):
+        """Persist pending changes, release the storage backend and stop the worker thread"""
+        if self._manager is not None or self._loading is not None:
+            await self._call("close")
+        self._executor.shutdown(wait=False)
+
+
+class AsyncSessionManager(_AsyncManager):
+    """Async counterpart of SessionManager"""
+
+    def __init__(self, storage=None, hasher=None, hash_pool=None, throttle=None, signer=None, events=None,
+                 metrics=None):
+        """
+        Args:
+            storage (StorageBackend, optional): backend persisting the user data
+            hasher (PasswordHasher, optional): hasher for new and rehashed passwords
+            hash_pool (HashingPool, optional): pool running the password hashing
+            throttle (LoginThrottle, optional): failed login counters
+            signer (TokenSigner, optional): signs stateless session tokens
+            events (EventLog, optional): log recording the outcomes as structured events
+            metrics (Metrics, optional): registry the timed methods are recorded in
+        """
+        super().__init__(lambda: SessionManager(storage, hasher, hash_pool, throttle, signer, events, metrics))
+
+    async def _hash(self, function, *args):
+        """Run a hashing call on the manager's hashing pool
+
+        Args:
+            function (callable): hashing function
+            *args: arguments of the function
+
+        Returns:
+            the function's result
+        """
+        manager = await self._get_manager()
+        return await asyncio.wrap_future(manager.hash_pool.submit(function, *args))
+
+    async def create_account(self, username: str, password: str, role='user'):
+        """Create new user with a hashed password
+
+        Args:
+            username (str): username
+            password (str): password
+            role (str, optional): user role. Defaults to 'user'.
+
+        Returns:
+            bool: True if user doesn't exist, False if user already exist.
+        """
+        manager = await self._get_checked_manager()
+        if username in manager.data["users"]:
+            return False
+        password_hash = await self._hash(manager.hasher.hash, password)
+        return await self._call("_add_user", username, password_hash, role)
+
+    async def verify_user(self, username: str, password: str):
+        """Verify user credentials, rehashing the password when its parameters are outdated
+
+        Args:
+            username (str): user name
+            password (str): password
+
+        Returns:
+            bool: True if the credentials are valid, False otherwise
+        """
+        return await self._verify_password(await self._get_checked_manager(), username, password)
+
+    async def _verify_password(self, manager, username: str, password: str):
+        """Verify user credentials against the loaded data, rehashing outdated hashes
+
+        Args:
+            manager (SessionManager): the wrapped manager, refreshed by the caller
+            username (str): user name
+            password (str): password
+
+        Returns:
+            bool: True if the credentials are valid, False otherwise
+        """
+        user = manager.data["users"].get(username)
+        if user is None:
+            return False
+        stored_password = user["password"]
+        if not await self._hash(verify_password, password, stored_password):
+            return False
+        if manager.hasher.needs_rehash(stored_password):
+            new_hash = await self._hash(manager.hasher.hash, password)
+            await self._call("_replace_password_hash", username, stored_password, new_hash)
+        return True
+
+    async def login_user(self, username: str, password: str, source: str = None):
+        """Authenticate user and return success or failure, throttled like SessionManager.login_user
+
+        Args:
+            username (str): username
+            password (str): password
+            source (str, optional): origin of the attempt, e.g. the client address. Defaults to None.
+
+        Returns:
+            bool: True if login is successful, False otherwise.
+        """
+        manager = await self._get_manager()
+        if manager.throttle.retry_after(username, source):
+            self._emit(manager, "login.failure", WARNING, username=username, source=source, reason="throttled")
+            return False
+        manager = await self._get_checked_manager()
+        if username not in manager.data["users"]:
+            manager.throttle.record_failure(username, source)
+            self._emit(manager, "login.failure", WARNING, username=username, source=source, reason="unknown_user")
+            return False
+        if not await self._verify_password(manager, username, password):
+            manager.throttle.record_failure(username, source)
+            self._emit(manager, "login.failure", WARNING, username=username, source=source, reason="password")
+            return False
+        manager.throttle.record_success(username)
+        self._emit(manager, "login.success", INFO, username=username, source=source)
+        return True
+
+    async def logout_user(self, username: str):
+        """Log out the user and end every session of the user
+
+        Args:
+            username (str): username
+
+        Returns:
+            bool: True if log out is successful, False otherwise
+        """
+        return await self._call("logout_user", username)
+
+    async def create_session(self, username: str):
+        """Create a session for a logged in user
+
+        Args:
+            username (str): username
+
+        Returns:
+            str: session token if user exists, None otherwise
+        """
+        return await self._call("create_session", username)
+
+    async def validate_session(self, username: str, session_token: str):
+        """Validate session token and check expiry
+
+        Args:
+            username (str): username
+            session_token (str): session token
+
+        Returns:
+            bool: True if session is valid, False otherwise
+        """
+        return await self.validate_token(session_token) == username
+
+    async def validate_token(self, session_token: str):
+        """Validate a session token without knowing the user
+
+        Runs on the worker thread since a sliding renewal may write to storage.
+
+        Args:
+            session_token (str): session token
+
+        Returns:
+            str: username owning the session if it is valid, None otherwise
+        """
+        return await self._call("validate_token", session_token)
+
+    async def terminate_session(self, session_token: str):
+        """End a single session
+
+        Args:
+            session_token (str): session token
+
+        Returns:
+            bool: True if the session is terminated, False if it does not exist
+        """
+        return await self._call("terminate_session", session_token)
+
+
+class AsyncRBACManager(_AsyncManager):
+    """Async counterpart of RBACManager"""
+
+    def __init__(self, storage=None, events=None, metrics=None, feed=None):
+        """
+        Args:
+            storage (StorageBackend, optional): backend persisting the RBAC data
+            events (EventLog, optional): log recording the outcomes as structured events
+            metrics (Metrics, optional): registry the timed methods are recorded in
+            feed (ChangeFeed, optional): feed the policy changes are published to
+        """
+        super().__init__(lambda: RBACManager(storage, events, metrics, feed))
+
+    async def add_role(self, role: str):
+        """Add a new role to the system, see RBACManager.add_role"""
+        return await self._call("add_role", role)
+
+    async def remove_role(self, role: str):
+        """Remove a role from the system, see RBACManager.remove_role"""
+        return await self._call("remove_role", role)
+
+    async def add_permission(self, permission_name: str):
+        """Add a new permission to the system, see RBACManager.add_permission"""
+        return await self._call("add_permission", permission_name)
+
+    async def remove_permission(self, permission_name: str):
+        """Remove a permission from the system, see RBACManager.remove_permission"""
+        return await self._call("remove_permission", permission_name)
+
+    async def assign_role_to_user(self, username: str, role: str):
+        """Assign a specific role to a user, see RBACManager.assign_role_to_user"""
+        return await self._call("assign_role_to_user", username, role)
+
+    async def remove_role_from_user(self, username: str, role: str):
+        """Remove a role from a user, see RBACManager.remove_role_from_user"""
+        return await self._call("remove_role_from_user", username, role)
+
+    async def assign_permission_to_role(self, role: str, permission_name: str):
+        """Assign permission to specific role, see RBACManager.assign_permission_to_role"""
+        return await self._call("assign_permission_to_role", role, permission_name)
+
+    async def add_role_inheritance(self, role: str, inherited_role: str):
+        """Let a role inherit another role, see RBACManager.add_role_inheritance"""
+        return await self._call("add_role_inheritance", role, inherited_role)
+
+    async def remove_role_inheritance(self, role: str, inherited_role: str):
+        """Remove an inheritance between two roles, see RBACManager.remove_role_inheritance"""
+        return await self._call("remove_role_inheritance", role, inherited_role)
+
+    async def check_user_permission(self, username: str, permission_name: str):
+        """Check permission for specific user, answered on the loop without output
+
+        Args:
+            username (str): username
+            permission_name (str): permission name
+
+        Returns:
+            bool: True if the user has the permission, False otherwise
+        """
+        manager = await self._get_checked_manager()
+        return manager.check_many([(username, permission_name)], refresh=False)[0]
+
+    async def check_user_permissions(self, username: str, permission_names, require_all: bool = True):
+        """Check several permissions for a specific user, see RBACManager.check_user_permissions"""
+        manager = await self._get_checked_manager()
+        if username not in manager.data["users"]:
+            return False
+        return manager.check_user_permissions(username, permission_names, require_all, refresh=False)
+
+    async def check_many(self, pairs):
+        """Check a batch of (username, permission) pairs, see RBACManager.check_many"""
+        manager = await self._get_checked_manager()
+        return manager.check_many(pairs, refresh=False)
+
+    async def permissions_for_users(self, usernames):
+        """Resolve the effective permissions of several users, see RBACManager.permissions_for_users"""
+        manager = await self._get_checked_manager()
+        return manager.permissions_for_users(usernames, refresh=False)
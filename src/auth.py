@@ -7,54 +7,109 @@ registration, login, and logout.
 Classes:
     AuthManager:
         Manages user authentication and session handling.
+        User data is persisted through a storage backend (see storage.py),
+        a JSON file by default. Passwords are hashed with a salted,
+        tunable hasher (see hashing.py) on a bounded thread pool.
+        Failed logins are throttled per username and per source (see
+        throttle.py), locked out attempts are rejected before any hashing.
+        The manager can be shared between threads: writers are serialized
+        by a lock and replace whole records instead of changing them in
+        place, so readers never take a lock and never see half a change.
+        Outcomes are printed unless VERBOSE is off, and recorded as
+        structured events when an EventLog is given (see events.py).
+        Given a Metrics registry (see metrics.py), the methods listed in
+        METRICS_CHECKS and METRICS_TIMED are timed. Reporting, write
+        validation and the storage lifecycle come from BaseManager (see
+        manager.py).
 
 Functions:
     create_account(username: str, password: str, role='user') -> bool:
         Creates a new account for the user with the provided username, password, and role.
+
+    add_users(accounts) -> list:
+        Stores a batch of users with already hashed passwords in one storage call.
         
     verify_user(username: str, password: str) -> bool:
         Verifies the user's credentials.
         
-    login_user(username: str, password: str) -> bool:
+    login_user(username: str, password: str, source: str = None) -> bool:
         Authenticates a user and returns success or failure.
         
     logout_user(username: str) -> bool:
         Logs out the user by clearing the session token.
+
+    flush() -> None:
+        Makes sure every change made so far has been persisted.
+
+    close() -> None:
+        Persists pending changes and releases the storage backend.
+
+    rebalance(batch_size: int = 1000) -> int:
+        Moves a batch of records to their shard after a shard was added to a ShardedBackend.
 """
-import json
+import threading
 from datetime import datetime, timedelta, timezone
-from utils import hash_password
+from events import INFO, WARNING
+from hashing import ScryptHasher, default_pool, verify_password
+from manager import BaseManager
+from storage import JSONFileBackend, transactional
+from throttle import LoginThrottle
 
 AUTH_FILE = "data/auth_data.json"
-class AuthManager:
+class AuthManager(BaseManager):
     SESSION_DURATION = 300 # Session expires in 5 minutes (300 seconds)
+    METRICS_CHECKS = ("verify_user", "login_user") # Timed, falsy results counted as failures
+    METRICS_TIMED = ("_load_user_data", "_save_user_data") # Timed only
     
-    def __init__(self):
+    def __init__(self, storage=None, hasher=None, hash_pool=None, throttle=None, events=None, metrics=None):
+        """
+        Args:
+            storage (StorageBackend, optional): backend persisting the user data.
+                Defaults to a JSONFileBackend on AUTH_FILE.
+            hasher (PasswordHasher, optional): hasher for new and rehashed passwords.
+                Defaults to a ScryptHasher with its default cost.
+            hash_pool (HashingPool, optional): pool running the password hashing.
+                Defaults to the process wide pool.
+            throttle (LoginThrottle, optional): failed login counters.
+                Defaults to a LoginThrottle with its default limits.
+            events (EventLog, optional): log recording the outcomes as structured events.
+                Defaults to None, which records nothing.
+            metrics (Metrics, optional): registry the timed methods and storage writes are
+                recorded in. Defaults to None, which leaves the methods uninstrumented.
+        """
+        if storage is None:
+            storage = JSONFileBackend(AUTH_FILE, {"users": {}}) # Ensure users key exists
+        self.storage = storage
+        self.hasher = hasher if hasher is not None else ScryptHasher()
+        self.hash_pool = hash_pool if hash_pool is not None else default_pool()
+        self.throttle = throttle if throttle is not None else LoginThrottle()
+        self.events = events
+        self.metrics = metrics
+        if metrics is not None:
+            metrics.instrument(self, self.METRICS_CHECKS)
+            metrics.instrument(self, self.METRICS_TIMED, count_failures=False)
+            storage.attach_metrics(metrics)
+        self._lock = threading.RLock() # Serializes writers, see storage.transactional
         self.data = self._load_user_data()
         
     def _load_user_data(self):
-        """Load user data from JSON file
+        """Load user data from the storage backend
 
         Returns:
             dict: A dictionary containing user data.
         """
-        try:
-            with open(AUTH_FILE, 'r') as file:
-                return json.load(file)
-        except (FileNotFoundError, json.JSONDecodeError):
-            return {"users": {}} # Ensure users key exists
+        return self.storage.load()
         
-    def _save_user_data(self):
-        """Save user data to JSON file
+    def _save_user_data(self, username: str = None):
+        """Save user data through the storage backend
 
         Args:
-            data (dict): user data
-
-        Returns:
-            dict: contains all user data such as username, password, session token etc.
+            username (str, optional): only persist this user's record (deleted if it
+                no longer exists). Defaults to None, which persists the whole document.
         """
-        with open(AUTH_FILE, 'w') as file:
-            return json.dump(self.data, file, indent=4)
+        if username is None:
+            return self.storage.save(self.data)
+        return self.storage.put("users", username, self.data["users"].get(username))
 
     def create_account(self, username: str, password: str, role='user'):
         """Create new user with a hashed password
@@ -69,23 +124,81 @@ class AuthManager:
         """
         
         if username in self.data["users"]:
-            print(f"User {username} already exists.\nProvide a new username.")
+            self._report(f"User {username} already exists.\nProvide a new username.")
+            return False
+        
+        return self._add_user(username, self.hash_pool.run(self.hasher.hash, password), role)
+
+    @transactional
+    def _add_user(self, username: str, password_hash: str, role='user'):
+        """Store a new user whose password has already been hashed
+
+        Args:
+            username (str): username
+            password_hash (str): encoded password hash
+            role (str, optional): user role. Defaults to 'user'.
+
+        Returns:
+            bool: True if user doesn't exist, False if user already exist.
+        """
+        if username in self.data["users"]:
+            self._report(f"User {username} already exists.\nProvide a new username.")
             return False
         
-        self.data["users"][username] = {
-            "password": hash_password(password),
+        user = {
+            "password": password_hash,
             "role": role,
             "session_token": None, # Session token assigned only after login
             "expires_at": None
         }
+        if not self._check_record("users", username, user):
+            return False
         
-        self._save_user_data()
-        print(f"User '{username}' created successfully.")
+        self.data["users"][username] = user
+        self._save_user_data(username)
+        self._report(f"User '{username}' created successfully.", "user.created", username=username, role=role)
         return True
 
+    @transactional
+    def add_users(self, accounts):
+        """Store a batch of new users whose passwords have already been hashed
+
+        The whole batch is persisted with a single storage call and nothing
+        is printed, which is what bulk imports need.
+
+        Args:
+            accounts (iterable): (username, password_hash, role) tuples
+
+        Returns:
+            list: usernames stored, users that already exist or are invalid are skipped
+        """
+        added = []
+        for username, password_hash, role in accounts:
+            if username in self.data["users"]:
+                continue
+            user = {
+                "password": password_hash,
+                "role": role,
+                "session_token": None,
+                "expires_at": None
+            }
+            if not self._check_record("users", username, user, quiet=True):
+                continue
+            self.data["users"][username] = user
+            added.append(username)
+        if added:
+            self.storage.apply([("users", username, self.data["users"][username]) for username in added])
+            if self.events is not None:
+                self.events.emit("user.imported", INFO, count=len(added))
+        return added
+
     def verify_user(self, username: str, password: str):
         """Verify user credentials during login
 
+        Unknown users are rejected before any hashing is done. When the stored
+        hash was made with other settings than the current hasher (or is a
+        legacy unsalted hash), it is replaced after a successful verification.
+
         Args:
             username (str): user name
             password (str): password
@@ -93,34 +206,72 @@ class AuthManager:
         Returns:
             bool: True if the credentials are valid, False otherwise
         """
-        hashed_password = hash_password(password)
-        if username not in self.data['users']:
+        self._refresh_data()
+        user = self.data['users'].get(username)
+        if user is None:
             return False
         
-        return self.data['users'][username]['password'] == hashed_password
+        stored_password = user['password']
+        if not self.hash_pool.run(verify_password, password, stored_password):
+            return False
+        
+        if self.hasher.needs_rehash(stored_password):
+            self._replace_password_hash(username, stored_password, self.hash_pool.run(self.hasher.hash, password))
+        return True
+
+    @transactional
+    def _replace_password_hash(self, username: str, old_hash: str, new_hash: str):
+        """Store a rehashed password unless the password changed in the meantime
+
+        Args:
+            username (str): username
+            old_hash (str): hash the new one was verified against
+            new_hash (str): new encoded password hash
+        """
+        user = self.data['users'].get(username)
+        if user is not None and user['password'] == old_hash:
+            self.data['users'][username] = dict(user, password=new_hash)
+            self._save_user_data(username)
 
-    def login_user(self, username: str, password: str):
+    def login_user(self, username: str, password: str, source: str = None):
         """Authenticate user and return success or failure
 
+        Attempts for a locked out username or source are rejected before the
+        password is hashed, failures count towards the lockouts.
+
         Args:
             username (str): username
             password (str): password
+            source (str, optional): origin of the attempt, e.g. the client address. Defaults to None.
 
         Returns:
             bool: True if login is successful, False otherwise.
         """
+        retry_after = self.throttle.retry_after(username, source)
+        if retry_after:
+            self._report(f"Too many failed login attempts. Try again in {int(retry_after) + 1} seconds.",
+                         "login.failure", WARNING, username=username, source=source, reason="throttled")
+            return False
+        
+        self._refresh_data()
         
         if username not in self.data['users']:
-            print(f"User '{username}' not found")
+            self.throttle.record_failure(username, source)
+            self._report(f"User '{username}' not found", "login.failure", WARNING,
+                         username=username, source=source, reason="unknown_user")
             return False
         
         if not self.verify_user(username, password):
-            print(f"Invalid password.")
+            self.throttle.record_failure(username, source)
+            self._report(f"Invalid password.", "login.failure", WARNING,
+                         username=username, source=source, reason="password")
             return False
         
-        print(f"Login successful for user '{username}'.")
+        self.throttle.record_success(username)
+        self._report(f"Login successful for user '{username}'.", "login.success", username=username, source=source)
         return True
         
+    @transactional
     def logout_user(self, username: str):
         """Log out the user by clearing session token and resetting session duration.
 
@@ -132,11 +283,10 @@ class AuthManager:
         """
         
         if username in self.data['users']:
-            self.data['users'][username]['session_token'] = None
-            self.data['users'][username]['expires_at'] = None
-            self._save_user_data()
-            print(f"User '{username} logged out successfully.")
+            self.data['users'][username] = dict(self.data['users'][username], session_token=None, expires_at=None)
+            self._save_user_data(username)
+            self._report(f"User '{username} logged out successfully.", "logout", username=username)
             return True
             
-        print(f"User '{username}' not found.")
+        self._report(f"User '{username}' not found.")
         return False
\ No newline at end of file
@@ -0,0 +1,526 @@
+"""
+Benchmark suite and load generator for the auth/RBAC stack
+
+This module builds reproducible synthetic datasets and measures the
+throughput and latency distribution of the hot operations against them:
+
+    create_account, login_user, create_session, validate_session, check_user_permission
+
+A dataset is a directory holding an auth store, an RBAC store and a
+dataset.json manifest. Usernames, role and permission assignments are drawn
+from a seeded generator, so the same parameters give the same dataset.
+Records are streamed to the store as they are generated, which keeps building
+10 million users within memory with the mapped backend. Every user shares one
+password hash, made with the scrypt cost recorded in the manifest.
+
+Each operation is run in one or more modes:
+
+    single      one thread
+    threads     several threads sharing one pair of managers
+    processes   several processes, each loading its own managers from the store
+
+Every worker first prepares its inputs (e.g. the sessions validate_session
+checks) and warms up, then all workers start together and run for a fixed
+duration. Latencies are recorded in the fixed-memory histograms of
+metrics.py. The single and threads runs share one pair of managers, loaded
+once (the load time is reported), so caches filled by one run, such as the
+permission masks, stay warm for the next ones. Operations that write are
+only run in processes mode on stores that support several writing
+processes (shared), they are reported as skipped otherwise. Each run works
+on a scratch copy of the dataset, removed afterwards, so writes never
+change the dataset and every run starts from the same records.
+
+Results are plain JSON (environment, dataset, one row per operation and
+mode) so runs on different commits can be compared with compare_results.
+
+Functions:
+    build_dataset(directory, users, roles, permissions, ...) -> dict:
+        Generates a dataset and returns its manifest.
+    run_benchmarks(directory, operations, modes, workers, duration, ...) -> dict:
+        Runs the benchmarks against a dataset and returns the results.
+    compare_results(baseline, current, threshold) -> list:
+        Compares two results documents row by row.
+    save_results(results, path) / load_results(path):
+        Writes or reads a results document.
+"""
+import json
+import multiprocessing
+import os
+import platform
+import random
+import secrets
+import shutil
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+from datetime import datetime, timezone
+from hashing import ScryptHasher
+from metrics import Histogram
+from rbac import RBACManager
+from session import SessionManager
+from storage import JournalBackend, MappedFileBackend, SharedJournalBackend, SQLiteBackend
+
+DATASET_PASSWORD = "benchmark-password"
+MANIFEST_FILE = "dataset.json"
+OPERATIONS = ("create_account", "login_user", "create_session", "validate_session", "check_user_permission")
+WRITING_OPERATIONS = ("create_account", "create_session", "validate_session") # validate_session renews
+MODES = ("single", "threads", "processes")
+STORES = {"mapped": MappedFileBackend, "journal": JournalBackend, "shared": SharedJournalBackend,
+          "sqlite": SQLiteBackend}
+MULTI_PROCESS_STORES = ("shared",)
+SESSION_POOL = 1000 # Sessions created by each validate_session worker before measuring
+_EXTENSIONS = {"mapped": ".map", "journal": ".json", "shared": ".json", "sqlite": ".db"}
+_AUTH_DEFAULT = {"users": {}, "sessions": {}}
+_RBAC_DEFAULT = {"users": {}, "roles": {}, "permissions": {}, "role_inheritance": {}}
+
+
+def build_dataset(directory: str, users: int = 10000, roles: int = 200, permissions: int = 2000,
+                  permissions_per_role: int = 20, store: str = "mapped", seed: int = 0, scrypt_n: int = 2 ** 14):
+    """Generate a synthetic dataset
+
+    Roles get permissions_per_role random permissions each and inherit the
+    previous role in chains of ten. Users get a random auth role (mostly
+    "user") and one to three RBAC roles.
+
+    Args:
+        directory (str): directory to write the dataset to, created if needed
+        users (int, optional): number of users. Defaults to 10000.
+        roles (int, optional): number of RBAC roles. Defaults to 200.
+        permissions (int, optional): number of permissions. Defaults to 2000.
+        permissions_per_role (int, optional): permissions assigned to each role. Defaults to 20.
+        store (str, optional): storage backend, a key of STORES. Defaults to "mapped".
+        seed (int, optional): seed of the generator. Defaults to 0.
+        scrypt_n (int, optional): scrypt cost of the shared password hash. Defaults to 2 ** 14.
+
+    Returns:
+        dict: the manifest, also written to directory/dataset.json
+
+    Raises:
+        ValueError: if the store is unknown
+    """
+    if store not in STORES:
+        raise ValueError(f"Unknown store '{store}', expected one of {', '.join(STORES)}.")
+    os.makedirs(directory, exist_ok=True)
+    started = time.perf_counter()
+    password_hash = ScryptHasher(n=scrypt_n).hash(DATASET_PASSWORD)
+    permission_names = [_permission_name(index) for index in range(permissions)]
+    role_names = [_role_name(index) for index in range(roles)]
+
+    rng = random.Random(f"{seed}-roles")
+    role_records = {role: sorted(rng.sample(permission_names, min(permissions_per_role, permissions)))
+                    for role in role_names}
+    inheritance = {role_names[index]: [role_names[index - 1]] for index in range(roles) if index % 10}
+
+    def auth_users():
+        rng = random.Random(f"{seed}-auth")
+        for index in range(users):
+            draw = rng.random()
+            role = "admin" if draw < 0.01 else "guest" if draw < 0.1 else "user"
+            yield _username(index), {"password": password_hash, "role": role,
+                                     "session_token": None, "expires_at": None}
+
+    def rbac_users():
+        rng = random.Random(f"{seed}-rbac")
+        for index in range(users):
+            yield _username(index), sorted(rng.sample(role_names, min(rng.randint(1, 3), roles)))
+
+    manifest = {
+        "users": users, "roles": roles, "permissions": permissions,
+        "permissions_per_role": permissions_per_role, "store": store, "seed": seed, "scrypt_n": scrypt_n,
+        "auth_store": "auth_data" + _EXTENSIONS[store], "rbac_store": "rbac_data" + _EXTENSIONS[store],
+    }
+    _write_store(store, os.path.join(directory, manifest["auth_store"]),
+                 {"users": auth_users(), "sessions": iter(())})
+    _write_store(store, os.path.join(directory, manifest["rbac_store"]), {
+        "permissions": ((name, []) for name in permission_names),
+        "role_inheritance": iter(sorted(inheritance.items())),
+        "roles": iter(sorted(role_records.items())),
+        "users": rbac_users(),
+    })
+    manifest["build_seconds"] = round(time.perf_counter() - started, 3)
+    with open(os.path.join(directory, MANIFEST_FILE), 'w') as file:
+        json.dump(manifest, file, indent=4)
+    return manifest
+
+
+def run_benchmarks(directory: str, operations=OPERATIONS, modes=("single", "threads"), workers: int = 4,
+                   duration: float = 2.0, max_ops: int = None, warmup: float = 0.2):
+    """Run the benchmarks against a dataset
+
+    Args:
+        directory (str): dataset directory written by build_dataset
+        operations (iterable, optional): operations to run. Defaults to all of OPERATIONS.
+        modes (iterable, optional): modes to run them in. Defaults to ("single", "threads").
+        workers (int, optional): threads or processes in the multi-worker modes. Defaults to 4.
+        duration (float, optional): seconds each worker measures for. Defaults to 2.
+        max_ops (int, optional): operations after which a worker stops early. Defaults to None (no limit).
+        warmup (float, optional): seconds each worker runs unmeasured first. Defaults to 0.2.
+
+    Returns:
+        dict: "environment", "dataset" (the manifest plus load times) and "results", one row per
+            operation and mode with ops, seconds, throughput (ops per second) and the latency mean,
+            p50, p90, p99, p999 and max in seconds, or a "skipped" reason
+
+    Raises:
+        ValueError: if an operation or mode is unknown
+    """
+    for name, known in (("operation", OPERATIONS), ("mode", MODES)):
+        unknown = set(operations if name == "operation" else modes) - set(known)
+        if unknown:
+            raise ValueError(f"Unknown {name} '{sorted(unknown)[0]}', expected one of {', '.join(known)}.")
+    with open(os.path.join(directory, MANIFEST_FILE)) as file:
+        manifest = json.load(file)
+    run_id = secrets.token_hex(3)
+    dataset = dict(manifest)
+    # Writes go to a scratch copy next to the dataset, the dataset itself is never changed
+    parent = os.path.dirname(os.path.abspath(directory))
+    scratch = tempfile.mkdtemp(prefix=os.path.basename(os.path.abspath(directory)) + "-run-", dir=parent)
+    try:
+        shutil.copytree(directory, scratch, dirs_exist_ok=True)
+        rows = _run_operations(scratch, manifest, dataset, run_id, operations, modes, workers, duration,
+                               max_ops, warmup)
+    finally:
+        shutil.rmtree(scratch, ignore_errors=True)
+    return {"environment": _environment(), "dataset": dataset, "results": rows}
+
+
+def compare_results(baseline: dict, current: dict, threshold: float = 0.1):
+    """Compare two results documents row by row
+
+    Args:
+        baseline (dict): results of the reference run
+        current (dict): results of the run to check
+        threshold (float, optional): relative throughput drop or p99 rise reported as a
+            regression. Defaults to 0.1 (10%).
+
+    Returns:
+        list: one dict per row measured in both runs, with the operation, mode, workers,
+            throughput_change and p99_change (relative, e.g. -0.2 for 20% less) and regression
+    """
+    reference = {(row["operation"], row["mode"], row["workers"]): row
+                 for row in baseline["results"] if "skipped" not in row}
+    comparison = []
+    for row in current["results"]:
+        old = reference.get((row["operation"], row["mode"], row["workers"]))
+        if old is None or "skipped" in row:
+            continue
+        throughput_change = row["throughput"] / old["throughput"] - 1 if old["throughput"] else 0.0
+        p99_change = row["p99"] / old["p99"] - 1 if old["p99"] else 0.0
+        comparison.append({
+            "operation": row["operation"], "mode": row["mode"], "workers": row["workers"],
+            "throughput_change": round(throughput_change, 4), "p99_change": round(p99_change, 4),
+            "regression": throughput_change < -threshold or p99_change > threshold,
+        })
+    return comparison
+
+
+def save_results(results: dict, path: str):
+    """Write a results document
+
+    Args:
+        results (dict): document returned by run_benchmarks
+        path (str): JSON file path
+    """
+    directory = os.path.dirname(path)
+    if directory:
+        os.makedirs(directory, exist_ok=True)
+    with open(path, 'w') as file:
+        json.dump(results, file, indent=4)
+
+
+def load_results(path: str):
+    """Read a results document
+
+    Args:
+        path (str): JSON file path
+
+    Returns:
+        dict: the results document
+    """
+    with open(path) as file:
+        return json.load(file)
+
+
+def _run_operations(directory: str, manifest: dict, dataset: dict, run_id: str, operations, modes,
+                    workers: int, duration: float, max_ops: int, warmup: float):
+    """Run every operation in every mode against a scratch copy of a dataset
+
+    Args:
+        directory (str): scratch copy of the dataset
+        manifest (dict): dataset manifest
+        dataset (dict): dataset section of the results, the load time is added to it
+        run_id (str): suffix making the usernames created by this run unique
+        operations, modes, workers, duration, max_ops, warmup: see run_benchmarks
+
+    Returns:
+        list: one row per operation and mode, see run_benchmarks
+    """
+    managers = None
+    rows = []
+    for operation in operations:
+        for mode in modes:
+            count = 1 if mode == "single" else workers
+            row = {"operation": operation, "mode": mode, "workers": count}
+            if (mode == "processes" and operation in WRITING_OPERATIONS
+                    and manifest["store"] not in MULTI_PROCESS_STORES):
+                row["skipped"] = f"the {manifest['store']} store does not support several writing processes"
+                rows.append(row)
+                continue
+            spec = {"directory": directory, "manifest": manifest, "operation": operation, "run_id": run_id,
+                    "duration": duration, "max_ops": max_ops, "warmup": warmup}
+            if mode == "processes":
+                measurements = _run_processes(spec, count)
+            else:
+                if managers is None:
+                    started = time.perf_counter()
+                    managers = _open_managers(directory, manifest)
+                    dataset["load_seconds"] = round(time.perf_counter() - started, 3)
+                measurements = _run_threads(spec, managers, count)
+            row.update(_summarize(measurements))
+            rows.append(row)
+    if managers is not None:
+        for manager in managers:
+            manager.close()
+    return rows
+
+
+def _username(index: int):
+    return f"user{index:09d}" # Zero padded, so generation order is key order
+
+
+def _role_name(index: int):
+    return f"role{index:05d}"
+
+
+def _permission_name(index: int):
+    return f"perm{index:06d}"
+
+
+def _write_store(store: str, path: str, sections: dict):
+    """Stream generated sections into a new store
+
+    Args:
+        store (str): key of STORES
+        path (str): store path
+        sections (dict): section name mapped to an iterator of (key, record) tuples in key order
+    """
+    for stale_path in (path, path + ".journal", path + ".journal.old"):
+        if os.path.exists(stale_path):
+            os.remove(stale_path)
+    if store == "mapped":
+        MappedFileBackend.write_records(path, sections)
+    elif store == "sqlite":
+        backend = SQLiteBackend(path, {})
+        batch = []
+        for section, records in sections.items():
+            for key, record in records:
+                batch.append((section, key, record))
+                if len(batch) >= 10000:
+                    backend.apply(batch)
+                    batch = []
+        backend.apply(batch)
+        backend.close()
+    else:
+        # The JSON snapshot format, streamed instead of built as one document
+        with open(path + ".tmp", 'w') as file:
+            file.write("{")
+            for section_number, (section, records) in enumerate(sections.items()):
+                file.write((", " if section_number else "") + json.dumps(section) + ": {")
+                for record_number, (key, record) in enumerate(records):
+                    file.write((", " if record_number else "") + json.dumps(key) + ": " + json.dumps(record))
+                file.write("}")
+            file.write("}")
+        os.replace(path + ".tmp", path)
+
+
+def _open_managers(directory: str, manifest: dict):
+    """Open quiet managers on a dataset
+
+    Returns:
+        tuple: (SessionManager, RBACManager)
+    """
+    backend = STORES[manifest["store"]]
+    session_manager = SessionManager(backend(os.path.join(directory, manifest["auth_store"]), _AUTH_DEFAULT),
+                                     hasher=ScryptHasher(n=manifest["scrypt_n"]))
+    rbac_manager = RBACManager(backend(os.path.join(directory, manifest["rbac_store"]), _RBAC_DEFAULT))
+    session_manager.VERBOSE = rbac_manager.VERBOSE = False
+    return session_manager, rbac_manager
+
+
+def _prepare(spec: dict, managers: tuple, worker: int):
+    """Build the callable performing one operation with random inputs
+
+    Args:
+        spec (dict): benchmark specification, see run_benchmarks
+        managers (tuple): (SessionManager, RBACManager)
+        worker (int): worker number, seeds the inputs
+
+    Returns:
+        callable: performs one operation per call
+    """
+    session_manager, rbac_manager = managers
+    manifest = spec["manifest"]
+    operation = spec["operation"]
+    rng = random.Random(f"{manifest['seed']}-{operation}-{worker}")
+    users = manifest["users"]
+
+    def random_user():
+        return _username(rng.randrange(users))
+
+    if operation == "create_account":
+        counter = iter(range(sys.maxsize))
+        prefix = f"bench{spec['run_id']}w{worker}n"
+        return lambda: session_manager.create_account(f"{prefix}{next(counter)}", DATASET_PASSWORD)
+    if operation == "login_user":
+        return lambda: session_manager.login_user(random_user(), DATASET_PASSWORD)
+    if operation == "create_session":
+        return lambda: session_manager.create_session(random_user())
+    if operation == "validate_session":
+        pool = []
+        for _ in range(SESSION_POOL):
+            username = random_user()
+            pool.append((username, session_manager.create_session(username)))
+        return lambda: session_manager.validate_session(*rng.choice(pool))
+    permissions = manifest["permissions"]
+    return lambda: rbac_manager.check_user_permission(random_user(), _permission_name(rng.randrange(permissions)))
+
+
+def _measure(spec: dict, perform, start):
+    """Warm up, wait for the other workers, then run an operation for the configured duration
+
+    Args:
+        spec (dict): benchmark specification
+        perform (callable): performs one operation
+        start (callable): blocks until every worker is ready
+
+    Returns:
+        tuple: (operations, elapsed nanoseconds, latency Histogram)
+    """
+    clock = time.perf_counter_ns
+    deadline = clock() + int(spec["warmup"] * 1e9)
+    while clock() < deadline:
+        perform()
+    start()
+    histogram = Histogram()
+    record = histogram.record
+    max_ops = spec["max_ops"] or sys.maxsize
+    operations = 0
+    began = clock()
+    deadline = began + int(spec["duration"] * 1e9)
+    now = began
+    while now < deadline and operations < max_ops:
+        perform()
+        finished = clock()
+        record(finished - now)
+        now = finished
+        operations += 1
+    return operations, now - began, histogram
+
+
+def _run_threads(spec: dict, managers: tuple, count: int):
+    """Run an operation on threads sharing one pair of managers
+
+    Returns:
+        list: one (operations, elapsed nanoseconds, Histogram) tuple per thread
+    """
+    barrier = threading.Barrier(count)
+    measurements = [None] * count
+
+    def work(worker):
+        measurements[worker] = _measure(spec, _prepare(spec, managers, worker), barrier.wait)
+
+    threads = [threading.Thread(target=work, args=(worker,)) for worker in range(count)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    if None in measurements:
+        raise RuntimeError(f"A {spec['operation']} worker failed.")
+    return measurements
+
+
+def _run_processes(spec: dict, count: int):
+    """Run an operation in processes, each loading its own managers
+
+    Returns:
+        list: one (operations, elapsed nanoseconds, Histogram) tuple per process
+    """
+    context = multiprocessing.get_context("spawn") # No inherited storage threads or locks
+    barrier = context.Barrier(count)
+    results = context.Queue()
+    processes = [context.Process(target=_process_worker, args=(spec, worker, barrier, results))
+                 for worker in range(count)]
+    for process in processes:
+        process.start()
+    measurements = [results.get() for _ in processes]
+    for process in processes:
+        process.join()
+    if None in measurements:
+        raise RuntimeError(f"A {spec['operation']} worker process failed.")
+    histograms = []
+    for operations, elapsed, counts, total in measurements:
+        histogram = Histogram()
+        histogram.counts[:] = counts
+        histogram.total = total
+        histograms.append((operations, elapsed, histogram))
+    return histograms
+
+
+def _process_worker(spec: dict, worker: int, barrier, results):
+    """Entry point of a benchmark process, reports its measurement through the results queue"""
+    try:
+        managers = _open_managers(spec["directory"], spec["manifest"])
+        operations, elapsed, histogram = _measure(spec, _prepare(spec, managers, worker), barrier.wait)
+        for manager in managers:
+            manager.close()
+        results.put((operations, elapsed, histogram.counts, histogram.total))
+    except BaseException:
+        barrier.abort()
+        results.put(None)
+        raise
+
+
+def _summarize(measurements: list):
+    """Merge the measurements of the workers of one run
+
+    Returns:
+        dict: ops, seconds, throughput and latency statistics in seconds
+    """
+    histogram = Histogram()
+    operations = 0
+    elapsed = 0
+    for worker_operations, worker_elapsed, worker_histogram in measurements:
+        operations += worker_operations
+        elapsed = max(elapsed, worker_elapsed)
+        histogram.merge(worker_histogram)
+    summary = histogram.snapshot()
+    seconds = elapsed / 1e9
+    return {
+        "ops": operations,
+        "seconds": round(seconds, 6),
+        "throughput": round(operations / seconds, 3) if seconds else 0.0,
+        **{name: summary[name] for name in ("mean", "p50", "p90", "p99", "p999", "max")},
+    }
+
+
+def _environment():
+    """Describe the machine and code a run was made on
+
+    Returns:
+        dict: time, git commit (None outside a git checkout), Python version, platform and CPU count
+    """
+    try:
+        commit = subprocess.run(["git", "rev-parse", "HEAD"], capture_output=True, text=True, check=True,
+                                cwd=os.path.dirname(os.path.abspath(__file__))).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        commit = None
+    return {
+        "created_at": datetime.now(timezone.utc).isoformat(timespec="seconds"),
+        "commit": commit,
+        "python": platform.python_version(),
+        "implementation": platform.python_implementation(),
+        "platform": platform.platform(),
+        "cpu_count": os.cpu_count(),
+    }
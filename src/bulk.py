@@ -0,0 +1,181 @@
+"""
+Bulk user import and export
+
+This module streams user records between AuthManager and CSV or JSON Lines
+files without holding more than one batch in memory. Imports validate the
+records of a batch together, hash the passwords of the batch in parallel on
+the manager's HashingPool and store the batch with a single storage call.
+Exports stream the records from the storage backend and write each one as
+soon as it is read, while writers go on (see StorageBackend.iter_records).
+
+Records carry a username, a role and either a plain text "password" (hashed
+on import) or a "password_hash" already produced by this system (stored as
+is). Exports always write password_hash, so an export can be imported again.
+
+Functions:
+    read_users(file, file_format: str) -> iterator:
+        Reads (line number, record) pairs from a CSV or JSON Lines file.
+
+    write_users(records, file, file_format: str) -> int:
+        Writes records to a CSV or JSON Lines file as they are produced.
+
+    import_users(manager, records, batch_size: int = 1000) -> dict:
+        Validates, hashes and stores records in batches.
+
+    export_users(storage) -> iterator:
+        Yields the stored users as export records.
+"""
+import csv
+import json
+import string
+import sys
+from itertools import islice
+from hashing import HASHERS
+
+FORMATS = ("csv", "jsonl")
+
+
+def read_users(file, file_format: str):
+    """Read user records from a CSV or JSON Lines file
+
+    Args:
+        file: text file opened for reading
+        file_format (str): "csv" (with a header line) or "jsonl"
+
+    Returns:
+        iterator: (line number, record) tuples, record None for unreadable lines
+    """
+    if file_format == "csv":
+        reader = csv.DictReader(file)
+        for record in reader:
+            yield reader.line_num, record
+        return
+    for line_number, line in enumerate(file, 1):
+        if not line.strip():
+            continue
+        try:
+            record = json.loads(line)
+        except ValueError:
+            record = None
+        yield line_number, record if isinstance(record, dict) else None
+
+
+def write_users(records, file, file_format: str):
+    """Write user records to a CSV or JSON Lines file
+
+    Args:
+        records (iterable): export records, see export_users
+        file: text file opened for writing
+        file_format (str): "csv" or "jsonl"
+
+    Returns:
+        int: number of records written
+    """
+    count = 0
+    if file_format == "csv":
+        writer = csv.DictWriter(file, fieldnames=("username", "password_hash", "role"))
+        writer.writeheader()
+        for record in records:
+            writer.writerow(record)
+            count += 1
+        return count
+    for record in records:
+        file.write(json.dumps(record) + "\n")
+        count += 1
+    return count
+
+
+def import_users(manager, records, batch_size: int = 1000):
+    """Validate, hash and store user records in batches
+
+    Invalid records are reported and skipped, as are users that already exist
+    or whose stored record is rejected by the schema (see AuthManager.add_users).
+
+    Args:
+        manager (AuthManager): manager storing the users
+        records (iterable): (line number, record) tuples, see read_users
+        batch_size (int, optional): records validated, hashed and stored together. Defaults to 1000.
+
+    Returns:
+        dict: number of records "imported", "skipped" (existing or rejected users) and "invalid"
+    """
+    summary = {"imported": 0, "skipped": 0, "invalid": 0}
+    records = iter(records)
+    while True:
+        batch = list(islice(records, batch_size))
+        if not batch:
+            return summary
+        accounts = []
+        seen = set()
+        for line_number, record in batch:
+            error = _validate_record(record)
+            if error is not None:
+                print(f"Line {line_number}: {error}, skipped.", file=sys.stderr)
+                summary["invalid"] += 1
+                continue
+            username = record["username"]
+            if username in seen or username in manager.data["users"]:
+                summary["skipped"] += 1
+                continue
+            seen.add(username)
+            password_hash = record.get("password_hash") or manager.hash_pool.submit(manager.hasher.hash, record["password"])
+            accounts.append((username, password_hash, record.get("role") or "user"))
+        accounts = [(username, password_hash if isinstance(password_hash, str) else password_hash.result(), role)
+                    for username, password_hash, role in accounts]
+        added = manager.add_users(accounts)
+        summary["imported"] += len(added)
+        summary["skipped"] += len(accounts) - len(added)
+
+
+def export_users(storage):
+    """Yield the stored users as export records
+
+    Args:
+        storage (StorageBackend): backend holding the users, e.g. an AuthManager's storage
+
+    Returns:
+        iterator: dicts with "username", "password_hash" and "role"
+    """
+    for username, user in storage.iter_records("users"):
+        yield {"username": username, "password_hash": user["password"], "role": user.get("role", "user")}
+
+
+def _validate_record(record):
+    """Check an import record
+
+    Args:
+        record (dict): import record, None for an unreadable line
+
+    Returns:
+        str: description of the problem, None if the record is valid
+    """
+    if record is None:
+        return "unreadable record"
+    username = record.get("username")
+    if not isinstance(username, str) or not username.strip():
+        return "missing username"
+    password, password_hash = record.get("password"), record.get("password_hash")
+    if bool(password) == bool(password_hash):
+        return "exactly one of password and password_hash is required"
+    if not isinstance(password or password_hash, str):
+        return "password must be a string"
+    if password_hash and not _is_password_hash(password_hash):
+        return "password_hash is not a hash produced by this system"
+    role = record.get("role")
+    if role is not None and not isinstance(role, str):
+        return "role must be a string"
+    return None
+
+
+def _is_password_hash(value: str):
+    """Check that a value is an encoded hash verify_password understands
+
+    Args:
+        value (str): candidate password hash
+
+    Returns:
+        bool: True for an encoded hash of a supported algorithm or a legacy SHA-256 hex digest
+    """
+    if "$" in value:
+        return value.split("$", 1)[0] in HASHERS and value.count("$") == 3
+    return len(value) == 64 and all(character in string.hexdigits for character in value)
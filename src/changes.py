@@ -0,0 +1,214 @@
+"""
+Policy change feed for remote permission caches
+
+RBACManager numbers every change of the policy (roles, permissions,
+assignments, inheritance) with a monotonically increasing policy version
+stored with the RBAC data, and publishes it to a ChangeFeed as a change entry:
+
+    {"version": 42, "ts": 1700000000.123, "change": "permission.assigned",
+     "users": [], "roles": ["editor", "admin"], "permissions": ["edit"], "full": false}
+
+"roles" lists the roles whose effective permissions changed, the inheriting
+roles included, "users" the users whose own roles or permissions changed.
+A cache keyed by user drops the entries of those users and of the users
+holding one of those roles, and keeps everything else for as long as it
+likes. "full" asks to drop everything: the policy was reloaded as a whole,
+or the consumer fell too far behind for the feed to tell what changed.
+
+A feed is consumed by registering a callback, by iterating over changes
+(blocking until new ones arrive), or by following the JSONL change file with
+tail_changes from any process. Processes sharing an RBAC store may share the
+change file, each appends the changes it makes while holding the store's
+write lock, so the file stays in version order.
+
+Classes:
+    ChangeFeed:
+        Bounded history of change entries with callbacks, blocking iteration
+        and an optional JSONL change file.
+
+Functions:
+    tail_changes(path: str, since: int = 0, timeout: float = None, poll_interval: float = 0.1) -> iterator:
+        Follows a change file, yielding the entries newer than a version.
+"""
+import json
+import os
+import threading
+import time
+from collections import deque
+
+
+class ChangeFeed:
+    """Bounded history of change entries with callbacks, blocking iteration and an optional change file
+
+    Safe to share between threads. Entries are published in version order by
+    the manager holding its writer lock.
+    """
+
+    def __init__(self, path: str = None, history: int = 10000):
+        """
+        Args:
+            path (str, optional): JSONL file every published entry is appended to. Defaults to None,
+                which keeps the entries in memory only.
+            history (int, optional): entries kept in memory for iterators catching up. Defaults to 10000.
+        """
+        self.path = path
+        self.version = 0 # version of the last entry published
+        self.callback_errors = 0 # exceptions raised by subscribers, which never fail the change
+        self._history = deque(maxlen=history)
+        self._floor = 0 # changes up to this version are not in the history
+        self._subscribers = {}
+        self._next_subscription = 0
+        self._condition = threading.Condition()
+        self._file = None
+        if path is not None:
+            directory = os.path.dirname(path)
+            if directory:
+                os.makedirs(directory, exist_ok=True)
+            self._file = open(path, 'a', encoding='utf-8')
+
+    def rebase(self, version: int):
+        """Start the history at a version, consumers behind it are told to drop everything
+
+        Args:
+            version (int): current policy version
+        """
+        with self._condition:
+            if version > self.version:
+                self._history.clear()
+                self._floor = self.version = version
+
+    def publish(self, entry: dict, local: bool = True):
+        """Record an entry, append it to the change file and call the subscribers
+
+        Args:
+            entry (dict): change entry, see the module docstring
+            local (bool, optional): False for changes made by another process, which are
+                not written to the change file since that process writes them. Defaults to True.
+        """
+        with self._condition:
+            if len(self._history) == self._history.maxlen:
+                self._floor = self._history[0]["version"]
+            self._history.append(entry)
+            self.version = max(self.version, entry["version"])
+            if local and self._file is not None:
+                self._file.write(json.dumps(entry) + "\n")
+                self._file.flush()
+            self._condition.notify_all()
+            subscribers = list(self._subscribers.values())
+        for callback, predicate in subscribers:
+            if predicate is None or predicate(entry):
+                try:
+                    callback(entry)
+                except Exception:
+                    self.callback_errors += 1
+
+    def subscribe(self, callback, predicate=None):
+        """Call a function with every new entry
+
+        Args:
+            callback (callable): function receiving the entry, called by the writer
+                after the change is stored, it should return quickly
+            predicate (callable, optional): function telling whether an entry is of interest.
+                Defaults to every entry.
+
+        Returns:
+            int: subscription id, see unsubscribe
+        """
+        with self._condition:
+            subscription = self._next_subscription
+            self._next_subscription += 1
+            self._subscribers[subscription] = (callback, predicate)
+        return subscription
+
+    def unsubscribe(self, subscription: int):
+        """Stop calling a subscriber
+
+        Args:
+            subscription (int): id returned by subscribe
+
+        Returns:
+            bool: True if the subscription existed
+        """
+        with self._condition:
+            return self._subscribers.pop(subscription, None) is not None
+
+    def changes(self, since: int = None, predicate=None, timeout: float = None):
+        """Iterate over the entries newer than a version, waiting for new ones
+
+        A consumer whose version is older than the history gets a "policy.reset"
+        entry asking it to drop everything, then the history.
+
+        Args:
+            since (int, optional): last version the consumer has seen. Defaults to the current version.
+            predicate (callable, optional): function telling whether an entry is of interest.
+                Defaults to every entry.
+            timeout (float, optional): seconds to wait for a new entry before stopping.
+                Defaults to None, which waits forever.
+
+        Yields:
+            dict: change entries in version order
+        """
+        if since is None:
+            since = self.version
+        while True:
+            with self._condition:
+                if since < self._floor:
+                    pending = [_reset_entry(self._floor)]
+                else:
+                    pending = [entry for entry in self._history if entry["version"] > since]
+                if not pending:
+                    if not self._condition.wait_for(lambda: self.version > since, timeout):
+                        return
+                    continue
+            for entry in pending:
+                since = max(since, entry["version"])
+                if predicate is None or predicate(entry):
+                    yield entry
+
+    def close(self):
+        """Close the change file"""
+        with self._condition:
+            if self._file is not None:
+                self._file.close()
+                self._file = None
+
+
+def tail_changes(path: str, since: int = 0, timeout: float = None, poll_interval: float = 0.1):
+    """Follow a change file, yielding the entries newer than a version
+
+    Args:
+        path (str): JSONL change file written by a ChangeFeed
+        since (int, optional): last version the consumer has seen. Defaults to 0.
+        timeout (float, optional): seconds without a new entry before stopping.
+            Defaults to None, which follows the file forever.
+        poll_interval (float, optional): seconds between reads at the end of the file. Defaults to 0.1.
+
+    Yields:
+        dict: change entries in version order
+    """
+    offset = 0
+    idle_since = time.monotonic()
+    while True:
+        try:
+            with open(path, 'rb') as file:
+                file.seek(offset)
+                content = file.read()
+        except FileNotFoundError:
+            content = b""
+        lines = content.split(b"\n")
+        for line in lines[:-1]: # The last piece has no newline yet
+            offset += len(line) + 1
+            entry = json.loads(line)
+            if entry["version"] > since:
+                since = entry["version"]
+                idle_since = time.monotonic()
+                yield entry
+        if timeout is not None and time.monotonic() - idle_since >= timeout:
+            return
+        time.sleep(poll_interval)
+
+
+def _reset_entry(version: int):
+    """Build the entry telling a consumer to drop everything up to a version"""
+    return {"version": version, "ts": round(time.time(), 6), "change": "policy.reset",
+            "users": [], "roles": [], "permissions": [], "full": True}
@@ -0,0 +1,149 @@
+"""
+Structured audit and event log
+
+Managers report outcomes (logins, sessions, role and permission changes,
+permission checks) as events to an EventLog. emit only checks the level and
+the sampling rate and appends the event to a bounded in-memory queue, so it
+never does I/O and never blocks: when the queue is full the event is dropped
+and counted. A background thread drains the queue in batches and appends
+them to a JSONL file, one JSON object per line:
+
+    {"ts": 1700000000.123, "level": "INFO", "event": "login.failure", "username": "alice", "reason": "password"}
+
+Pending events are written by flush, close and at interpreter exit.
+
+Classes:
+    EventLog:
+        Bounded, sampled event queue drained to a JSONL file by a background writer.
+
+Constants:
+    DEBUG, INFO, WARNING: event levels, the values of the logging module levels.
+"""
+import atexit
+import json
+import logging
+import os
+import random
+import threading
+import time
+from collections import deque
+
+DEBUG = logging.DEBUG
+INFO = logging.INFO
+WARNING = logging.WARNING
+
+EVENT_FILE = 'data/events.jsonl'
+
+
+class EventLog:
+    """Bounded, sampled event queue drained to a JSONL file by a background writer
+
+    Safe to share between threads and managers.
+    """
+
+    def __init__(self, path: str = EVENT_FILE, level: int = INFO, sample: dict = None,
+                 max_queue: int = 10000, batch_size: int = 512, flush_interval: float = 1.0):
+        """
+        Args:
+            path (str, optional): JSONL file the events are appended to. Defaults to EVENT_FILE.
+            level (int, optional): lowest level recorded. Defaults to INFO.
+            sample (dict, optional): event name mapped to the fraction of those events recorded,
+                e.g. {"permission.granted": 0.01}. Defaults to recording every event.
+            max_queue (int, optional): events held in memory before new ones are dropped. Defaults to 10000.
+            batch_size (int, optional): queued events waking the writer early. Defaults to 512.
+            flush_interval (float, optional): longest time in seconds an event waits for the writer.
+                Defaults to 1.
+        """
+        self.path = path
+        self.level = level
+        self.sample = dict(sample or {})
+        self.max_queue = max_queue
+        self.batch_size = batch_size
+        self.flush_interval = flush_interval
+        self.dropped = 0 # events lost to a full queue
+        self.written = 0
+        self._queue = deque()
+        self._wakeup = threading.Event()
+        self._write_lock = threading.Lock() # Serializes draining between the writer and flush
+        self._closed = False
+        directory = os.path.dirname(path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+        self._file = open(path, 'a', encoding='utf-8')
+        self._writer = threading.Thread(target=self._run, daemon=True)
+        self._writer.start()
+        atexit.register(self.close)
+
+    def enabled(self, level: int):
+        """Tell whether events of a level are recorded, lets callers skip building costly fields
+
+        Args:
+            level (int): event level
+
+        Returns:
+            bool: True if the level is recorded
+        """
+        return level >= self.level and not self._closed
+
+    def emit(self, event: str, level: int = INFO, **fields):
+        """Queue an event without blocking
+
+        Args:
+            event (str): event name, e.g. "login.success"
+            level (int, optional): event level. Defaults to INFO.
+            **fields: JSON serializable details of the event
+
+        Returns:
+            bool: True if the event was queued, False if it was filtered, sampled out or dropped
+        """
+        if level < self.level or self._closed:
+            return False
+        rate = self.sample.get(event)
+        if rate is not None and random.random() >= rate:
+            return False
+        if len(self._queue) >= self.max_queue:
+            self.dropped += 1
+            return False
+        # Serialized by the writer, the hot path only stores a tuple
+        self._queue.append((time.time(), level, event, fields))
+        if len(self._queue) >= self.batch_size:
+            self._wakeup.set()
+        return True
+
+    def flush(self):
+        """Write every queued event now"""
+        with self._write_lock:
+            self._drain()
+
+    def close(self):
+        """Write the queued events, stop the writer and close the file"""
+        if self._closed:
+            return
+        self._closed = True
+        self._wakeup.set()
+        self._writer.join()
+        self.flush()
+        self._file.close()
+        atexit.unregister(self.close)
+
+    def _run(self):
+        """Writer thread: drain the queue every flush_interval, or sooner once a batch is queued"""
+        while not self._closed:
+            self._wakeup.wait(self.flush_interval)
+            self._wakeup.clear()
+            with self._write_lock:
+                self._drain()
+
+    def _drain(self):
+        """Append the queued events to the file in batches, the caller holds the write lock"""
+        queue = self._queue
+        while queue:
+            lines = []
+            while queue and len(lines) < self.batch_size:
+                timestamp, level, event, fields = queue.popleft()
+                record = {"ts": round(timestamp, 6), "level": logging.getLevelName(level), "event": event}
+                record.update(fields)
+                lines.append(json.dumps(record, default=str) + "\n")
+            self._file.write("".join(lines))
+            self.written += len(lines)
+        self._file.flush()
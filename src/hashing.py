@@ -0,0 +1,288 @@
+"""
+Password hashing (salted, tunable, memory-hard)
+
+This module provides pluggable password hashers built on hashlib. Every
+hash is stored as a single self-describing string holding the algorithm,
+its cost parameters, the salt and the derived key, so the parameters can be
+changed at any time and old hashes still verify.
+
+    scrypt$n=16384,r=8,p=1$<salt>$<key>
+    pbkdf2_sha256$600000$<salt>$<key>
+
+Unsalted SHA-256 hex digests written by utils.hash_password are still
+accepted for verification, and are replaced on the next successful login.
+
+Classes:
+    PasswordHasher:
+        Base interface shared by all hashers.
+    ScryptHasher:
+        Memory-hard scrypt hasher (the default).
+    PBKDF2Hasher:
+        PBKDF2-HMAC-SHA256 hasher.
+    HashingPool:
+        Bounded thread pool the password hashing is offloaded to.
+
+Functions:
+    verify_password(password: str, encoded: str) -> bool:
+        Verifies a password against a stored hash of any supported algorithm.
+
+    default_pool() -> HashingPool:
+        Returns the process wide hashing pool.
+"""
+import base64
+import hashlib
+import hmac
+import os
+import secrets
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from utils import hash_password
+
+
+class PasswordHasher:
+    """Base interface for password hashers
+
+    Subclasses set algorithm and implement hash, _derive and _parameters.
+    """
+    algorithm = None
+    SALT_BYTES = 16
+
+    def hash(self, password: str):
+        """Hash a password with a fresh random salt
+
+        Args:
+            password (str): plain text password
+
+        Returns:
+            str: encoded hash holding the algorithm, parameters, salt and key
+        """
+        raise NotImplementedError
+
+    def verify(self, password: str, encoded: str):
+        """Verify a password against a hash produced by this algorithm
+
+        Args:
+            password (str): plain text password
+            encoded (str): stored hash
+
+        Returns:
+            bool: True if the password matches, False otherwise
+        """
+        try:
+            _, parameters, salt, key = encoded.split("$")
+            expected = _b64decode(key)
+            derived = self._derive(password, _b64decode(salt), parameters, len(expected))
+        except (ValueError, KeyError):
+            return False
+        return hmac.compare_digest(derived, expected)
+
+    def needs_rehash(self, encoded: str):
+        """Check whether a stored hash was made with other settings than this hasher's
+
+        Args:
+            encoded (str): stored hash
+
+        Returns:
+            bool: True if the hash should be replaced, False otherwise
+        """
+        parts = encoded.split("$")
+        return len(parts) != 4 or parts[0] != self.algorithm or parts[1] != self._parameters()
+
+    def _parameters(self):
+        """Encode the cost parameters of this hasher
+
+        Returns:
+            str: the parameter field of the encoded hash
+        """
+        raise NotImplementedError
+
+    def _derive(self, password: str, salt: bytes, parameters: str, length: int):
+        """Derive a key with the parameters read from a stored hash
+
+        Args:
+            password (str): plain text password
+            salt (bytes): salt
+            parameters (str): parameter field of the encoded hash
+            length (int): key length in bytes
+
+        Returns:
+            bytes: derived key
+        """
+        raise NotImplementedError
+
+    def _encode(self, salt: bytes, key: bytes):
+        """Build the stored representation of a hash
+
+        Args:
+            salt (bytes): salt
+            key (bytes): derived key
+
+        Returns:
+            str: encoded hash
+        """
+        return "$".join((self.algorithm, self._parameters(), _b64encode(salt), _b64encode(key)))
+
+
+class ScryptHasher(PasswordHasher):
+    """Memory-hard scrypt hasher
+
+    The defaults cost about 16 MiB and a few tens of milliseconds per hash.
+    """
+    algorithm = "scrypt"
+
+    def __init__(self, n: int = 2 ** 14, r: int = 8, p: int = 1, key_length: int = 32):
+        """
+        Args:
+            n (int, optional): CPU/memory cost, a power of two. Defaults to 2 ** 14.
+            r (int, optional): block size. Defaults to 8.
+            p (int, optional): parallelization. Defaults to 1.
+            key_length (int, optional): derived key length in bytes. Defaults to 32.
+        """
+        self.n = n
+        self.r = r
+        self.p = p
+        self.key_length = key_length
+
+    def hash(self, password: str):
+        salt = secrets.token_bytes(self.SALT_BYTES)
+        key = _scrypt(password, salt, self.n, self.r, self.p, self.key_length)
+        return self._encode(salt, key)
+
+    def _parameters(self):
+        return f"n={self.n},r={self.r},p={self.p}"
+
+    def _derive(self, password: str, salt: bytes, parameters: str, length: int):
+        values = dict(item.split("=") for item in parameters.split(","))
+        return _scrypt(password, salt, int(values["n"]), int(values["r"]), int(values["p"]), length)
+
+
+class PBKDF2Hasher(PasswordHasher):
+    """PBKDF2-HMAC-SHA256 hasher"""
+    algorithm = "pbkdf2_sha256"
+
+    def __init__(self, iterations: int = 600000, key_length: int = 32):
+        """
+        Args:
+            iterations (int, optional): number of iterations. Defaults to 600000.
+            key_length (int, optional): derived key length in bytes. Defaults to 32.
+        """
+        self.iterations = iterations
+        self.key_length = key_length
+
+    def hash(self, password: str):
+        salt = secrets.token_bytes(self.SALT_BYTES)
+        key = hashlib.pbkdf2_hmac("sha256", password.encode(), salt, self.iterations, self.key_length)
+        return self._encode(salt, key)
+
+    def _parameters(self):
+        return str(self.iterations)
+
+    def _derive(self, password: str, salt: bytes, parameters: str, length: int):
+        return hashlib.pbkdf2_hmac("sha256", password.encode(), salt, int(parameters), length)
+
+
+HASHERS = {hasher.algorithm: hasher for hasher in (ScryptHasher, PBKDF2Hasher)}
+
+
+def verify_password(password: str, encoded: str):
+    """Verify a password against a stored hash of any supported algorithm
+
+    Args:
+        password (str): plain text password
+        encoded (str): stored hash, or a legacy unsalted SHA-256 hex digest
+
+    Returns:
+        bool: True if the password matches, False otherwise
+    """
+    if not encoded:
+        return False
+    algorithm = encoded.split("$", 1)[0]
+    if algorithm in HASHERS:
+        return HASHERS[algorithm]().verify(password, encoded)
+    if "$" not in encoded:
+        return hmac.compare_digest(hash_password(password), encoded)
+    return False
+
+
+class HashingPool:
+    """Bounded thread pool for password hashing
+
+    hashlib releases the GIL while running scrypt and PBKDF2, so a burst of
+    logins is spread over every core while the number of hashes running at
+    once (and the memory scrypt needs for them) stays bounded.
+    """
+
+    def __init__(self, max_workers: int = None):
+        """
+        Args:
+            max_workers (int, optional): number of worker threads. Defaults to the CPU count.
+        """
+        self.executor = ThreadPoolExecutor(max_workers=max_workers or os.cpu_count() or 1,
+                                           thread_name_prefix="password-hashing")
+
+    def submit(self, function, *args):
+        """Schedule a hashing call on the pool
+
+        Args:
+            function (callable): function to run, e.g. hasher.hash or verify_password
+            *args: arguments of the function
+
+        Returns:
+            concurrent.futures.Future: future resolving to the function's result
+        """
+        return self.executor.submit(function, *args)
+
+    def run(self, function, *args):
+        """Run a hashing call on the pool and wait for its result
+
+        Args:
+            function (callable): function to run
+            *args: arguments of the function
+
+        Returns:
+            the function's result
+        """
+        return self.submit(function, *args).result()
+
+    def shutdown(self, wait: bool = True):
+        """Stop the worker threads
+
+        Args:
+            wait (bool, optional): wait for running hashes to finish. Defaults to True.
+        """
+        self.executor.shutdown(wait=wait)
+
+
+_default_pool = None
+_default_pool_lock = threading.Lock()
+
+
+def default_pool():
+    """Get the process wide hashing pool, creating it on first use
+
+    Returns:
+        HashingPool: shared pool sized to the CPU count
+    """
+    global _default_pool
+    with _default_pool_lock:
+        if _default_pool is None:
+            _default_pool = HashingPool()
+        return _default_pool
+
+
+def _scrypt(password: str, salt: bytes, n: int, r: int, p: int, length: int):
+    """Run scrypt with enough memory allowed for the given parameters
+
+    Returns:
+        bytes: derived key
+    """
+    return hashlib.scrypt(password.encode(), salt=salt, n=n, r=r, p=p, dklen=length,
+                          maxmem=256 * n * r * p + 1024 * 1024)
+
+
+def _b64encode(value: bytes):
+    return base64.b64encode(value).decode().rstrip("=")
+
+
+def _b64decode(value: str):
+    return base64.b64decode(value + "=" * (-len(value) % 4))
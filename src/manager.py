@@ -0,0 +1,91 @@
+"""
+Shared plumbing of the managers
+
+Classes:
+    BaseManager:
+        Base class of AuthManager and RBACManager: console and event
+        reporting, write validation, refreshing from other processes and the
+        storage lifecycle (flush, close, rebalance).
+"""
+from events import INFO, WARNING
+from storage import transactional
+from utils import validate_records
+
+
+class BaseManager:
+    """Base class of the managers
+
+    Subclasses set self.storage (a StorageBackend), self.events (an EventLog
+    or None) and self._lock (a threading.RLock serializing their writers).
+    """
+    VALIDATE_WRITES = True # Check new records against schema.json before storing them
+    VERBOSE = True # Print outcomes to the console
+
+    def _refresh_data(self):
+        """Pick up changes made by other processes
+
+        The writer lock is only taken when the backend has a refresh due, so
+        the indexes updated by the storage listeners change under the lock.
+        """
+        if self.storage.refresh_due():
+            with self._lock:
+                self.storage.refresh()
+
+    def _check_record(self, section: str, key: str, record, quiet: bool = False):
+        """Validate a record about to be stored against the schema
+
+        Args:
+            section (str): document section, e.g. "users"
+            key (str): record key
+            record: record to store
+            quiet (bool, optional): only record an invalid record as an event, never print it.
+                Defaults to False.
+
+        Returns:
+            bool: True if the record is valid or validation is disabled, False otherwise
+        """
+        if not self.VALIDATE_WRITES:
+            return True
+        valid, message = validate_records(section, {key: record})
+        if not valid:
+            if quiet:
+                if self.events is not None:
+                    self.events.emit("record.invalid", WARNING, section=section, key=key, error=message)
+            else:
+                self._report(f"Invalid {section} record '{key}'. {message}", "record.invalid", WARNING,
+                             section=section, key=key, error=message)
+        return valid
+
+    def _report(self, message: str, event: str = None, level: int = INFO, **fields):
+        """Print an outcome and record it as an event
+
+        Args:
+            message (str): console message, printed when VERBOSE is set
+            event (str, optional): event name. Defaults to None, which only prints.
+            level (int, optional): event level. Defaults to INFO.
+            **fields: details of the event
+        """
+        if self.VERBOSE:
+            print(message)
+        if event is not None and self.events is not None:
+            self.events.emit(event, level, **fields)
+
+    def flush(self):
+        """Make sure every change made so far has been persisted"""
+        self.storage.flush()
+
+    def close(self):
+        """Persist pending changes and release the storage backend"""
+        self.storage.close()
+
+    @transactional
+    def rebalance(self, batch_size: int = 1000):
+        """Move a batch of records to the shard owning them after a shard was added, see ShardedBackend
+
+        Args:
+            batch_size (int, optional): records moved at most. Defaults to 1000.
+
+        Returns:
+            int: records moved, 0 once the store is balanced
+        """
+        return self.storage.rebalance(batch_size)
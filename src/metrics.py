@@ -0,0 +1,356 @@
+"""
+Built-in metrics: counters, latency and size histograms, cache hit ratios
+
+Instrumentation is opt-in. A manager given a Metrics registry replaces the
+methods listed in its METRICS attribute with timing wrappers on that one
+instance, and its storage backend reports the size of what it writes.
+Managers built without a registry are left untouched, so disabled metrics
+cost nothing.
+
+Each timed method gets a latency histogram (its count is the number of
+calls returning) and a counter of calls raising an exception. Checks also count the
+calls returning a falsy result (failed logins, invalid sessions, denied
+permissions).
+
+Histograms are log-linear like HDR histograms: values are grouped by power of
+two with 8 linear sub-buckets each, so quantiles are reported within 12.5%
+in a fixed array of counts however many values are recorded. Recording a
+value only increments its bucket and the running sum, the count and the
+maximum are derived from the buckets when read.
+
+Updates take no lock: with several threads an increment is lost on the rare
+thread switch in the middle of it, which is accepted for monitoring data.
+
+Classes:
+    Histogram:
+        Fixed-memory log-linear histogram of non-negative integers.
+    Counter:
+        Monotonic counter.
+    Metrics:
+        Registry of counters, histograms and caches with a snapshot API and a
+        Prometheus text format dump.
+"""
+import threading
+import time
+
+_SUB_BITS = 3 # 8 sub-buckets per power of two
+_SUB_BUCKETS = 1 << _SUB_BITS
+_BUCKETS = (64 - _SUB_BITS + 1) << _SUB_BITS # Enough for any 64-bit value
+
+
+class Histogram:
+    """Fixed-memory log-linear histogram of non-negative integers
+
+    Values are recorded as integers (nanoseconds, bytes) and reported
+    multiplied by scale (e.g. 1e-9 to report seconds).
+    """
+    __slots__ = ("unit", "scale", "bounds", "counts", "total")
+
+    def __init__(self, unit: str = "seconds", scale: float = 1e-9, bounds: tuple = (10, 36)):
+        """
+        Args:
+            unit (str, optional): unit of the reported values. Defaults to "seconds".
+            scale (float, optional): factor converting recorded integers to the unit. Defaults to 1e-9.
+            bounds (tuple, optional): lowest and highest power of two used as Prometheus bucket
+                boundaries, in recorded units. Defaults to 2**10 (about 1 microsecond) to 2**36
+                (about 69 seconds) nanoseconds.
+        """
+        self.unit = unit
+        self.scale = scale
+        self.bounds = bounds
+        self.counts = [0] * _BUCKETS
+        self.total = 0
+
+    @property
+    def count(self):
+        """int: number of recorded values"""
+        return sum(self.counts)
+
+    @property
+    def max(self):
+        """int: largest value the highest non-empty bucket can hold, 0 if empty"""
+        for index in range(_BUCKETS - 1, -1, -1):
+            if self.counts[index]:
+                return _upper_bound(index)
+        return 0
+
+    def record(self, value: int):
+        """Record a value
+
+        Args:
+            value (int): non-negative integer in recorded units
+        """
+        self.counts[_bucket(value)] += 1
+        self.total += value
+
+    def merge(self, other):
+        """Add the values recorded by another histogram of the same unit
+
+        Args:
+            other (Histogram): histogram to add
+        """
+        self.counts[:] = [count + other_count for count, other_count in zip(self.counts, other.counts)]
+        self.total += other.total
+
+    def quantile(self, q: float):
+        """Estimate a quantile
+
+        Args:
+            q (float): quantile between 0 and 1, e.g. 0.99
+
+        Returns:
+            float: upper bound of the bucket holding the quantile in the reported unit, 0 if empty
+        """
+        total = self.count
+        if not total:
+            return 0.0
+        rank = max(1, round(q * total))
+        seen = 0
+        for index, count in enumerate(self.counts):
+            seen += count
+            if seen >= rank:
+                return _upper_bound(index) * self.scale
+        return self.max * self.scale
+
+    def cumulative(self, limit: int):
+        """Count the values below a limit, exact when the limit is a power of two
+
+        Args:
+            limit (int): limit in recorded units
+
+        Returns:
+            int: number of values recorded below limit
+        """
+        return sum(self.counts[:_bucket(limit)])
+
+    def snapshot(self):
+        """Summarize the histogram
+
+        Returns:
+            dict: count, sum, mean, max and the p50, p90, p99 and p999 quantiles in the reported unit
+        """
+        count = self.count
+        return {
+            "count": count,
+            "sum": self.total * self.scale,
+            "mean": self.total * self.scale / count if count else 0.0,
+            "max": self.max * self.scale,
+            "p50": self.quantile(0.5),
+            "p90": self.quantile(0.9),
+            "p99": self.quantile(0.99),
+            "p999": self.quantile(0.999),
+        }
+
+
+class Counter:
+    """Monotonic counter"""
+    __slots__ = ("value",)
+
+    def __init__(self):
+        self.value = 0
+
+
+class Metrics:
+    """Registry of counters, histograms and caches
+
+    Safe to share between managers and threads.
+    """
+
+    def __init__(self, namespace: str = "auth"):
+        """
+        Args:
+            namespace (str, optional): prefix of the Prometheus metric names. Defaults to "auth".
+        """
+        self.namespace = namespace
+        self.counters = {}
+        self.histograms = {}
+        self.caches = {} # cache name -> (lookups Counter, misses Counter)
+        self._lock = threading.Lock() # Only taken to register metrics
+
+    def counter(self, name: str):
+        """Get a counter, registering it on first use
+
+        Args:
+            name (str): metric name, e.g. "login_user_failures_total"
+
+        Returns:
+            Counter: the counter
+        """
+        counter = self.counters.get(name)
+        if counter is None:
+            with self._lock:
+                counter = self.counters.setdefault(name, Counter())
+        return counter
+
+    def histogram(self, name: str, unit: str = "seconds", scale: float = 1e-9, bounds: tuple = (10, 36)):
+        """Get a histogram, registering it on first use
+
+        Args:
+            name (str): metric name, e.g. "login_user_seconds"
+            unit, scale, bounds: see Histogram, only used when the histogram is registered
+
+        Returns:
+            Histogram: the histogram
+        """
+        histogram = self.histograms.get(name)
+        if histogram is None:
+            with self._lock:
+                histogram = self.histograms.setdefault(name, Histogram(unit, scale, bounds))
+        return histogram
+
+    def inc(self, name: str, value: int = 1):
+        """Increment a counter
+
+        Args:
+            name (str): metric name
+            value (int, optional): increment. Defaults to 1.
+        """
+        self.counter(name).value += value
+
+    def record_size(self, name: str, size: int):
+        """Record a size in bytes
+
+        Args:
+            name (str): metric name, e.g. "storage_write_bytes"
+            size (int): size in bytes
+        """
+        self.histogram(name, "bytes", 1, (6, 30)).record(size)
+
+    def timed(self, name: str, function, count_failures: bool = True):
+        """Wrap a function to record its latency, exceptions and falsy results
+
+        Args:
+            name (str): metric base name, e.g. "login_user"
+            function (callable): function to time
+            count_failures (bool, optional): count the calls returning a falsy result. Defaults to True.
+
+        Returns:
+            callable: the wrapper
+        """
+        histogram = self.histogram(name + "_seconds")
+        failures = self.counter(name + "_failures_total") if count_failures else None
+        errors = self.counter(name + "_errors_total")
+        counts = histogram.counts
+        clock = time.perf_counter_ns
+
+        def wrapper(*args, **kwargs):
+            start = clock()
+            try:
+                result = function(*args, **kwargs)
+            except BaseException:
+                errors.value += 1
+                raise
+            elapsed = clock() - start
+            # Histogram.record inlined, this runs on every instrumented call
+            if elapsed < 2 * _SUB_BUCKETS:
+                counts[elapsed] += 1
+            else:
+                shift = elapsed.bit_length() - _SUB_BITS - 1
+                counts[(shift << _SUB_BITS) + (elapsed >> shift)] += 1
+            histogram.total += elapsed
+            if failures is not None and not result:
+                failures.value += 1
+            return result
+
+        wrapper.__wrapped__ = function
+        wrapper.__name__ = getattr(function, "__name__", name)
+        wrapper.__doc__ = getattr(function, "__doc__", None)
+        return wrapper
+
+    def instrument(self, obj, method_names, count_failures: bool = True):
+        """Replace methods of one object with timing wrappers
+
+        Args:
+            obj: object to instrument, e.g. a manager
+            method_names (iterable): names of the methods, the metric name drops leading underscores
+            count_failures (bool, optional): count the calls returning a falsy result. Defaults to True.
+        """
+        for method_name in method_names:
+            method = getattr(obj, method_name)
+            setattr(obj, method_name, self.timed(method_name.lstrip("_"), method, count_failures))
+
+    def add_cache(self, name: str):
+        """Register a cache whose hit ratio is reported, its owner counts the lookups and misses
+
+        Args:
+            name (str): cache name, e.g. "user_mask"
+
+        Returns:
+            tuple: the lookups and misses Counters, named "<name>_lookups_total" and "<name>_misses_total"
+        """
+        counters = self.counter(name + "_lookups_total"), self.counter(name + "_misses_total")
+        self.caches[name] = counters
+        return counters
+
+    def reset(self):
+        """Forget every recorded value, the registered metrics stay"""
+        with self._lock:
+            for counter in self.counters.values():
+                counter.value = 0
+            for histogram in self.histograms.values():
+                histogram.counts[:] = [0] * _BUCKETS # In place, the timing wrappers hold the list
+                histogram.total = 0
+
+    def snapshot(self):
+        """Get the current values
+
+        Returns:
+            dict: "counters" (name -> value), "histograms" (name -> summary, see
+                Histogram.snapshot) and "caches" (name -> lookups, misses and hit_ratio)
+        """
+        caches = {}
+        for name, (lookups, misses) in self.caches.items():
+            caches[name] = {
+                "lookups": lookups.value,
+                "misses": misses.value,
+                "hit_ratio": 1 - misses.value / lookups.value if lookups.value else 0.0,
+            }
+        return {
+            "counters": {name: counter.value for name, counter in sorted(self.counters.items())},
+            "histograms": {name: histogram.snapshot() for name, histogram in sorted(self.histograms.items())},
+            "caches": caches,
+        }
+
+    def prometheus(self):
+        """Dump the current values in the Prometheus text exposition format
+
+        Returns:
+            str: the exposition text
+        """
+        lines = []
+        for name, counter in sorted(self.counters.items()):
+            metric = f"{self.namespace}_{name}"
+            lines.append(f"# TYPE {metric} counter")
+            lines.append(f"{metric} {counter.value}")
+        for name, histogram in sorted(self.histograms.items()):
+            metric = f"{self.namespace}_{name}"
+            count = histogram.count
+            lines.append(f"# TYPE {metric} histogram")
+            low, high = histogram.bounds
+            for exponent in range(low, high + 1):
+                le = float(1 << exponent) * histogram.scale
+                lines.append(f'{metric}_bucket{{le="{le:.9g}"}} {histogram.cumulative(1 << exponent)}')
+            lines.append(f'{metric}_bucket{{le="+Inf"}} {count}')
+            lines.append(f"{metric}_sum {histogram.total * histogram.scale:.9g}")
+            lines.append(f"{metric}_count {count}")
+        for name, cache in sorted(self.snapshot()["caches"].items()):
+            metric = f"{self.namespace}_{name}_cache_hit_ratio"
+            lines.append(f"# TYPE {metric} gauge")
+            lines.append(f"{metric} {cache['hit_ratio']:.6g}")
+        return "\n".join(lines) + "\n"
+
+
+def _bucket(value: int):
+    """Index of the bucket holding a value"""
+    if value < 2 * _SUB_BUCKETS:
+        return value
+    shift = value.bit_length() - _SUB_BITS - 1
+    return (shift << _SUB_BITS) + (value >> shift)
+
+
+def _upper_bound(index: int):
+    """Largest value held by a bucket"""
+    if index < 2 * _SUB_BUCKETS:
+        return index
+    shift = (index >> _SUB_BITS) - 1
+    return ((_SUB_BUCKETS + (index & (_SUB_BUCKETS - 1)) + 1) << shift) - 1
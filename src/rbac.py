@@ -2,6 +2,24 @@
 Role-based Access control
 
 This module provides functionality for role-based access control (RBAC) in a system.
+RBAC data is persisted through a storage backend (see storage.py), a JSON file by default.
+
+A manager can be shared between threads. Writers are serialized by a lock
+and publish changes by replacing whole records and cached masks, never by
+changing them in place, so permission checks read without taking a lock.
+Only a check missing the cached mask of a user takes the lock to fill it.
+
+Outcomes are printed unless VERBOSE is off, and recorded as structured
+events (role and permission changes, permission checks) when an EventLog is
+given (see events.py). Given a Metrics registry (see metrics.py), the
+permission checks and the storage calls are timed and the hit ratio of the
+cached user masks is reported. Reporting, write validation and the storage
+lifecycle (flush, close, rebalance) come from BaseManager (see manager.py).
+
+Every policy change increases the policy version stored with the RBAC data
+and is published to a ChangeFeed (see changes.py) naming the users and roles
+whose effective permissions changed, so remote caches of permission checks
+can drop exactly those entries.
 
 Classes:
     User: Represents a user in the system.
@@ -17,36 +35,451 @@ Functions:
     assign_role_to_user(username, role_name): Assigns a role to a user.
     remove_role_from_user(username, role_name): Removes a role assigned to a user
     assign_permission_to_role(role_name, permission_name): Assigns a permission to a role.
+    add_role_inheritance(role_name, inherited_role): Lets a role inherit the permissions of another role.
+    remove_role_inheritance(role_name, inherited_role): Removes an inheritance between two roles.
     check_user_permission(username, permission_name): Checks if a user has a specific permission.
+    check_user_permissions(username, permission_names, require_all): Checks several permissions in one mask test.
+    check_many(pairs): Checks a batch of (username, permission) pairs without console output.
+    permissions_for_users(usernames): Resolves the effective permissions of several users at once.
+    flush(): Makes sure every change made so far has been persisted.
+    close(): Persists pending changes and releases the storage backend.
+    rebalance(batch_size): Moves a batch of records to their shard after a shard was added to a ShardedBackend.
+    subscribe(callback, users, roles): Calls a function with every policy change concerning some users or roles.
+    unsubscribe(subscription): Stops calling a subscriber.
+    changes(since, users, roles, timeout): Iterates over the policy changes newer than a version.
 """
-import json
+import sys
+import threading
+import time
+from changes import ChangeFeed
+from events import DEBUG, WARNING
+from manager import BaseManager
+from storage import JSONFileBackend, transactional
 
 RBAC_FILE= 'data/rbac_data.json'
-class RBACManager:
-    def __init__(self):
+class RBACManager(BaseManager):
+    METRICS_CHECKS = ("check_user_permission", "check_user_permissions") # Timed, falsy results counted as failures
+    METRICS_TIMED = ("_load_rbac_data", "_save_rbac_data", "_fill_user_mask") # Timed only
+
+    def __init__(self, storage=None, events=None, metrics=None, feed=None):
+        """
+        Args:
+            storage (StorageBackend, optional): backend persisting the RBAC data.
+                Defaults to a JSONFileBackend on RBAC_FILE.
+            events (EventLog, optional): log recording the outcomes as structured events.
+                Defaults to None, which records nothing.
+            metrics (Metrics, optional): registry the timed methods and storage writes are
+                recorded in. Defaults to None, which leaves the methods uninstrumented.
+            feed (ChangeFeed, optional): feed the policy changes are published to.
+                Defaults to an in-memory ChangeFeed.
+        """
+        if storage is None:
+            storage = JSONFileBackend(RBAC_FILE, {"users": {}, "roles": {}, "permissions": {},
+                                                  "role_inheritance": {}})
+        self.storage = storage
+        self.events = events
+        self.metrics = metrics
+        self.feed = feed if feed is not None else ChangeFeed()
+        if metrics is not None:
+            metrics.instrument(self, self.METRICS_CHECKS)
+            metrics.instrument(self, self.METRICS_TIMED, count_failures=False)
+            self._mask_lookups, self._mask_misses = metrics.add_cache("user_mask")
+            self._user_mask = self._counted_user_mask
+            storage.attach_metrics(metrics)
+        self._lock = threading.RLock() # Serializes writers, see storage.transactional
+        self._mask_lock = threading.Lock() # Guards publishing cached user masks, see _fill_user_mask
+        self._mask_generation = 0
         self.data = self._load_rbac_data()
+        self.data.setdefault("role_inheritance", {})
+        self.data.setdefault("policy", {})
+        self._build_permission_index()
+        self.feed.rebase(self.policy_version)
+        self.storage.add_listener(self._on_storage_changes)
+
+    @property
+    def policy_version(self):
+        """int: number of policy changes made to the store, increased by every role,
+        permission, assignment and inheritance change"""
+        return self.data["policy"].get("version", 0)
         
     def _load_rbac_data(self):
-        """Load the rbac_data.json file
+        """Load the RBAC data from the storage backend
 
         Returns:
-            dict: JSON file content if present, empty dict otherwise
+            dict: stored RBAC data if present, empty sections otherwise
         """
-        try:
-            with open(RBAC_FILE, 'r') as file:
-                return json.load(file)
-        except (FileNotFoundError, json.JSONDecodeError):
-            return {"users": {}, "roles": {}, "permissions": {}}
+        return self.storage.load()
         
-    def _save_rbac_data(self):
-        """Saves RBAC data to the rbac_data.json
+    def _save_rbac_data(self, section: str = None, key: str = None):
+        """Saves RBAC data through the storage backend
 
-        Returns:
-            dict: roles nad permissions associated with eacch user
+        Args:
+            section (str, optional): section of the changed record ("users", "roles",
+                "permissions" or "role_inheritance"). Defaults to None, which persists the whole document.
+            key (str, optional): key of the changed record, deleted if it no longer exists
         """
-        with open(RBAC_FILE, 'w') as file:
-            return json.dump(self.data, file, indent=4)
+        if section is None:
+            return self.storage.save(self.data)
+        return self.storage.put(section, key, self.data[section].get(key))
         
+    def _user_roles(self, username: str):
+        """Get the role list of a user
+
+        User entries are either a plain list of roles or a dict with "roles"
+        and user-specific "permissions" lists.
+
+        Args:
+            username (str): username
+
+        Returns:
+            list: the user's role list, not to be changed in place (see _set_user_entry)
+        """
+        user_data = self.data["users"][username]
+        if isinstance(user_data, dict):
+            return user_data.get("roles", [])
+        return user_data
+
+    def _user_permissions(self, username: str):
+        """Get the user-specific permissions of a user
+
+        Args:
+            username (str): username
+
+        Returns:
+            list: permissions granted directly to the user
+        """
+        user_data = self.data["users"][username]
+        if isinstance(user_data, dict):
+            return user_data.get("permissions", [])
+        return []
+
+    def _set_user_entry(self, username: str, roles: list = None, permissions: list = None):
+        """Publish a new user entry, keeping the shape of the existing one
+
+        Args:
+            username (str): username
+            roles (list, optional): new role list. Defaults to None (unchanged).
+            permissions (list, optional): new user-specific permissions. Defaults to None (unchanged).
+        """
+        user_data = self.data["users"][username]
+        if isinstance(user_data, dict):
+            user_data = dict(user_data)
+            if roles is not None:
+                user_data["roles"] = roles
+            if permissions is not None:
+                user_data["permissions"] = permissions
+        elif roles is not None:
+            user_data = roles
+        self.data["users"][username] = user_data
+
+    def _build_permission_index(self):
+        """Build the interned permission bitsets, the role hierarchy closure and the role membership index
+
+        Each permission name is interned to a bit position in self._permission_ids
+        (self._permission_names maps the positions back to names) and each role's own permission list is encoded as an int bitmask in
+        self._role_masks. The transitive closure of the role hierarchy is kept
+        in self._role_juniors (the roles a role inherits, itself included) and
+        self._role_seniors (the roles inheriting a role, itself included), and
+        self._closure_masks holds the OR of the masks of a role's juniors, so a
+        deep hierarchy costs the same to check as a flat role.
+        self._role_members maps each role name to the users referencing it.
+        self._user_masks caches the effective permission mask of a user (the OR
+        of its user-specific bits and role closure masks), it is filled lazily
+        by _user_mask and kept up to date by every mutation.
+
+        The user-specific permissions are interned too, so filling a user's mask
+        on a check never assigns a bit.
+
+        Role names in the user entries are interned as well, so the millions of
+        role references loaded from the store share a single string per role.
+
+        The masks speed up checks only: self.data keeps the permission name
+        lists, which are what the store persists, so the indexes add to the
+        memory held rather than replace it.
+
+        Checks read the indexes without a lock while they are rebuilt after a
+        full reload, so the new ones are built aside and published by plain
+        assignments, the cached user masks last. Permission bits keep their
+        position across rebuilds, so old and new masks always agree.
+        """
+        permission_ids = dict(getattr(self, "_permission_ids", {}))
+        permission_names = list(getattr(self, "_permission_names", []))
+
+        def permission_bit(permission_name):
+            bit = permission_ids.get(permission_name)
+            if bit is None:
+                permission_name = sys.intern(permission_name)
+                bit = permission_ids[permission_name] = len(permission_names)
+                permission_names.append(permission_name)
+            return bit
+
+        for permission_name in self.data["permissions"]:
+            permission_bit(permission_name)
+        role_masks = {}
+        for role, permissions in self.data["roles"].items():
+            mask = 0
+            for permission_name in permissions:
+                mask |= 1 << permission_bit(permission_name)
+            role_masks[role] = mask
+        role_juniors = {}
+        role_seniors = {}
+        closure_masks = {}
+        for role in self.data["roles"]:
+            juniors = role_juniors[role] = self._collect_juniors(role)
+            mask = 0
+            for junior in juniors:
+                role_seniors.setdefault(junior, set()).add(role)
+                mask |= role_masks[junior]
+            closure_masks[role] = mask
+        role_members = {}
+        for username in self.data["users"]:
+            roles = self._user_roles(username)
+            roles[:] = [sys.intern(role) for role in roles]
+            for role in roles:
+                role_members.setdefault(role, set()).add(username)
+            for permission_name in self._user_permissions(username):
+                permission_bit(permission_name)
+        self._permission_ids = permission_ids
+        self._permission_names = permission_names
+        self._role_masks = role_masks
+        self._role_juniors = role_juniors
+        self._role_seniors = role_seniors
+        self._closure_masks = closure_masks
+        self._role_members = role_members
+        self._begin_mask_update()
+        self._user_masks = {}
+
+    def _on_storage_changes(self, changes):
+        """Update the permission indexes after other processes changed the store
+
+        Args:
+            changes (list): (section, key, old_value) tuples, None after a full reload
+        """
+        if changes is None:
+            self._build_permission_index()
+            if self.policy_version > self.feed.version:
+                self.feed.publish(self._change_entry("policy.reloaded", full=True), local=False)
+            return
+        closure_roles = set()
+        users = set()
+        permissions = set()
+        for section, key, old_value in changes:
+            if section == "permissions":
+                permissions.add(key)
+                if key in self.data["permissions"]:
+                    self._permission_bit(key)
+            elif section == "roles":
+                if key in self.data["roles"]:
+                    self._role_masks[key] = self._permission_mask(self.data["roles"][key])
+                else:
+                    self._role_masks.pop(key, None)
+                closure_roles |= self._role_seniors.get(key, set()) | {key}
+            elif section == "role_inheritance":
+                closure_roles |= self._role_seniors.get(key, set()) | {key}
+            elif section == "users":
+                old_roles = old_value.get("roles", []) if isinstance(old_value, dict) else old_value or []
+                for role in old_roles:
+                    self._role_members.get(role, set()).discard(key)
+                if key in self.data["users"]:
+                    for role in self._user_roles(key):
+                        self._role_members.setdefault(role, set()).add(key)
+                    for permission_name in self._user_permissions(key):
+                        self._permission_bit(permission_name)
+                self._invalidate_users([key])
+                users.add(key)
+        self._refresh_role_closures(closure_roles)
+        if self.policy_version > self.feed.version:
+            self.feed.publish(self._change_entry("policy.changed", users, closure_roles, permissions), local=False)
+
+    def _collect_juniors(self, role: str):
+        """Walk the role hierarchy below a role
+
+        Args:
+            role (str): role name
+
+        Returns:
+            set: the role itself and every role it inherits, directly or transitively
+        """
+        juniors = set()
+        stack = [role]
+        while stack:
+            current = stack.pop()
+            if current in juniors or current not in self.data["roles"]:
+                continue
+            juniors.add(current)
+            stack.extend(self.data["role_inheritance"].get(current, []))
+        return juniors
+
+    def _refresh_role_closures(self, roles):
+        """Recompute the hierarchy closure of the given roles after an inheritance change
+
+        Only the roles whose closure can have changed are walked, i.e. the
+        seniors of the role at the changed edge. Cached masks of their users
+        are dropped.
+
+        Args:
+            roles (iterable): role names to recompute
+        """
+        for role in list(roles):
+            old_juniors = self._role_juniors.pop(role, set())
+            new_juniors = self._collect_juniors(role)
+            for junior in old_juniors - new_juniors:
+                seniors = self._role_seniors.get(junior)
+                if seniors is not None:
+                    seniors.discard(role)
+                    if not seniors:
+                        del self._role_seniors[junior]
+            for junior in new_juniors - old_juniors:
+                self._role_seniors.setdefault(junior, set()).add(role)
+            self._closure_masks.pop(role, None)
+            if new_juniors:
+                self._role_juniors[role] = new_juniors
+                mask = 0
+                for junior in new_juniors:
+                    mask |= self._role_masks[junior]
+                self._closure_masks[role] = mask
+            self._invalidate_users(self._role_members.get(role, ()))
+
+    def _permission_bit(self, permission_name: str):
+        """Intern a permission name to its bit position
+
+        Args:
+            permission_name (str): name of the permission
+
+        Returns:
+            int: bit position of the permission, assigned on first use
+        """
+        bit = self._permission_ids.get(permission_name)
+        if bit is None:
+            permission_name = sys.intern(permission_name)
+            bit = self._permission_ids[permission_name] = len(self._permission_names)
+            self._permission_names.append(permission_name)
+        return bit
+
+    def _permission_mask(self, permission_names):
+        """Encode permission names as a bitmask
+
+        Args:
+            permission_names (iterable): names of the permissions
+
+        Returns:
+            int: bitmask with one bit set per permission
+        """
+        mask = 0
+        for permission_name in permission_names:
+            mask |= 1 << self._permission_bit(permission_name)
+        return mask
+
+    def _user_mask(self, username: str):
+        """Get the effective permission mask of a user from the index
+
+        Args:
+            username (str): username, must exist in the system
+
+        Returns:
+            int: user-specific permission bits OR-ed with the mask of every role
+        """
+        mask = self._user_masks.get(username)
+        if mask is not None:
+            return mask
+        return self._fill_user_mask(username)
+
+    def _counted_user_mask(self, username: str):
+        """_user_mask counting the cache lookups and misses, used instead of it when metrics are recorded
+
+        Args:
+            username (str): username, must exist in the system
+
+        Returns:
+            int: user-specific permission bits OR-ed with the mask of every role
+        """
+        self._mask_lookups.value += 1
+        mask = self._user_masks.get(username)
+        if mask is not None:
+            return mask
+        self._mask_misses.value += 1
+        return self._fill_user_mask(username)
+
+    def _fill_user_mask(self, username: str):
+        """Compute and cache the effective permission mask of a user missing from the index
+
+        The mask is computed without the writer lock, so checks never wait for
+        a write. It is only cached if no writer touched the cached masks in the
+        meantime (see _begin_mask_update), otherwise the next check computes it
+        again.
+
+        Args:
+            username (str): username
+
+        Returns:
+            int: the user's mask, 0 for an unknown user
+        """
+        generation = self._mask_generation
+        if username not in self.data["users"]:
+            return 0
+        permission_ids = self._permission_ids
+        mask = 0
+        for permission_name in self._user_permissions(username):
+            bit = permission_ids.get(permission_name)
+            if bit is not None:
+                mask |= 1 << bit
+        for role in self._user_roles(username):
+            mask |= self._closure_masks.get(role, 0)
+        with self._mask_lock:
+            if self._mask_generation == generation:
+                self._user_masks[username] = mask
+        return mask
+
+    def _begin_mask_update(self):
+        """Discard the user masks being computed by checks, before a writer changes the cached ones
+
+        Writers call it after changing the data the masks are computed from, so
+        a mask cached before the call is corrected by the writer and one
+        computed from older data is never cached after it.
+        """
+        with self._mask_lock:
+            self._mask_generation += 1
+
+    def _invalidate_users(self, usernames):
+        """Drop cached user masks so they are recomputed on the next check
+
+        Args:
+            usernames (iterable): usernames whose permissions changed
+        """
+        self._begin_mask_update()
+        for username in usernames:
+            self._user_masks.pop(username, None)
+
+    def _change_entry(self, change: str, users=(), roles=(), permissions=(), full: bool = False):
+        """Build a change entry at the current policy version, see changes.py
+
+        Args:
+            change (str): change name, e.g. "permission.assigned"
+            users (iterable, optional): users whose own roles or permissions changed
+            roles (iterable, optional): roles whose effective permissions changed
+            permissions (iterable, optional): permissions involved
+            full (bool, optional): True when consumers must drop everything. Defaults to False.
+
+        Returns:
+            dict: the change entry
+        """
+        return {"version": self.policy_version, "ts": round(time.time(), 6), "change": change,
+                "users": sorted(users), "roles": sorted(roles), "permissions": sorted(permissions), "full": full}
+
+    def _publish_change(self, change: str, users=(), roles=(), permissions=()):
+        """Increase the policy version and publish the change, the caller holds the writer lock
+
+        Args:
+            change (str): change name, e.g. "permission.assigned"
+            users (iterable, optional): users whose own roles or permissions changed
+            roles (iterable, optional): roles whose effective permissions changed, inheriting roles included
+            permissions (iterable, optional): permissions involved
+        """
+        self.data["policy"]["version"] = self.policy_version + 1
+        self._save_rbac_data("policy", "version")
+        self.feed.publish(self._change_entry(change, users, roles, permissions))
+
+    @transactional
     def add_role(self, role: str):
         """Add a new role to the system
 
@@ -57,14 +490,21 @@ class RBACManager:
             bool: True if role added successfully, False otherwise
         """
         if role in self.data['roles']:
-            print(f"Role '{role}' already exists.")
+            self._report(f"Role '{role}' already exists.")
+            return False
+        
+        if not self._check_record('roles', role, []):
             return False
         
         self.data['roles'][role] = []
-        self._save_rbac_data()
-        print(f"Role '{role}' added successfully.")
+        self._save_rbac_data('roles', role)
+        self._role_masks[role] = 0
+        self._refresh_role_closures([role])
+        self._publish_change("role.added", roles=[role])
+        self._report(f"Role '{role}' added successfully.", "role.added", role=role)
         return True
     
+    @transactional
     def remove_role(self, role: str):
         """Remove a role from the system
 
@@ -75,14 +515,31 @@ class RBACManager:
             bool: True if role removed successfully, False otherwise
         """
         if role not in self.data["roles"]:
-            print(f"Role '{role}' not found in the system.")
+            self._report(f"Role '{role}' not found in the system.")
             return False
         
+        affected = set(self._role_seniors.get(role, ()))
         del self.data["roles"][role]
-        self._save_rbac_data()
-        print(f"Role '{role}' removed successfully.")
+        self._save_rbac_data("roles", role)
+        # Drop the inheritance edges from and to the removed role
+        inheritance = self.data["role_inheritance"]
+        if inheritance.pop(role, None) is not None:
+            self._save_rbac_data("role_inheritance", role)
+        for senior, inherited_roles in list(inheritance.items()):
+            if role in inherited_roles:
+                inherited_roles = [name for name in inherited_roles if name != role]
+                if inherited_roles:
+                    inheritance[senior] = inherited_roles
+                else:
+                    del inheritance[senior]
+                self._save_rbac_data("role_inheritance", senior)
+        self._refresh_role_closures(affected)
+        del self._role_masks[role]
+        self._publish_change("role.removed", roles=affected)
+        self._report(f"Role '{role}' removed successfully.", "role.removed", role=role)
         return True
     
+    @transactional
     def add_permission(self, permission_name: str):
         """Add a new permission to the system
 
@@ -93,16 +550,23 @@ class RBACManager:
             bool: True if permission added successfully, False otherwise
         """
         if permission_name in self.data["permissions"]:
-            print(f"Permission '{permission_name}' already exists.")
+            self._report(f"Permission '{permission_name}' already exists.")
+            return False
+        
+        if not self._check_record("permissions", permission_name, []):
             return False
         
         self.data["permissions"][permission_name] = []
-        self._save_rbac_data()
-        print(f"Permission '{permission_name}' added successfully.")
+        self._save_rbac_data("permissions", permission_name)
+        self._permission_bit(permission_name)
+        self._publish_change("permission.added", permissions=[permission_name])
+        self._report(f"Permission '{permission_name}' added successfully.", "permission.added",
+                     permission=permission_name)
         return True
     
+    @transactional
     def remove_permission(self, permission_name: str):
-        """Remove a permission from the system
+        """Remove a permission from the system and revoke it from every role and user
 
         Args:
             permission_name (str): name of the permission
@@ -111,14 +575,38 @@ class RBACManager:
             bool: True if permission removed successfully, False otherwise
         """
         if permission_name not in self.data["permissions"]:
-            print(f"Permission '{permission_name}' does not exist.")
+            self._report(f"Permission '{permission_name}' does not exist.")
             return False
         
         del self.data["permissions"][permission_name]
-        self._save_rbac_data()
-        print(f"Permission '{permission_name}' removed successfully.")
+        self._save_rbac_data("permissions", permission_name)
+        # Revoke the permission from every role and user still holding it
+        clear = ~(1 << self._permission_bit(permission_name))
+        affected_roles = set()
+        affected_users = []
+        for role, permissions in self.data["roles"].items():
+            if permission_name in permissions:
+                self.data["roles"][role] = [name for name in permissions if name != permission_name]
+                self._save_rbac_data("roles", role)
+                self._role_masks[role] &= clear
+                affected_roles |= self._role_seniors.get(role, set())
+        for role, mask in self._closure_masks.items():
+            self._closure_masks[role] = mask & clear
+        for username in self.data["users"]:
+            permissions = self._user_permissions(username)
+            if permission_name in permissions:
+                self._set_user_entry(username, permissions=[name for name in permissions if name != permission_name])
+                self._save_rbac_data("users", username)
+                affected_users.append(username)
+        self._begin_mask_update()
+        for username, mask in self._user_masks.items():
+            self._user_masks[username] = mask & clear
+        self._publish_change("permission.removed", affected_users, affected_roles, [permission_name])
+        self._report(f"Permission '{permission_name}' removed successfully.", "permission.removed",
+                     permission=permission_name)
         return True
     
+    @transactional
     def assign_role_to_user(self, username: str, role: str):
         """Assign a specific role to a user
 
@@ -130,20 +618,29 @@ class RBACManager:
             bool: True if role is successful assigned to user, False otherwise
         """
         if username not in self.data["users"]:
+            if not self._check_record("users", username, []):
+                return False
             self.data["users"][username] = []
             
         if role not in self.data["roles"]:
-            print(f"Role '{role}' does not exist.")
+            self._report(f"Role '{role}' does not exist.")
             return False
         
-        if role in self.data["users"][username]:
-            print(f"User '{username}' already has role '{role}'.")
+        if role in self._user_roles(username):
+            self._report(f"User '{username}' already has role '{role}'.")
             return False
-        self.data["users"][username].append(role)
-        self._save_rbac_data()
-        print(f"Role '{role}' has been assigned to user '{username}'.")
+        self._set_user_entry(username, roles=self._user_roles(username) + [role])
+        self._save_rbac_data("users", username)
+        self._role_members.setdefault(role, set()).add(username)
+        self._begin_mask_update()
+        if username in self._user_masks:
+            self._user_masks[username] |= self._closure_masks[role]
+        self._publish_change("role.assigned", users=[username])
+        self._report(f"Role '{role}' has been assigned to user '{username}'.", "role.assigned",
+                     username=username, role=role)
         return True
     
+    @transactional
     def remove_role_from_user(self, username: str, role: str):
         """Remove a role from a user
 
@@ -155,22 +652,27 @@ class RBACManager:
             bool: True if role removed from a user, False otherwise
         """
         if username not in self.data["users"]:
-            print(f"User '{username}' does not exist.")
+            self._report(f"User '{username}' does not exist.")
             return False
         
         if role not in self.data["roles"]:
-            print(f"Role '{role}' does not exist.")
+            self._report(f"Role '{role}' does not exist.")
             return False
         
-        if role not in self.data["users"][username]:
-            print(f"User '{username}' does not have role '{role}'.")
+        if role not in self._user_roles(username):
+            self._report(f"User '{username}' does not have role '{role}'.")
             return False
         
-        self.data["users"][username].remove(role)
-        self._save_rbac_data()
-        print(f"Role '{role}' removed from user '{username}'.")
+        self._set_user_entry(username, roles=[name for name in self._user_roles(username) if name != role])
+        self._save_rbac_data("users", username)
+        self._role_members[role].discard(username)
+        self._invalidate_users([username])
+        self._publish_change("role.unassigned", users=[username])
+        self._report(f"Role '{role}' removed from user '{username}'.", "role.unassigned",
+                     username=username, role=role)
         return True
     
+    @transactional
     def assign_permission_to_role(self, role: str, permission_name: str):
         """Assign permission to specific role
 
@@ -182,20 +684,92 @@ class RBACManager:
             bool: True if permission assigned to role, False other wise
         """
         if permission_name not in self.data["permissions"]:
-            print(f"Permission '{permission_name}' does not exist.")
+            self._report(f"Permission '{permission_name}' does not exist.")
             return False
         
         if role not in self.data["roles"]:
-            print(f"Role '{role}' does not exist.")
+            self._report(f"Role '{role}' does not exist.")
             return False
         
         if permission_name in self.data["roles"][role]:
-            print(f"Role '{role}' already has permission '{permission_name}'.")
+            self._report(f"Role '{role}' already has permission '{permission_name}'.")
             return False
         
-        self.data["roles"][role].append(permission_name)
-        self._save_rbac_data()
-        print(f"Permission '{permission_name}' assigned to role '{role}'.")
+        self.data["roles"][role] = self.data["roles"][role] + [permission_name]
+        self._save_rbac_data("roles", role)
+        bit = 1 << self._permission_bit(permission_name)
+        self._role_masks[role] |= bit
+        for senior in self._role_seniors[role]:
+            self._closure_masks[senior] |= bit
+            self._begin_mask_update()
+            for username in self._role_members.get(senior, ()):
+                if username in self._user_masks:
+                    self._user_masks[username] |= bit
+        self._publish_change("permission.assigned", roles=self._role_seniors[role], permissions=[permission_name])
+        self._report(f"Permission '{permission_name}' assigned to role '{role}'.", "permission.assigned",
+                     role=role, permission=permission_name)
+        return True
+    
+    @transactional
+    def add_role_inheritance(self, role: str, inherited_role: str):
+        """Let a role inherit every permission of another role
+
+        Args:
+            role (str): role name, e.g. "admin"
+            inherited_role (str): role whose permissions are inherited, e.g. "editor"
+
+        Returns:
+            bool: True if the inheritance is added, False if a role is missing, the
+                inheritance already exists or it would create a cycle
+        """
+        for name in (role, inherited_role):
+            if name not in self.data["roles"]:
+                self._report(f"Role '{name}' does not exist.")
+                return False
+        
+        inherited_roles = self.data["role_inheritance"].get(role, [])
+        if inherited_role in inherited_roles:
+            self._report(f"Role '{role}' already inherits role '{inherited_role}'.")
+            return False
+        
+        if role in self._role_juniors[inherited_role]:
+            self._report(f"Role '{role}' cannot inherit role '{inherited_role}': it would create a cycle.")
+            return False
+        
+        self.data["role_inheritance"][role] = inherited_roles + [inherited_role]
+        self._save_rbac_data("role_inheritance", role)
+        self._refresh_role_closures(set(self._role_seniors[role]))
+        self._publish_change("role.inheritance_added", roles=self._role_seniors[role])
+        self._report(f"Role '{role}' now inherits role '{inherited_role}'.", "role.inheritance_added",
+                     role=role, inherited_role=inherited_role)
+        return True
+    
+    @transactional
+    def remove_role_inheritance(self, role: str, inherited_role: str):
+        """Stop a role from inheriting the permissions of another role
+
+        Args:
+            role (str): role name
+            inherited_role (str): role whose permissions are no longer inherited
+
+        Returns:
+            bool: True if the inheritance is removed, False otherwise
+        """
+        inherited_roles = self.data["role_inheritance"].get(role, [])
+        if inherited_role not in inherited_roles:
+            self._report(f"Role '{role}' does not inherit role '{inherited_role}'.")
+            return False
+        
+        inherited_roles = [name for name in inherited_roles if name != inherited_role]
+        if inherited_roles:
+            self.data["role_inheritance"][role] = inherited_roles
+        else:
+            del self.data["role_inheritance"][role]
+        self._save_rbac_data("role_inheritance", role)
+        self._refresh_role_closures(set(self._role_seniors[role]))
+        self._publish_change("role.inheritance_removed", roles=self._role_seniors[role])
+        self._report(f"Role '{role}' no longer inherits role '{inherited_role}'.", "role.inheritance_removed",
+                     role=role, inherited_role=inherited_role)
         return True
     
     def check_user_permission(self, username: str, permission_name: str):
@@ -206,23 +780,199 @@ class RBACManager:
             permission_name (str): permission name
 
         Returns:
-            bool: True if username found in the system, False otherwise
+            bool: True if the user has the permission, directly or through a role, False otherwise
         """
+        self._refresh_data()
         if username not in self.data["users"]:
-            print(f"User '{username}' not found.")
+            self._report(f"User '{username}' not found.", "permission.denied", WARNING,
+                         username=username, permission=permission_name, reason="unknown_user")
             return False
         
-        user_data = self.data["users"][username]
-        # Check user specific permission first
-        if permission_name in user_data.get("permissions", []):
-            print(f"User '{username}' has permission '{permission_name}' (user-specific).")
+        # Single AND against the precomputed effective permission mask
+        bit = self._permission_ids.get(permission_name)
+        if bit is not None and self._user_mask(username) >> bit & 1:
+            self._report(f"User '{username}' has permission '{permission_name}'.", "permission.granted", DEBUG,
+                         username=username, permission=permission_name)
             return True
+            
+        self._report(f"User '{username}' does not have permission '{permission_name}'.", "permission.denied",
+                     WARNING, username=username, permission=permission_name)
+        return False
+
+    def check_user_permissions(self, username: str, permission_names, require_all: bool = True,
+                               refresh: bool = True):
+        """Check several permissions for a specific user at once
 
-        # Check role based permissions
-        for role in user_data.get["roles", []]:
-            if permission_name in self.data["roles"].get(role, {}):
-                print(f"User '{username}' has permission '{permission_name}'.")
+        Args:
+            username (str): username
+            permission_names (iterable): permission names
+            require_all (bool, optional): True to require every permission, False to
+                require at least one of them. Defaults to True.
+            refresh (bool, optional): pick up the changes of other processes first, which can wait
+                for the store's file lock. Defaults to True, False for callers refreshing on
+                another thread (see async_api.py).
+
+        Returns:
+            bool: True if the user holds all (or any) of the permissions, False otherwise
+        """
+        if refresh:
+            self._refresh_data()
+        if username not in self.data["users"]:
+            self._report(f"User '{username}' not found.")
+            return False
+
+        required = 0
+        for permission_name in permission_names:
+            bit = self._permission_ids.get(permission_name)
+            if bit is None:
+                if require_all:
+                    return False
+                continue
+            required |= 1 << bit
+
+        granted = self._user_mask(username) & required
+        return granted == required if require_all else granted != 0
+
+    def check_many(self, pairs, refresh: bool = True):
+        """Check a batch of (username, permission) pairs in one pass
+
+        Each user's permission mask is looked up once per batch and nothing
+        is printed, so the cost per pair is a dict lookup and a bit test.
+
+        Args:
+            pairs (iterable): (username, permission_name) tuples
+            refresh (bool, optional): pick up the changes of other processes first, which can wait
+                for the store's file lock. Defaults to True, False for callers refreshing on
+                another thread (see async_api.py).
+
+        Returns:
+            list: one bool per pair, in input order, False for unknown users or permissions
+        """
+        if refresh:
+            self._refresh_data()
+        users = self.data["users"]
+        permission_ids = self._permission_ids
+        masks = {}
+        results = []
+        for username, permission_name in pairs:
+            mask = masks.get(username)
+            if mask is None:
+                mask = masks[username] = self._user_mask(username) if username in users else 0
+            bit = permission_ids.get(permission_name)
+            results.append(bit is not None and bool(mask >> bit & 1))
+        return results
+
+    def permissions_for_users(self, usernames, refresh: bool = True):
+        """Resolve the effective permissions of several users at once
+
+        Args:
+            usernames (iterable): usernames
+            refresh (bool, optional): pick up the changes of other processes first, which can wait
+                for the store's file lock. Defaults to True, False for callers refreshing on
+                another thread (see async_api.py).
+
+        Returns:
+            dict: username mapped to the frozenset of its effective permission names,
+                empty for unknown users
+        """
+        if refresh:
+            self._refresh_data()
+        results = {}
+        for username in usernames:
+            if username in results:
+                continue
+            mask = self._user_mask(username) if username in self.data["users"] else 0
+            names = []
+            while mask:
+                low_bit = mask & -mask
+                names.append(self._permission_names[low_bit.bit_length() - 1])
+                mask ^= low_bit
+            results[username] = frozenset(names)
+        return results
+
+    def subscribe(self, callback, users=None, roles=None):
+        """Call a function with every policy change concerning some users or roles
+
+        Args:
+            callback (callable): function receiving the change entry (see changes.py), called
+                by the writer after the change is stored, it should return quickly
+            users (iterable, optional): usernames whose effective permissions are watched
+            roles (iterable, optional): roles whose effective permissions are watched.
+                Every change is reported when neither users nor roles is given.
+
+        Returns:
+            int: subscription id, see unsubscribe
+        """
+        return self.feed.subscribe(callback, self._change_filter(users, roles))
+
+    def unsubscribe(self, subscription: int):
+        """Stop calling a subscriber
+
+        Args:
+            subscription (int): id returned by subscribe
+
+        Returns:
+            bool: True if the subscription existed
+        """
+        return self.feed.unsubscribe(subscription)
+
+    def changes(self, since: int = None, users=None, roles=None, timeout: float = None, poll_interval: float = 0.1):
+        """Iterate over the policy changes newer than a version, waiting for new ones
+
+        Changes made by other processes sharing the store are picked up every
+        poll_interval seconds while waiting.
+
+        Args:
+            since (int, optional): last policy version the consumer has seen. Defaults to the current one.
+            users (iterable, optional): usernames whose effective permissions are watched
+            roles (iterable, optional): roles whose effective permissions are watched.
+                Every change is reported when neither users nor roles is given.
+            timeout (float, optional): seconds to wait for a new change before stopping.
+                Defaults to None, which waits forever.
+            poll_interval (float, optional): seconds between checks for changes made by other processes.
+                Defaults to 0.1.
+
+        Yields:
+            dict: change entries in version order, see changes.py
+        """
+        predicate = self._change_filter(users, roles)
+        since = self.policy_version if since is None else since
+        deadline = None if timeout is None else time.monotonic() + timeout
+        while True:
+            wait = poll_interval if deadline is None else max(0.0, min(poll_interval, deadline - time.monotonic()))
+            for change in self.feed.changes(since, None, wait):
+                since = max(since, change["version"])
+                if predicate is None or predicate(change):
+                    if deadline is not None:
+                        deadline = time.monotonic() + timeout
+                    yield change
+            if deadline is not None and time.monotonic() >= deadline:
+                return # The changes already published have been yielded, even with a timeout of 0
+            self._refresh_data()
+
+    def _change_filter(self, users=None, roles=None):
+        """Build the predicate selecting the change entries concerning some users or roles
+
+        Args:
+            users (iterable, optional): watched usernames, a change to one of their
+                roles concerns them as well
+            roles (iterable, optional): watched roles
+
+        Returns:
+            callable: predicate taking a change entry, None when everything is watched
+        """
+        if users is None and roles is None:
+            return None
+        users = frozenset(users or ())
+        roles = frozenset(roles or ())
+
+        def concerns(change):
+            if change["full"] or not users.isdisjoint(change["users"]) or not roles.isdisjoint(change["roles"]):
                 return True
-            
-        print(f"User '{username}' does not have permission '{permission_name}'.")
-        return False
\ No newline at end of file
+            if not change["roles"]:
+                return False
+            # The changed roles include the inheriting ones, so a user's own roles are enough
+            changed_roles = frozenset(change["roles"])
+            return any(not changed_roles.isdisjoint(self._user_roles(username))
+                       for username in users if username in self.data["users"])
+        return concerns
@@ -16,15 +16,149 @@ METHODS:
         
     validate_session: 
         Validates a session token and checks if it has expired.
+
+    validate_token:
+        Validates a bearer token on its own and returns the user owning it.
+
+    logout_user:
+        Ends every session of the user before logging the user out.
+
+    terminate_session:
+        Ends a single session.
+
+    reap_expired_sessions:
+        Purges expired sessions from the session store in batches.
+
+Sessions live in their own "sessions" section keyed by token, so a user can
+hold several concurrent sessions and a token is resolved with one hash lookup.
+Expiry times are stored as integer epoch seconds and tracked in a min-heap,
+so expired sessions are found in O(log n) and purged lazily. Sessions use
+sliding expiration: every successful validation pushes the expiry
+SESSION_DURATION seconds ahead, but the new expiry is only written to storage
+once it has moved by at least RENEWAL_GRANULARITY seconds.
+
+Session records are never changed in place: a renewal publishes a new record
+under the writer lock, so concurrent validations read a consistent record
+without locking.
+
+With a TokenSigner (see tokens.py) sessions are stateless: the token is
+signed and carries the username, the user's role, the expiry, the issue
+time and a token id, nothing is stored when it is created and validating it
+is pure CPU work: the user is not looked up, and the revocations made by
+other processes are picked up at most every REVOCATION_REFRESH_INTERVAL
+seconds. Signed tokens are not renewed by validation. Logging out
+revokes every token issued to the user so far and terminating a session
+revokes its token id, the revocations are stored in the "revoked_users" and
+"revoked_tokens" sections and dropped once the tokens they cover expired.
+Stored sessions created before switching modes keep validating.
+
+Session events (created, validated, invalid, expired, terminated, reaped) are
+recorded to the EventLog given to the manager, see AuthManager.
 """
-import random
-import string
-from datetime import datetime, timedelta, timezone
+import heapq
+import secrets
+import time
+from datetime import datetime
 from auth import AuthManager
+from events import DEBUG, INFO
+from storage import transactional
 
 class SessionManager(AuthManager):
-    def __init__(self):
-        super().__init__() # Initializing AuthManager
+    REAP_BATCH_SIZE = 256 # Expired sessions purged per lazy reaper run
+    SLIDING_EXPIRATION = True # Extend the session expiry on every successful validation
+    RENEWAL_GRANULARITY = 60 # Persist an extended expiry only once it moved by 60 seconds
+    REVOCATION_REFRESH_INTERVAL = 1.0 # Signed token checks pick up other processes' revocations once a second
+    METRICS_CHECKS = AuthManager.METRICS_CHECKS + ("create_session", "validate_session", "validate_token")
+    METRICS_TIMED = AuthManager.METRICS_TIMED + ("_save_session",)
+
+    def __init__(self, storage=None, hasher=None, hash_pool=None, throttle=None, signer=None, events=None,
+                 metrics=None):
+        """
+        Args:
+            storage, hasher, hash_pool, throttle, events, metrics: see AuthManager
+            signer (TokenSigner, optional): signs stateless session tokens. Defaults to None,
+                which stores every session server side.
+        """
+        super().__init__(storage, hasher, hash_pool, throttle, events, metrics) # Initializing AuthManager
+        self.signer = signer
+        self.data.setdefault("sessions", {})
+        self.data.setdefault("revoked_tokens", {})
+        self.data.setdefault("revoked_users", {})
+        self._prune_revocations_at = 64
+        self._revocations_refreshed_at = time.monotonic()
+        self._build_session_index()
+        self.storage.add_listener(self._on_storage_changes)
+
+    def _build_session_index(self):
+        """Index the sessions of each user and build the expiry heap
+
+        self._user_sessions maps a username to the set of its session tokens.
+        self._expiry_heap holds (expires_at, session_token) pairs, entries of
+        ended or extended sessions are skipped when they reach the top.
+        Sessions stored in the legacy per-user session_token slot are carried
+        over into the session store, and ISO expiry times are converted to
+        epoch seconds. Lazily loaded stores (see MappedFileBackend) skip the
+        legacy slots, they are only carried over by an eagerly loaded backend.
+        """
+        sessions = self.data["sessions"]
+        if not self.storage.lazy: # Scanning every user would parse a whole lazily loaded store
+            for username, user in self.data["users"].items():
+                if user.get("session_token") and user["session_token"] not in sessions:
+                    sessions[user["session_token"]] = {"username": username, "expires_at": user.get("expires_at")}
+        # Built aside and published at once, readers never see a half built index
+        user_sessions = {}
+        expiry_heap = []
+        for session_token, session in sessions.items():
+            if not isinstance(session["expires_at"], int):
+                session["expires_at"] = _to_epoch(session["expires_at"])
+            user_sessions.setdefault(session["username"], set()).add(session_token)
+            expiry_heap.append((session["expires_at"], session_token))
+        heapq.heapify(expiry_heap)
+        self._user_sessions = user_sessions
+        self._expiry_heap = expiry_heap
+        self._persisted_expiry = {}
+
+    def _on_storage_changes(self, changes):
+        """Update the session indexes after other processes changed the store
+
+        Args:
+            changes (list): (section, key, old_value) tuples, None after a full reload
+        """
+        if changes is None:
+            self.data.setdefault("sessions", {})
+            self._build_session_index()
+            return
+        for section, session_token, old_session in changes:
+            if section != "sessions":
+                continue
+            if old_session is not None:
+                self._unindex_session(old_session["username"], session_token)
+            session = self.data["sessions"].get(session_token)
+            if session is not None:
+                self._user_sessions.setdefault(session["username"], set()).add(session_token)
+                heapq.heappush(self._expiry_heap, (session["expires_at"], session_token))
+
+    def _unindex_session(self, username: str, session_token: str):
+        """Remove an ended session from the per-user token index
+
+        Args:
+            username (str): username owning the session
+            session_token (str): session token
+        """
+        self._persisted_expiry.pop(session_token, None)
+        user_sessions = self._user_sessions.get(username)
+        if user_sessions is not None:
+            user_sessions.discard(session_token)
+            if not user_sessions:
+                del self._user_sessions[username]
+
+    def _save_session(self, session_token: str):
+        """Persist a single session record (deleted if it no longer exists)
+
+        Args:
+            session_token (str): session token
+        """
+        self.storage.put("sessions", session_token, self.data["sessions"].get(session_token))
     
     def _generate_session_token(self):
         """Generate a random session token
@@ -32,11 +166,63 @@ class SessionManager(AuthManager):
         Returns:
             str: A randomly generated session token.
         """
-        return ''.join(random.choices(string.ascii_letters + string.digits, k=16))
+        return secrets.token_urlsafe(12)
     
     def create_session(self, username: str):
         """Create a session for a logged in user.
 
+        Args:
+            username (str): username
+
+        Returns:
+            str: session token if user exists, None otherwise
+        """
+        if self.signer is not None:
+            return self._create_signed_session(username)
+        return self._create_stored_session(username)
+
+    def _create_signed_session(self, username: str):
+        """Issue a signed token, nothing is stored
+
+        The claims are [username, role stamp, expires_at, issued_at (epoch
+        milliseconds), token id].
+
+        Args:
+            username (str): username
+
+        Returns:
+            str: signed session token if user exists, None otherwise
+        """
+        user = self.data['users'].get(username)
+        if user is None:
+            self._report(f"User '{username} not found.'")
+            return None
+        
+        expiry_time = int(time.time()) + self.SESSION_DURATION
+        session_token = self.signer.sign([username, self._token_stamp(user), expiry_time,
+                                          time.time_ns() // 1000000, secrets.token_hex(8)])
+        self._report(f"Session created for user '{username}'. Session token: {session_token}",
+                     "session.created", username=username, mode="signed")
+        return session_token
+
+    def _token_stamp(self, user: dict):
+        """Stamp of a user's authorization state carried by signed tokens
+
+        Validation does not look the user up, so a writer changing the role
+        of a user must revoke the user's tokens, as logout_user does.
+
+        Args:
+            user (dict): user record
+
+        Returns:
+            str: the user's role
+        """
+        return user.get('role')
+
+    @transactional
+    def _create_stored_session(self, username: str):
+        """Create a session stored server side under a random token
+
         Args:
             username (str): username
 
@@ -44,18 +230,21 @@ class SessionManager(AuthManager):
             str: session token if user exists, None otherwise
         """
         if username not in self.data['users']:
-            print(f"User '{username} not found.'")
+            self._report(f"User '{username} not found.'")
             return None
         
+        self._reap_expired_sessions(self.REAP_BATCH_SIZE)
         session_token = self._generate_session_token()
-        expiry_time = (datetime.now(timezone.utc) + timedelta(seconds=self.SESSION_DURATION)).isoformat()
+        expiry_time = int(time.time()) + self.SESSION_DURATION
         
-        #Update session information
-        self.data['users'][username]['session_token'] = session_token
-        self.data['users'][username]['expires_at'] = expiry_time
-        self._save_user_data()
+        #Store the session under its token, earlier sessions of the user stay valid
+        self.data['sessions'][session_token] = {"username": username, "expires_at": expiry_time}
+        self._user_sessions.setdefault(username, set()).add(session_token)
+        heapq.heappush(self._expiry_heap, (expiry_time, session_token))
+        self._save_session(session_token)
         
-        print(f"Session created for user '{username}'. Session token: {session_token}")
+        self._report(f"Session created for user '{username}'. Session token: {session_token}",
+                     "session.created", username=username, mode="stored")
         return session_token
         
     def validate_session(self, username: str, session_token: str):
@@ -68,23 +257,277 @@ class SessionManager(AuthManager):
         Returns:
             bool: True if session is valid, False otherwise
         """
+        if self.signer is not None and self.signer.is_signed(session_token):
+            if self._validate_signed_token(session_token) != username:
+                self._report(f"Invalid session token.", "session.invalid", INFO, username=username, reason="token")
+                return False
+            self._report(f"Session is valid.", "session.validated", DEBUG, username=username)
+            return True
+        
+        self._refresh_data()
         if username not in self.data['users']:
-            print(f"User '{username}' not found.\nSession cannot be created.")
+            self._report(f"User '{username}' not found.\nSession cannot be created.",
+                         "session.invalid", INFO, username=username, reason="unknown_user")
             return False
         
-        user = self.data['users'][username]
-        if user['session_token'] != session_token:
-            print(f"Invalid session token.")
+        session = self.data['sessions'].get(session_token)
+        if session is None or session['username'] != username:
+            self._report(f"Invalid session token.", "session.invalid", INFO, username=username, reason="token")
             return False
         
-        expiry_time = datetime.fromisoformat(user['expires_at'])
-        if datetime.now(timezone.utc) > expiry_time:
-            print(f"Session Expired.")
+        now = time.time()
+        if now > session['expires_at']:
+            self._report(f"Session Expired.", "session.expired", INFO, username=username)
             return False
         
-        print(f"Session is valid.")
+        self._renew_session(session_token, session, now)
+        self._report(f"Session is valid.", "session.validated", DEBUG, username=username)
         return True
-    
-    # For future session termination if database structure is implemented
-    """def terminate_session(self, username: str):
-        pass"""
+
+    def validate_token(self, session_token: str):
+        """Validate a session token without knowing the user
+
+        Intended for bearer token checks, it does a single lookup in the
+        session store and prints nothing.
+
+        Args:
+            session_token (str): session token
+
+        Returns:
+            str: username owning the session if it is valid, None otherwise
+        """
+        if self.signer is not None and self.signer.is_signed(session_token):
+            return self._validate_signed_token(session_token)
+        self._refresh_data()
+        session = self.data['sessions'].get(session_token)
+        if session is None:
+            return None
+        now = time.time()
+        if now > session['expires_at']:
+            return None
+        self._renew_session(session_token, session, now)
+        return session['username']
+
+    def _validate_signed_token(self, session_token: str):
+        """Validate a signed token from its claims and the in-memory revocations
+
+        The revocations are refreshed from other processes once
+        REVOCATION_REFRESH_INTERVAL seconds have passed since the last time.
+
+        Args:
+            session_token (str): signed session token
+
+        Returns:
+            str: username owning the token if it is valid, None otherwise
+        """
+        claims = self.signer.verify(session_token)
+        if claims is None or len(claims) != 5:
+            return None
+        username, _, expires_at, issued_at, token_id = claims
+        if time.time() > expires_at:
+            return None
+        now = time.monotonic()
+        if now - self._revocations_refreshed_at >= self.REVOCATION_REFRESH_INTERVAL:
+            self._revocations_refreshed_at = now
+            self._refresh_data()
+        if token_id in self.data['revoked_tokens'] or issued_at <= self.data['revoked_users'].get(username, -1):
+            return None
+        return username
+
+    def _renew_session(self, session_token: str, session: dict, now: float):
+        """Slide the expiry of a session that has just been used
+
+        The expiry is always extended in memory. It is written to storage
+        only when it moved by at least RENEWAL_GRANULARITY seconds since it
+        was last persisted, so a busy session costs one write per granularity
+        period instead of one per request.
+
+        Args:
+            session_token (str): session token
+            session (dict): session record
+            now (float): current epoch time
+        """
+        if not self.SLIDING_EXPIRATION:
+            return
+        expiry_time = int(now) + self.SESSION_DURATION
+        if expiry_time <= session['expires_at']:
+            return
+        with self._lock:
+            session = self.data['sessions'].get(session_token)
+            if session is None or expiry_time <= session['expires_at']:
+                return # Ended or renewed by another thread in the meantime
+            persisted = self._persisted_expiry.pop(session_token, session['expires_at'])
+            self.data['sessions'][session_token] = dict(session, expires_at=expiry_time)
+            if expiry_time - persisted >= self.RENEWAL_GRANULARITY:
+                self._persist_renewal(session_token, expiry_time)
+            else:
+                self._persisted_expiry[session_token] = persisted
+
+    @transactional
+    def _persist_renewal(self, session_token: str, expiry_time: int):
+        """Write an extended session expiry to storage
+
+        Args:
+            session_token (str): session token
+            expiry_time (int): new expiry time in epoch seconds
+        """
+        session = self.data['sessions'].get(session_token)
+        if session is None:
+            return # Ended in the meantime
+        if expiry_time > session['expires_at']:
+            self.data['sessions'][session_token] = dict(session, expires_at=expiry_time)
+        self._save_session(session_token)
+
+    @transactional
+    def logout_user(self, username: str):
+        """Log out the user and end every session of the user
+
+        Args:
+            username (str): username
+
+        Returns:
+            bool: True if log out is successful, False otherwise
+        """
+        session_tokens = self._user_sessions.pop(username, ())
+        for session_token in session_tokens:
+            self.data['sessions'].pop(session_token, None)
+            self._persisted_expiry.pop(session_token, None)
+        if session_tokens:
+            self.storage.apply([("sessions", session_token, None) for session_token in session_tokens])
+        if self.signer is not None and username in self.data['users']:
+            self._revoke('revoked_users', username, time.time_ns() // 1000000) # Every token issued so far
+        return super().logout_user(username)
+
+    @transactional
+    def terminate_session(self, session_token: str):
+        """End a single session
+
+        Args:
+            session_token (str): session token
+
+        Returns:
+            bool: True if the session is terminated, False if it does not exist
+        """
+        if self.signer is not None and self.signer.is_signed(session_token):
+            return self._terminate_signed_session(session_token)
+        
+        session = self.data['sessions'].pop(session_token, None)
+        if session is None:
+            self._report(f"Session not found.")
+            return False
+        
+        self._unindex_session(session['username'], session_token)
+        self._save_session(session_token)
+        self._report(f"Session terminated for user '{session['username']}'.",
+                     "session.terminated", username=session['username'], mode="stored")
+        return True
+
+    def _terminate_signed_session(self, session_token: str):
+        """Revoke a signed token until it expires
+
+        Args:
+            session_token (str): signed session token
+
+        Returns:
+            bool: True if the token is revoked, False if it is not valid
+        """
+        username = self._validate_signed_token(session_token)
+        if username is None:
+            self._report(f"Session not found.")
+            return False
+        
+        _, _, expires_at, _, token_id = self.signer.verify(session_token)
+        self._revoke('revoked_tokens', token_id, expires_at)
+        self._report(f"Session terminated for user '{username}'.", "session.terminated", username=username, mode="signed")
+        return True
+
+    def _revoke(self, section: str, key: str, value: int):
+        """Store a revocation, dropping expired ones once the list doubled since the last pruning
+
+        Args:
+            section (str): "revoked_tokens" (token id -> expiry) or "revoked_users"
+                (username -> epoch milliseconds before which tokens are revoked)
+            key (str): token id or username
+            value (int): expiry or revocation time
+        """
+        self.data[section][key] = value
+        self.storage.put(section, key, value)
+        revocations = len(self.data['revoked_tokens']) + len(self.data['revoked_users'])
+        if revocations >= self._prune_revocations_at:
+            self._prune_revocations()
+            revocations = len(self.data['revoked_tokens']) + len(self.data['revoked_users'])
+            self._prune_revocations_at = max(64, 2 * revocations)
+
+    def _prune_revocations(self):
+        """Drop the revocations of tokens that have expired anyway, the caller holds the writer lock
+
+        Returns:
+            int: number of revocations dropped
+        """
+        now = time.time()
+        cutoff = int((now - self.SESSION_DURATION) * 1000) # Tokens issued earlier have expired
+        changes = [('revoked_tokens', token_id, None)
+                   for token_id, expires_at in self.data['revoked_tokens'].items() if expires_at < now]
+        changes += [('revoked_users', username, None)
+                    for username, revoked_at in self.data['revoked_users'].items() if revoked_at < cutoff]
+        for section, key, _ in changes:
+            del self.data[section][key]
+        if changes:
+            self.storage.apply(changes)
+        return len(changes)
+
+    def reap_expired_sessions(self):
+        """Purge every expired session from the session store, and the revocations of expired signed tokens
+
+        Returns:
+            int: number of sessions purged
+        """
+        purged = self._reap_expired_sessions()
+        with self._lock, self.storage.transaction():
+            self._prune_revocations()
+        return purged
+
+    @transactional
+    def _reap_expired_sessions(self, limit: int = None):
+        """Pop expired sessions off the expiry heap and delete them in one batch
+
+        Args:
+            limit (int, optional): maximum number of sessions to purge. Defaults to None (no limit).
+
+        Returns:
+            int: number of sessions purged
+        """
+        now = time.time()
+        heap = self._expiry_heap
+        sessions = self.data['sessions']
+        expired = []
+        while heap and heap[0][0] < now and (limit is None or len(expired) < limit):
+            expires_at, session_token = heapq.heappop(heap)
+            session = sessions.get(session_token)
+            if session is None:
+                continue # Already ended
+            if session['expires_at'] != expires_at:
+                heapq.heappush(heap, (session['expires_at'], session_token)) # Extended since
+                continue
+            del sessions[session_token]
+            self._unindex_session(session['username'], session_token)
+            expired.append(session_token)
+        if expired:
+            self.storage.apply([("sessions", session_token, None) for session_token in expired])
+            if self.events is not None:
+                self.events.emit("session.reaped", INFO, count=len(expired))
+        return len(expired)
+
+
+def _to_epoch(expires_at):
+    """Convert a stored expiry time to epoch seconds
+
+    Args:
+        expires_at (str): ISO 8601 expiry time, or None
+
+    Returns:
+        int: expiry time in epoch seconds, 0 (already expired) if unset
+    """
+    if expires_at is None:
+        return 0
+    return int(datetime.fromisoformat(expires_at).timestamp())
@@ -0,0 +1,2241 @@
+"""
+Storage backends for the authentication and RBAC data stores
+
+This module decouples AuthManager and RBACManager from the format their data
+is persisted in. Every backend works on the same document layout the managers
+already use (a dict of sections such as "users", "roles" and "permissions",
+each mapping a key to a record), but lets a manager persist a single changed
+record instead of rewriting the whole document.
+
+Classes:
+    StorageBackend:
+        Base interface shared by all storage backends.
+    JSONFileBackend:
+        Keeps the whole document in a single JSON file (the original format).
+    JournalBackend:
+        JSON file snapshot plus an append-only journal of changes, compacted
+        into a new snapshot in the background.
+    SQLiteBackend:
+        Keeps one row per record in a SQLite database running in WAL mode,
+        indexed on username, session token and role.
+    SharedJournalBackend:
+        Journaled JSON store that several processes can read and write at once,
+        using fcntl file locks and a version counter.
+    MappedFileBackend:
+        Journaled store whose snapshot is a sorted, indexed file opened with
+        mmap, records are only parsed when they are first looked up.
+    GroupCommitBackend:
+        Wraps another backend and coalesces the changes made within a short
+        window into a single persist call.
+    HashRing:
+        Consistent hash ring mapping keys to node names.
+    ShardedBackend:
+        Partitions records across several backends by consistent hashing on
+        their key, shards can be added while the store is in use.
+    StorageConflictError:
+        Raised when a change conflicts with a change made by another process.
+
+Functions:
+    transactional(method):
+        Decorator running a manager method inside a storage transaction.
+
+Notes:
+    A change is a (section, key, value) tuple. A value of None deletes the record.
+"""
+import atexit
+import bisect
+import collections.abc
+import contextlib
+import copy
+import fcntl
+import functools
+import json
+import mmap
+import os
+import sqlite3
+import stat
+import struct
+import tempfile
+import threading
+import time
+import zlib
+
+
+class StorageConflictError(Exception):
+    """A change conflicts with a change made by another process since the last refresh"""
+
+
+def transactional(method):
+    """Run a manager method as a write, under the manager's writer lock and a storage transaction
+
+    Args:
+        method (callable): method of a manager having a storage attribute and
+            a _lock attribute (a threading.RLock serializing its writers)
+
+    Returns:
+        callable: the wrapped method
+    """
+    @functools.wraps(method)
+    def wrapper(self, *args, **kwargs):
+        with self._lock, self.storage.transaction():
+            return method(self, *args, **kwargs)
+    return wrapper
+
+
+class StorageBackend:
+    """Base interface for storage backends
+
+    Subclasses must implement load, apply and save. Point lookups and the
+    index queries fall back to scanning the loaded document.
+    """
+
+    lazy = False # True when the loaded document parses records on first access
+    metrics = None # Metrics registry recording the size of writes, see attach_metrics
+
+    def __init__(self, default: dict):
+        """
+        Args:
+            default (dict): empty document returned when nothing has been stored yet
+        """
+        self.default = default
+        self._listeners = []
+
+    def add_listener(self, callback):
+        """Register a callback for changes made to the document by other processes
+
+        The callback receives a list of (section, key, old_value) tuples for the
+        records that changed, or None when the whole document was reloaded.
+
+        Args:
+            callback (callable): function called after the document was updated
+        """
+        self._listeners.append(callback)
+
+    def attach_metrics(self, metrics):
+        """Record the size of every write in a metrics registry
+
+        Incremental writes (journal appends, row upserts) are recorded in the
+        "storage_append_bytes" histogram, whole document writes in "storage_snapshot_bytes".
+
+        Args:
+            metrics (Metrics): registry, see metrics.py
+        """
+        self.metrics = metrics
+
+    def _notify(self, changes):
+        """Call the registered listeners
+
+        Args:
+            changes (list): (section, key, old_value) tuples, None for a full reload
+        """
+        for callback in self._listeners:
+            callback(changes)
+
+    def transaction(self):
+        """Hold the store exclusively for a read-modify-write sequence
+
+        Backends shared between processes bring the document up to date when
+        the transaction starts and keep other writers out until it ends.
+
+        Returns:
+            context manager: a no-op for single process backends
+        """
+        return contextlib.nullcontext()
+
+    def refresh(self):
+        """Pick up changes made by other processes, a no-op for single process backends"""
+
+    def refresh_due(self):
+        """Tell whether refresh has anything to do yet
+
+        Lets callers take their own locks only when a refresh is due.
+
+        Returns:
+            bool: False for single process backends
+        """
+        return False
+
+    def rebalance(self, batch_size: int = 1000):
+        """Move a batch of records to the shard owning them, see ShardedBackend
+
+        Args:
+            batch_size (int, optional): records moved at most. Defaults to 1000.
+
+        Returns:
+            int: records moved, always 0 for unsharded backends
+        """
+        return 0
+
+    def _empty_document(self):
+        """Build a fresh empty document
+
+        Returns:
+            dict: a copy of the default document with an empty dict per section
+        """
+        return {section: {} for section in self.default}
+
+    def load(self):
+        """Load the whole document
+
+        Returns:
+            dict: the stored document, or an empty document if nothing is stored
+        """
+        raise NotImplementedError
+
+    def apply(self, changes):
+        """Persist a batch of record level changes
+
+        Args:
+            changes (iterable): (section, key, value) tuples, value None deletes the record
+        """
+        raise NotImplementedError
+
+    def save(self, data: dict):
+        """Replace the whole stored document
+
+        Args:
+            data (dict): document to store
+        """
+        raise NotImplementedError
+
+    def put(self, section: str, key: str, value):
+        """Insert or update a single record
+
+        Args:
+            section (str): document section, e.g. "users"
+            key (str): record key, e.g. the username
+            value: record to store, None deletes the record
+        """
+        self.apply([(section, key, value)])
+
+    def delete(self, section: str, key: str):
+        """Delete a single record
+
+        Args:
+            section (str): document section
+            key (str): record key
+        """
+        self.apply([(section, key, None)])
+
+    def get(self, section: str, key: str):
+        """Look up a single record
+
+        Args:
+            section (str): document section
+            key (str): record key
+
+        Returns:
+            the stored record, None if it does not exist
+        """
+        return self.load().get(section, {}).get(key)
+
+    def iter_records(self, section: str):
+        """Iterate over the records of a section while writers go on
+
+        Walks a snapshot of the keys of the loaded document and reads each
+        record when it is reached, so records deleted meanwhile are skipped.
+
+        Args:
+            section (str): document section, e.g. "users"
+
+        Returns:
+            iterator: (key, record) tuples
+        """
+        records = self.load().get(section, {})
+        for key in list(records):
+            record = records.get(key)
+            if record is not None:
+                yield key, record
+
+    def find_by_token(self, session_token: str):
+        """Find the user owning a session token
+
+        Args:
+            session_token (str): session token
+
+        Returns:
+            str: username if the token is found, None otherwise
+        """
+        session = self.get("sessions", session_token)
+        if session is not None:
+            return session["username"]
+        for username, record in self.load().get("users", {}).items():
+            if isinstance(record, dict) and record.get("session_token") == session_token:
+                return username
+        return None
+
+    def find_by_role(self, role: str):
+        """Find all users holding a role
+
+        Args:
+            role (str): role name
+
+        Returns:
+            list: usernames holding the role
+        """
+        return [username for username, record in self.load().get("users", {}).items()
+                if role in _record_roles(record)]
+
+    def flush(self):
+        """Make sure every change applied so far is durable"""
+
+    def close(self):
+        """Flush pending changes and release any resources held by the backend"""
+        self.flush()
+
+
+class JSONFileBackend(StorageBackend):
+    """Keep the whole document in one JSON file
+
+    Every change rewrites the complete file, which keeps the on-disk format
+    identical to what AuthManager and RBACManager have always written.
+    """
+
+    def __init__(self, path: str, default: dict):
+        """
+        Args:
+            path (str): path to the JSON file
+            default (dict): empty document returned when the file does not exist
+        """
+        super().__init__(default)
+        self.path = path
+        self.data = None
+
+    def load(self):
+        """Load the JSON file
+
+        Returns:
+            dict: file content if present and valid, an empty document otherwise
+        """
+        if self.data is not None:
+            return self.data
+        try:
+            with open(self.path, 'r') as file:
+                self.data = json.load(file)
+        except (FileNotFoundError, json.JSONDecodeError):
+            self.data = self._empty_document()
+        for section in self.default:
+            self.data.setdefault(section, {})
+        return self.data
+
+    def apply(self, changes):
+        """Apply changes to the document and rewrite the JSON file
+
+        Args:
+            changes (iterable): (section, key, value) tuples, value None deletes the record
+        """
+        data = self.load()
+        for section, key, value in changes:
+            records = data.setdefault(section, {})
+            if value is None:
+                records.pop(key, None)
+            else:
+                records[key] = value
+        self._write(data)
+
+    def save(self, data: dict):
+        """Rewrite the JSON file with a new document
+
+        Args:
+            data (dict): document to store
+        """
+        self.data = data
+        self._write(data)
+
+    def _write(self, data: dict):
+        """Serialize the document to the JSON file
+
+        Args:
+            data (dict): document to store
+        """
+        size = _atomic_write(self.path, json.dumps(data, indent=4))
+        if self.metrics is not None:
+            self.metrics.record_size("storage_snapshot_bytes", size)
+
+
+class JournalBackend(JSONFileBackend):
+    """JSON snapshot plus an append-only journal of changes
+
+    The snapshot keeps the exact format written by JSONFileBackend, so the
+    two backends can be swapped on the same file. Each change is appended as
+    one JSON line to "<path>.journal" instead of rewriting the snapshot, and
+    the journal is replayed onto the snapshot when the document is loaded.
+    Once the journal grows past max_journal_bytes, or compact_interval seconds
+    have passed since the last compaction, a background thread folds it into
+    a new snapshot.
+
+    Compaction first rotates the journal to "<path>.journal.old" and only
+    removes it after the new snapshot has been atomically renamed into place.
+    Replaying a change twice is harmless, so a crash at any point loses nothing.
+    """
+
+    def __init__(self, path: str, default: dict, max_journal_bytes: int = 1024 * 1024,
+                 compact_interval: float = 60.0, fsync: bool = False):
+        """
+        Args:
+            path (str): path to the JSON snapshot file
+            default (dict): empty document returned when nothing has been stored yet
+            max_journal_bytes (int, optional): journal size triggering a compaction. Defaults to 1 MiB.
+            compact_interval (float, optional): seconds after which a non-empty journal is
+                compacted. Defaults to 60.
+            fsync (bool, optional): fsync the journal after every append. Defaults to False.
+        """
+        super().__init__(path, default)
+        self.journal_path = path + ".journal"
+        self.max_journal_bytes = max_journal_bytes
+        self.compact_interval = compact_interval
+        self.fsync = fsync
+        self._lock = threading.Lock()
+        self._journal = None
+        self._journal_bytes = 0
+        self._last_compaction = time.monotonic()
+        self._compactor = None
+
+    def load(self):
+        """Load the snapshot and replay the journal onto it
+
+        Returns:
+            dict: the stored document
+        """
+        if self.data is not None:
+            return self.data
+        data = super().load()
+        for journal_path in (self.journal_path + ".old", self.journal_path):
+            for _, section, key, value in _read_journal(journal_path)[0]:
+                _apply_change(data, section, key, value)
+        if os.path.exists(self.journal_path):
+            self._journal_bytes = os.path.getsize(self.journal_path)
+        return data
+
+    def apply(self, changes):
+        """Apply changes to the document and append them to the journal
+
+        Args:
+            changes (iterable): (section, key, value) tuples, value None deletes the record
+        """
+        data = self.load()
+        lines = []
+        with self._lock:
+            for section, key, value in changes:
+                _apply_change(data, section, key, value)
+                lines.append(json.dumps([section, key, value]) + "\n")
+            if not lines:
+                return
+            if self._journal is None:
+                self._journal = open(self.journal_path, 'a')
+            entry = "".join(lines)
+            self._journal.write(entry)
+            self._journal.flush()
+            if self.fsync:
+                os.fsync(self._journal.fileno())
+            self._journal_bytes += len(entry)
+            if self.metrics is not None:
+                self.metrics.record_size("storage_append_bytes", len(entry))
+            self._maybe_compact()
+
+    def save(self, data: dict):
+        """Write a full snapshot and discard the journal
+
+        Args:
+            data (dict): document to store
+        """
+        self.join()
+        with self._lock:
+            self.data = data
+            self._write(data)
+            self._close_journal()
+            for journal_path in (self.journal_path, self.journal_path + ".old"):
+                if os.path.exists(journal_path):
+                    os.remove(journal_path)
+            self._journal_bytes = 0
+            self._last_compaction = time.monotonic()
+
+    def compact(self, wait: bool = True):
+        """Fold the journal into a new snapshot
+
+        Args:
+            wait (bool, optional): block until the snapshot is written. Defaults to True.
+        """
+        self.load()
+        with self._lock:
+            self._start_compaction()
+        if wait:
+            self.join()
+
+    def join(self):
+        """Wait for a running background compaction to finish"""
+        compactor = self._compactor
+        if compactor is not None:
+            compactor.join()
+
+    def flush(self):
+        """Flush and fsync the journal"""
+        with self._lock:
+            if self._journal is not None:
+                self._journal.flush()
+                os.fsync(self._journal.fileno())
+
+    def close(self):
+        """Wait for compaction and close the journal"""
+        self.join()
+        self.flush()
+        with self._lock:
+            self._close_journal()
+
+    def _maybe_compact(self):
+        """Start a compaction when a threshold is reached, the caller holds the lock"""
+        if self._journal_bytes >= self.max_journal_bytes or (
+                self._journal_bytes and time.monotonic() - self._last_compaction >= self.compact_interval):
+            self._start_compaction()
+
+    def _start_compaction(self):
+        """Rotate the journal and write the snapshot in a background thread
+
+        The snapshot is taken while holding the lock so it matches the
+        rotated journal exactly, only the file I/O runs in the background.
+        """
+        if self._compactor is not None and self._compactor.is_alive():
+            return
+        self._close_journal()
+        if os.path.exists(self.journal_path + ".old"):
+            # A previous compaction did not finish, keep its journal and append the newer changes
+            with open(self.journal_path + ".old", 'a') as old, open(self.journal_path, 'a+') as journal:
+                journal.seek(0)
+                old.write(journal.read())
+            os.remove(self.journal_path)
+        elif os.path.exists(self.journal_path):
+            os.replace(self.journal_path, self.journal_path + ".old")
+        snapshot = self._take_snapshot()
+        self._journal_bytes = 0
+        self._last_compaction = time.monotonic()
+        self._compactor = threading.Thread(target=self._write_snapshot, args=(snapshot,), daemon=True)
+        self._compactor.start()
+
+    def _take_snapshot(self):
+        """Capture the document for a compaction, the caller holds the lock
+
+        Returns:
+            str: serialized document
+        """
+        return json.dumps(self.data, indent=4)
+
+    def _write_snapshot(self, snapshot: str):
+        """Atomically replace the snapshot, then drop the rotated journal
+
+        Args:
+            snapshot (str): serialized document, as returned by _take_snapshot
+        """
+        size = _atomic_write(self.path, snapshot)
+        if self.metrics is not None:
+            self.metrics.record_size("storage_snapshot_bytes", size)
+        if os.path.exists(self.journal_path + ".old"):
+            os.remove(self.journal_path + ".old")
+
+    def _close_journal(self):
+        """Close the open journal file, the caller holds the lock"""
+        if self._journal is not None:
+            self._journal.close()
+            self._journal = None
+
+
+class SharedJournalBackend(JournalBackend):
+    """Journaled JSON store shared by several processes
+
+    Every process appends to the same journal, each batch of changes tagged
+    with the next value of a store wide version counter. Writers serialize
+    on an advisory fcntl lock on "<path>.lock"; a transaction takes that lock
+    for a whole read-modify-write sequence and starts by catching up with the
+    journal, so checks made inside it see every committed change. Readers
+    catch up at most every refresh_interval seconds by reading only the
+    journal lines appended since their last read. Compaction happens under
+    the lock, replaces the snapshot and truncates the journal in place; a
+    process that finds a new snapshot reloads it instead.
+
+    A change applied outside a transaction is checked optimistically: if
+    another process changed the same record (or compacted the store) since
+    this process last caught up, StorageConflictError is raised and the
+    document is left matching the store.
+
+    Changes picked up from other processes are reported to the callbacks
+    registered with add_listener, so managers can update their indexes.
+    """
+
+    def __init__(self, path: str, default: dict, max_journal_bytes: int = 1024 * 1024,
+                 compact_interval: float = 60.0, fsync: bool = False, refresh_interval: float = 0.1):
+        """
+        Args:
+            path (str): path to the JSON snapshot file
+            default (dict): empty document returned when nothing has been stored yet
+            max_journal_bytes (int, optional): journal size triggering a compaction. Defaults to 1 MiB.
+            compact_interval (float, optional): seconds after which a non-empty journal is
+                compacted. Defaults to 60.
+            fsync (bool, optional): fsync the journal after every append. Defaults to False.
+            refresh_interval (float, optional): seconds readers may lag behind other
+                processes. Defaults to 0.1.
+        """
+        super().__init__(path, default, max_journal_bytes, compact_interval, fsync)
+        self.refresh_interval = refresh_interval
+        self.version = 0
+        self._lock = threading.RLock()
+        self._lock_file = open(path + ".lock", 'a')
+        self._lock_depth = 0
+        self._journal_offset = 0
+        self._snapshot_signature = None
+        self._last_refresh = 0.0
+
+    @contextlib.contextmanager
+    def _file_lock(self, operation: int):
+        """Hold the advisory file lock, re-entrant within this process
+
+        Args:
+            operation (int): fcntl.LOCK_EX or fcntl.LOCK_SH
+        """
+        with self._lock:
+            if self._lock_depth == 0:
+                fcntl.flock(self._lock_file.fileno(), operation)
+            self._lock_depth += 1
+            try:
+                yield
+            finally:
+                self._lock_depth -= 1
+                if self._lock_depth == 0:
+                    fcntl.flock(self._lock_file.fileno(), fcntl.LOCK_UN)
+
+    @contextlib.contextmanager
+    def transaction(self):
+        """Hold the store exclusively and catch up with other processes first"""
+        with self._file_lock(fcntl.LOCK_EX):
+            self.load()
+            self._catch_up()
+            yield
+
+    def load(self):
+        """Load the snapshot and replay the newer journal entries onto it
+
+        Returns:
+            dict: the stored document
+        """
+        if self.data is not None:
+            return self.data
+        with self._file_lock(fcntl.LOCK_SH):
+            self.data = self._read_store()
+        return self.data
+
+    def refresh(self):
+        """Catch up with changes made by other processes, at most every refresh_interval seconds"""
+        if not self.refresh_due():
+            return
+        with self._file_lock(fcntl.LOCK_SH):
+            self._catch_up()
+
+    def refresh_due(self):
+        """Tell whether refresh_interval has passed since the last catch up
+
+        Returns:
+            bool: True if refresh would read the journal
+        """
+        return self.data is not None and time.monotonic() - self._last_refresh >= self.refresh_interval
+
+    def apply(self, changes):
+        """Append changes to the journal under the file lock as one new version
+
+        Args:
+            changes (iterable): (section, key, value) tuples, value None deletes the record
+
+        Raises:
+            StorageConflictError: outside a transaction, when another process changed
+                one of the records since this process last caught up
+        """
+        changes = list(changes)
+        if not changes:
+            return
+        data = self.load()
+        with self._file_lock(fcntl.LOCK_EX):
+            in_transaction = self._lock_depth > 1
+            external = self._catch_up()
+            if not in_transaction:
+                changed_keys = {(section, key) for section, key, _ in changes}
+                if external is None or changed_keys & {(section, key) for section, key, _ in external}:
+                    raise StorageConflictError("Records were changed by another process, reload and retry.")
+            if os.path.exists(self.journal_path) and os.path.getsize(self.journal_path) > self._journal_offset:
+                # Cut off a torn line left behind by a crashed writer
+                os.truncate(self.journal_path, self._journal_offset)
+            self.version += 1
+            lines = []
+            for section, key, value in changes:
+                _apply_change(data, section, key, value)
+                lines.append(json.dumps([self.version, section, key, value]) + "\n")
+            entry = "".join(lines)
+            if self._journal is None:
+                self._journal = open(self.journal_path, 'a')
+            self._journal.write(entry)
+            self._journal.flush()
+            if self.fsync:
+                os.fsync(self._journal.fileno())
+            self._journal_offset += len(entry.encode())
+            self._journal_bytes = self._journal_offset
+            if self.metrics is not None:
+                self.metrics.record_size("storage_append_bytes", len(entry))
+            self._maybe_compact()
+
+    def save(self, data: dict):
+        """Write a full snapshot as a new version and empty the journal
+
+        Args:
+            data (dict): document to store
+        """
+        self.join()
+        with self._file_lock(fcntl.LOCK_EX):
+            self.version += 1
+            self.data = data
+            self._write_compacted()
+
+    def compact(self, wait: bool = True):
+        """Fold the journal into a new snapshot
+
+        Args:
+            wait (bool, optional): block until the snapshot is written. Defaults to True.
+        """
+        self.load()
+        with self._lock:
+            self._start_compaction()
+        if wait:
+            self.join()
+
+    def close(self):
+        """Wait for compaction, close the journal and release the lock file"""
+        super().close()
+        self._lock_file.close()
+
+    def _start_compaction(self):
+        """Compact in a background thread, the snapshot is written under the file lock"""
+        if self._compactor is not None and self._compactor.is_alive():
+            return
+        self._last_compaction = time.monotonic()
+        self._compactor = threading.Thread(target=self._compact_locked, daemon=True)
+        self._compactor.start()
+
+    def _compact_locked(self):
+        """Write the snapshot and empty the journal while holding the file lock
+
+        The background thread never changes the document itself: when other
+        processes wrote since this process last caught up, the compaction is
+        left to the next write that crosses a threshold.
+        """
+        with self._file_lock(fcntl.LOCK_EX):
+            entries, offset = _read_journal(self.journal_path, self._journal_offset)
+            journal_size = os.path.getsize(self.journal_path) if os.path.exists(self.journal_path) else 0
+            if entries or offset != journal_size or self._snapshot_stat() != self._snapshot_signature:
+                return
+            self._write_compacted()
+
+    def _write_compacted(self):
+        """Write the snapshot tagged with the current version and truncate the journal
+
+        The caller holds the exclusive file lock. A crash between the two steps
+        is harmless, journal entries up to the snapshot version are skipped on load.
+        """
+        size = _atomic_write(self.path, json.dumps(dict(self.data, version=self.version), indent=4))
+        if self.metrics is not None:
+            self.metrics.record_size("storage_snapshot_bytes", size)
+        self._snapshot_signature = self._snapshot_stat()
+        self._close_journal()
+        with open(self.journal_path, 'a') as journal:
+            journal.truncate(0)
+        self._journal_offset = 0
+        self._journal_bytes = 0
+        self._last_compaction = time.monotonic()
+
+    def _snapshot_stat(self):
+        """Identify the current snapshot file, every compaction replaces it
+
+        Returns:
+            tuple: inode number and modification time, None if there is no snapshot
+        """
+        try:
+            stat = os.stat(self.path)
+        except FileNotFoundError:
+            return None
+        return stat.st_ino, stat.st_mtime_ns
+
+    def _read_store(self):
+        """Read the snapshot and the journal entries newer than it, the caller holds the file lock
+
+        Returns:
+            dict: the stored document
+        """
+        self._snapshot_signature = self._snapshot_stat()
+        try:
+            with open(self.path, 'r') as file:
+                data = json.load(file)
+        except (FileNotFoundError, json.JSONDecodeError):
+            data = self._empty_document()
+        snapshot_version = self.version = data.pop("version", 0)
+        for section in self.default:
+            data.setdefault(section, {})
+        entries, self._journal_offset = _read_journal(self.journal_path)
+        for version, section, key, value in entries:
+            if version is not None and version <= snapshot_version:
+                continue # The changes of a batch share a version, only skip those in the snapshot
+            _apply_change(data, section, key, value)
+            self.version = max(self.version, version or 0)
+        self._journal_bytes = self._journal_offset
+        self._last_refresh = time.monotonic()
+        return data
+
+    def _catch_up(self):
+        """Apply the journal entries appended by other processes, the caller holds the file lock
+
+        Returns:
+            list: (section, key, old_value) tuples of the records changed, None if the
+                journal was compacted by another process and the store was reloaded
+        """
+        entries, offset = _read_journal(self.journal_path, self._journal_offset)
+        self._last_refresh = time.monotonic()
+        journal_size = os.path.getsize(self.journal_path) if os.path.exists(self.journal_path) else 0
+        if self._snapshot_stat() != self._snapshot_signature or journal_size < self._journal_offset or (
+                journal_size > self._journal_offset and (not entries or entries[0][0] != self.version + 1)):
+            # Compacted by another process: reload in place so references to the document stay valid,
+            # swapping whole sections so lock-free readers always find every section
+            data = self._read_store()
+            for section in self.data:
+                data.setdefault(section, {})
+            self.data.update(data)
+            self._notify(None)
+            return None
+        changes = []
+        for version, section, key, value in entries:
+            records = self.data.setdefault(section, {})
+            changes.append((section, key, records.get(key)))
+            _apply_change(self.data, section, key, value)
+            self.version = version
+        self._journal_offset = offset
+        self._journal_bytes = offset
+        if changes:
+            self._notify(changes)
+        return changes
+
+
+_MAPPED_MAGIC = b"AUTHMAP1"
+_INDEX_ENTRY = struct.Struct("<QII") # record offset, key length, value length
+_TRAILER = struct.Struct("<Q8s") # footer offset, magic
+_MISSING = object()
+_DELETED = object()
+
+
+class MappedFileBackend(JournalBackend):
+    """Journaled store with a memory-mapped, indexed snapshot
+
+    The snapshot at path holds every section's records sorted by key, each
+    one serialized as JSON, followed by a fixed width index per section
+    (offset, key length, value length) and a small footer locating the
+    indexes. Loading only maps the file and reads the footer, so opening a
+    store costs the same whatever its size. A record is parsed the first
+    time it is looked up (a binary search over the index), and the mapped
+    pages live in the page cache, shared by every process opening the file.
+
+    Changes are journaled exactly like JournalBackend. Compaction merges the
+    records changed since the last snapshot with the unchanged ones, which
+    are copied byte for byte without being parsed.
+
+    A JSON store written by JSONFileBackend or JournalBackend is copied to
+    the indexed format in "<path>.map" the first time it is loaded, and the
+    changes are journaled to "<path>.map.journal". The JSON store itself is
+    never written, so the JSON backends keep reading it, without the changes
+    made through this backend. Iterating a whole section parses every record,
+    so managers that index all users on load (RBACManager) gain little from
+    this backend, AuthManager and SessionManager only touch the users they
+    are asked about.
+    """
+    lazy = True
+
+    def __init__(self, path: str, default: dict, max_journal_bytes: int = 1024 * 1024,
+                 compact_interval: float = 60.0, fsync: bool = False):
+        """
+        Args:
+            path (str): path to the snapshot file. When it does not hold an indexed
+                snapshot, the store lives in "<path>.map" and a JSON store at path is its source.
+            default (dict): empty document returned when nothing has been stored yet
+            max_journal_bytes (int, optional): journal size triggering a compaction. Defaults to 1 MiB.
+            compact_interval (float, optional): seconds after which a non-empty journal is
+                compacted. Defaults to 60.
+            fsync (bool, optional): fsync the journal after every append. Defaults to False.
+        """
+        self.source_path = path
+        if not _is_mapped_file(path):
+            path += ".map"
+        super().__init__(path, default, max_journal_bytes, compact_interval, fsync)
+
+    @staticmethod
+    def write_records(path: str, sections: dict):
+        """Write a snapshot straight from streams of records, without building a document
+
+        Meant for generating or converting large stores, the records are
+        serialized as they are consumed. Any journal next to path is not touched.
+
+        Args:
+            path (str): snapshot file path
+            sections (dict): section name mapped to an iterable of (key, record) tuples,
+                sorted by the UTF-8 encoded key
+
+        Returns:
+            int: size of the snapshot file
+        """
+        return _write_mapped_file(path, {name: ((key.encode(), json.dumps(record).encode()) for key, record in records)
+                                         for name, records in sections.items()})
+
+    def load(self):
+        """Map the snapshot and replay the journal onto it
+
+        Returns:
+            dict: the stored document, its sections parse records on first access
+        """
+        if self.data is not None:
+            return self.data
+        data = self._open_snapshot()
+        for section in self.default:
+            data.setdefault(section, {})
+        for journal_path in (self.journal_path + ".old", self.journal_path):
+            for _, section, key, value in _read_journal(journal_path)[0]:
+                _apply_change(data, section, key, value)
+        if os.path.exists(self.journal_path):
+            self._journal_bytes = os.path.getsize(self.journal_path)
+        self.data = data
+        return data
+
+    def save(self, data: dict):
+        """Write a full snapshot and discard the journal
+
+        Args:
+            data (dict): document to store. If it is not the loaded document,
+                the backend serves the saved content from the new snapshot.
+        """
+        self.join()
+        with self._lock:
+            if data is self.data:
+                snapshot = self._take_snapshot()
+                self._rebase(snapshot, self._write_sections(snapshot))
+            else:
+                size = _write_mapped_file(self.path, {name: _plain_entries(records) for name, records in data.items()})
+                if self.metrics is not None:
+                    self.metrics.record_size("storage_snapshot_bytes", size)
+                self.data = None
+            self._close_journal()
+            for journal_path in (self.journal_path, self.journal_path + ".old"):
+                if os.path.exists(journal_path):
+                    os.remove(journal_path)
+            self._journal_bytes = 0
+            self._last_compaction = time.monotonic()
+        self.load()
+
+    def _take_snapshot(self):
+        """Capture the records changed since the last snapshot, the caller holds the lock
+
+        Returns:
+            dict: section name mapped to (section, index, changed records)
+        """
+        return {name: (records, records.index, dict(records.changes)) for name, records in self.data.items()}
+
+    def _write_snapshot(self, snapshot: dict):
+        """Write the merged snapshot, switch the sections over to it and drop the rotated journal
+
+        Args:
+            snapshot (dict): captured sections, as returned by _take_snapshot
+        """
+        mapped = self._write_sections(snapshot)
+        with self._lock:
+            self._rebase(snapshot, mapped)
+        if os.path.exists(self.journal_path + ".old"):
+            os.remove(self.journal_path + ".old")
+
+    def _write_sections(self, snapshot: dict):
+        """Write a new snapshot file from captured sections
+
+        Args:
+            snapshot (dict): section name mapped to (section, index, changed records)
+
+        Returns:
+            _MappedFile: the new snapshot file
+        """
+        size = _write_mapped_file(self.path, {name: _merged_entries(index, changes)
+                                              for name, (_, index, changes) in snapshot.items()})
+        if self.metrics is not None:
+            self.metrics.record_size("storage_snapshot_bytes", size)
+        return _MappedFile(self.path)
+
+    def _rebase(self, snapshot: dict, mapped):
+        """Switch the captured sections over to a new snapshot file, the caller holds the lock
+
+        Args:
+            snapshot (dict): section name mapped to (section, index, changed records)
+            mapped (_MappedFile): snapshot file holding the captured changes
+        """
+        for name, (records, _, changes) in snapshot.items():
+            records.rebase(mapped.sections.get(name, _EMPTY_INDEX), changes)
+
+    def _open_snapshot(self):
+        """Open the snapshot file, first copying a JSON source store to the indexed format
+
+        Returns:
+            _MappedDocument: document whose sections read from the mapped file
+        """
+        if not os.path.exists(self.path):
+            if self.source_path == self.path or not os.path.exists(self.source_path):
+                return _MappedDocument()
+            try:
+                with open(self.source_path, 'r') as file:
+                    document = json.load(file)
+            except json.JSONDecodeError:
+                document = {}
+            document.pop("version", None) # Written by SharedJournalBackend
+            source_journal = self.source_path + ".journal"
+            for journal_path in (source_journal + ".old", source_journal):
+                for _, section, key, value in _read_journal(journal_path)[0]:
+                    _apply_change(document, section, key, value)
+            _write_mapped_file(self.path, {name: _plain_entries(records) for name, records in document.items()})
+        mapped = _MappedFile(self.path)
+        return _MappedDocument({name: _MappedSection(index) for name, index in mapped.sections.items()})
+
+
+class _SectionIndex:
+    """Sorted key index of one section of a mapped snapshot file"""
+
+    def __init__(self, buffer, offset: int, count: int):
+        """
+        Args:
+            buffer (mmap.mmap): mapped snapshot file, None for an empty index
+            offset (int): position of the first index entry
+            count (int): number of records
+        """
+        self.buffer = buffer
+        self.offset = offset
+        self.count = count
+
+    def __len__(self):
+        return self.count
+
+    def _entry(self, position: int):
+        """Read an index entry
+
+        Returns:
+            tuple: (record offset, key length, value length)
+        """
+        return _INDEX_ENTRY.unpack_from(self.buffer, self.offset + position * _INDEX_ENTRY.size)
+
+    def find(self, key: bytes):
+        """Binary search for a key
+
+        Args:
+            key (bytes): UTF-8 encoded record key
+
+        Returns:
+            bytes: the serialized record, None if the key is not in the index
+        """
+        buffer = self.buffer
+        low, high = 0, self.count
+        while low < high:
+            middle = (low + high) // 2
+            offset, key_length, value_length = self._entry(middle)
+            current = buffer[offset:offset + key_length]
+            if current == key:
+                return buffer[offset + key_length:offset + key_length + value_length]
+            if current < key:
+                low = middle + 1
+            else:
+                high = middle
+        return None
+
+    def entries(self):
+        """Iterate over the raw records in key order
+
+        Returns:
+            iterator: (key bytes, serialized record) tuples
+        """
+        buffer = self.buffer
+        for position in range(self.count):
+            offset, key_length, value_length = self._entry(position)
+            yield buffer[offset:offset + key_length], buffer[offset + key_length:offset + key_length + value_length]
+
+
+_EMPTY_INDEX = _SectionIndex(None, 0, 0)
+
+
+class _MappedFile:
+    """Snapshot file mapped into memory, with one _SectionIndex per section"""
+
+    def __init__(self, path: str):
+        """
+        Args:
+            path (str): path to a snapshot written by _write_mapped_file
+
+        Raises:
+            ValueError: the file is not a mapped snapshot
+        """
+        with open(path, 'rb') as file:
+            buffer = mmap.mmap(file.fileno(), 0, access=mmap.ACCESS_READ)
+        footer_offset, magic = _TRAILER.unpack_from(buffer, len(buffer) - _TRAILER.size)
+        if magic != _MAPPED_MAGIC or buffer[:len(_MAPPED_MAGIC)] != _MAPPED_MAGIC:
+            raise ValueError(f"{path} is not a mapped snapshot")
+        footer = json.loads(buffer[footer_offset:len(buffer) - _TRAILER.size])
+        self.sections = {name: _SectionIndex(buffer, offset, count) for name, (offset, count) in footer.items()}
+
+
+class _MappedSection(collections.abc.MutableMapping):
+    """Section of a mapped document, parsing records from the snapshot on first access
+
+    Records looked up or assigned are kept in memory, deleted records are
+    marked as such. The records changed through the backend since the last
+    snapshot are tracked separately (changes) so a compaction writes only
+    those and copies everything else from the current snapshot.
+    """
+
+    def __init__(self, index: _SectionIndex = _EMPTY_INDEX):
+        """
+        Args:
+            index (_SectionIndex, optional): index of the section in the snapshot. Defaults to an empty index.
+        """
+        self.index = index
+        self.records = {}
+        self.changes = {}
+
+    def __getitem__(self, key):
+        value = self.records.get(key, _MISSING)
+        if value is _MISSING:
+            serialized = self.index.find(key.encode())
+            if serialized is None:
+                raise KeyError(key)
+            value = self.records.setdefault(key, json.loads(serialized))
+        if value is _DELETED:
+            raise KeyError(key)
+        return value
+
+    def __contains__(self, key):
+        value = self.records.get(key, _MISSING)
+        if value is _MISSING:
+            return self.index.find(key.encode()) is not None
+        return value is not _DELETED
+
+    def __setitem__(self, key, value):
+        self.records[key] = value
+
+    def __delitem__(self, key):
+        if key not in self:
+            raise KeyError(key)
+        self.records[key] = _DELETED
+
+    def __iter__(self):
+        records = self.records
+        index = self.index
+        for key, _ in index.entries():
+            key = key.decode()
+            if records.get(key) is not _DELETED:
+                yield key
+        for key, value in list(records.items()):
+            if value is not _DELETED and index.find(key.encode()) is None:
+                yield key
+
+    def __len__(self):
+        length = len(self.index)
+        for key, value in list(self.records.items()):
+            stored = self.index.find(key.encode()) is not None
+            if value is _DELETED and stored:
+                length -= 1
+            elif value is not _DELETED and not stored:
+                length += 1
+        return length
+
+    def items(self):
+        """Iterate over the records without keeping the ones not looked up yet in memory
+
+        Returns:
+            iterator: (key, record) tuples
+        """
+        records = self.records
+        for key, serialized in self.index.entries():
+            key = key.decode()
+            value = records.get(key, _MISSING)
+            if value is _MISSING:
+                yield key, json.loads(serialized)
+            elif value is not _DELETED:
+                yield key, value
+        for key, value in list(records.items()):
+            if value is not _DELETED and self.index.find(key.encode()) is None:
+                yield key, value
+
+    def __deepcopy__(self, memo):
+        duplicate = _MappedSection(self.index)
+        duplicate.records, duplicate.changes = copy.deepcopy((self.records, self.changes), memo)
+        return duplicate
+
+    def record_change(self, key: str, value):
+        """Apply a change persisted through the backend
+
+        Args:
+            key (str): record key
+            value: new record, None deletes the record
+        """
+        self.records[key] = _DELETED if value is None else value
+        self.changes[key] = value
+
+    def rebase(self, index: _SectionIndex, written: dict):
+        """Switch over to a new snapshot holding the given changes
+
+        Args:
+            index (_SectionIndex): index of the section in the new snapshot
+            written (dict): changes included in the new snapshot
+        """
+        self.index = index
+        for key, value in written.items():
+            if key in self.changes and self.changes[key] is value:
+                del self.changes[key]
+                if value is None and self.records.get(key) is _DELETED:
+                    del self.records[key]
+
+
+class _MappedDocument(dict):
+    """Document of MappedFileBackend, new sections are created as _MappedSection"""
+
+    def setdefault(self, section, default=None):
+        if section not in self:
+            records = self[section] = _MappedSection()
+            records.update(default or {})
+        return self[section]
+
+
+class SQLiteBackend(StorageBackend):
+    """Keep one row per record in a SQLite database
+
+    The database runs in WAL mode so readers never block the writer, and
+    every change is a row level upsert. The (section, key) primary key serves
+    username and session store lookups; legacy per-user session tokens and
+    role memberships have their own indexes so lookups stay constant cost as
+    the number of users grows.
+    """
+
+    SCHEMA = """
+        CREATE TABLE IF NOT EXISTS records (
+            section TEXT NOT NULL,
+            key TEXT NOT NULL,
+            value TEXT NOT NULL,
+            session_token TEXT,
+            PRIMARY KEY (section, key)
+        ) WITHOUT ROWID;
+        CREATE INDEX IF NOT EXISTS idx_records_session_token
+            ON records (session_token) WHERE session_token IS NOT NULL;
+        CREATE TABLE IF NOT EXISTS record_roles (
+            section TEXT NOT NULL,
+            key TEXT NOT NULL,
+            role TEXT NOT NULL,
+            PRIMARY KEY (section, key, role)
+        ) WITHOUT ROWID;
+        CREATE INDEX IF NOT EXISTS idx_record_roles_role
+            ON record_roles (role, section);
+    """
+
+    def __init__(self, path: str, default: dict):
+        """
+        Args:
+            path (str): path to the SQLite database file
+            default (dict): empty document, its keys are the sections of the store
+        """
+        super().__init__(default)
+        self.path = path
+        self._lock = threading.Lock()
+        self.connection = sqlite3.connect(path, check_same_thread=False)
+        self.connection.execute("PRAGMA journal_mode=WAL")
+        self.connection.execute("PRAGMA synchronous=NORMAL")
+        self.connection.executescript(self.SCHEMA)
+        self.connection.commit()
+
+    def load(self):
+        """Load every record into a document
+
+        Returns:
+            dict: the stored document
+        """
+        data = self._empty_document()
+        with self._lock:
+            rows = self.connection.execute("SELECT section, key, value FROM records").fetchall()
+        for section, key, value in rows:
+            data.setdefault(section, {})[key] = json.loads(value)
+        return data
+
+    def get(self, section: str, key: str):
+        """Look up a single record by its primary key
+
+        Args:
+            section (str): document section
+            key (str): record key
+
+        Returns:
+            the stored record, None if it does not exist
+        """
+        with self._lock:
+            row = self.connection.execute(
+                "SELECT value FROM records WHERE section = ? AND key = ?", (section, key)
+            ).fetchone()
+        return json.loads(row[0]) if row else None
+
+    def iter_records(self, section: str, batch_size: int = 1000):
+        """Stream the records of a section in key order, one batch of rows at a time
+
+        The lock is only held while a batch is read, so writers go on between
+        batches and the document is never loaded.
+
+        Args:
+            section (str): document section, e.g. "users"
+            batch_size (int, optional): rows read per query. Defaults to 1000.
+
+        Returns:
+            iterator: (key, record) tuples
+        """
+        with self._lock:
+            rows = self.connection.execute(
+                "SELECT key, value FROM records WHERE section = ? ORDER BY key LIMIT ?", (section, batch_size)
+            ).fetchall()
+        while rows:
+            for key, value in rows:
+                yield key, json.loads(value)
+            if len(rows) < batch_size:
+                return
+            with self._lock:
+                rows = self.connection.execute(
+                    "SELECT key, value FROM records WHERE section = ? AND key > ? ORDER BY key LIMIT ?",
+                    (section, rows[-1][0], batch_size)
+                ).fetchall()
+
+    def apply(self, changes):
+        """Upsert or delete the changed rows in a single transaction
+
+        Args:
+            changes (iterable): (section, key, value) tuples, value None deletes the record
+        """
+        size = 0
+        with self._lock, self.connection:
+            for section, key, value in changes:
+                self.connection.execute(
+                    "DELETE FROM record_roles WHERE section = ? AND key = ?", (section, key))
+                if value is None:
+                    self.connection.execute(
+                        "DELETE FROM records WHERE section = ? AND key = ?", (section, key))
+                    continue
+                size += self._upsert(section, key, value)
+        if self.metrics is not None:
+            self.metrics.record_size("storage_append_bytes", size)
+
+    def save(self, data: dict):
+        """Replace every stored record with the given document
+
+        Args:
+            data (dict): document to store
+        """
+        size = 0
+        with self._lock, self.connection:
+            self.connection.execute("DELETE FROM records")
+            self.connection.execute("DELETE FROM record_roles")
+            for section, records in data.items():
+                for key, value in records.items():
+                    size += self._upsert(section, key, value)
+        if self.metrics is not None:
+            self.metrics.record_size("storage_snapshot_bytes", size)
+
+    def _upsert(self, section: str, key: str, value):
+        """Write one record and its index entries, the caller holds the transaction
+
+        Args:
+            section (str): document section
+            key (str): record key
+            value: record to store
+
+        Returns:
+            int: size of the serialized record
+        """
+        session_token = value.get("session_token") if isinstance(value, dict) else None
+        serialized = json.dumps(value)
+        self.connection.execute(
+            "INSERT INTO records (section, key, value, session_token) VALUES (?, ?, ?, ?) "
+            "ON CONFLICT (section, key) DO UPDATE SET "
+            "value = excluded.value, session_token = excluded.session_token",
+            (section, key, serialized, session_token))
+        if section == "users":
+            self.connection.executemany(
+                "INSERT OR IGNORE INTO record_roles (section, key, role) VALUES (?, ?, ?)",
+                [(section, key, role) for role in _record_roles(value)])
+        return len(serialized)
+
+    def find_by_token(self, session_token: str):
+        """Find the user owning a session token through the token index
+
+        Args:
+            session_token (str): session token
+
+        Returns:
+            str: username if the token is found, None otherwise
+        """
+        session = self.get("sessions", session_token)
+        if session is not None:
+            return session["username"]
+        with self._lock:
+            row = self.connection.execute(
+                "SELECT key FROM records WHERE section = 'users' AND session_token = ?",
+                (session_token,)).fetchone()
+        return row[0] if row else None
+
+    def find_by_role(self, role: str):
+        """Find all users holding a role through the role index
+
+        Args:
+            role (str): role name
+
+        Returns:
+            list: usernames holding the role
+        """
+        with self._lock:
+            rows = self.connection.execute(
+                "SELECT key FROM record_roles WHERE role = ? AND section = 'users'",
+                (role,)).fetchall()
+        return [row[0] for row in rows]
+
+    def close(self):
+        """Close the database connection"""
+        with self._lock:
+            self.connection.close()
+
+
+class GroupCommitBackend(StorageBackend):
+    """Coalesce changes into group commits on top of another backend
+
+    Changes are buffered and handed to the wrapped backend in one apply call
+    once window seconds have passed since the first buffered change, or as
+    soon as max_ops distinct records are pending. Several changes to the same
+    record within a window collapse into the last one. A background thread
+    performs the commits, callers either block until their change is durable
+    (wait=True) or return right away. Pending changes are flushed by flush,
+    close and at interpreter exit.
+    """
+
+    def __init__(self, backend: StorageBackend, window: float = 0.005, max_ops: int = 256,
+                 wait: bool = False):
+        """
+        Args:
+            backend (StorageBackend): backend receiving the group commits
+            window (float, optional): seconds changes are collected for. Defaults to 0.005.
+            max_ops (int, optional): pending records forcing an early commit. Defaults to 256.
+            wait (bool, optional): default for apply, block until the change is durable.
+                Defaults to False.
+        """
+        super().__init__(backend.default)
+        self.backend = backend
+        self.lazy = backend.lazy
+        self.window = window
+        self.max_ops = max_ops
+        self.wait = wait
+        self._condition = threading.Condition()
+        self._pending = {}
+        self._first_pending_at = None
+        self._started = 0 # number of the last batch taken by the committer
+        self._committed = 0 # number of the last batch persisted
+        self._flush_requested = False
+        self._error = None
+        self._closed = False
+        self._committer = threading.Thread(target=self._run, daemon=True)
+        self._committer.start()
+        atexit.register(self.close)
+
+    def attach_metrics(self, metrics):
+        """Record the size of the writes made by the wrapped backend
+
+        Args:
+            metrics (Metrics): registry, see metrics.py
+        """
+        self.metrics = metrics
+        self.backend.attach_metrics(metrics)
+
+    def load(self):
+        """Flush pending changes and load the document from the wrapped backend
+
+        Returns:
+            dict: a private copy of the stored document, the committer thread
+                works on the wrapped backend's copy
+        """
+        self.flush()
+        return copy.deepcopy(self.backend.load())
+
+    def iter_records(self, section: str):
+        """Flush pending changes and stream the records of a section from the wrapped backend
+
+        Args:
+            section (str): document section, e.g. "users"
+
+        Returns:
+            iterator: (key, record) tuples
+        """
+        self.flush()
+        return self.backend.iter_records(section)
+
+    def get(self, section: str, key: str):
+        """Look up a single record, pending changes included
+
+        Args:
+            section (str): document section
+            key (str): record key
+
+        Returns:
+            the stored record, None if it does not exist
+        """
+        with self._condition:
+            if (section, key) in self._pending:
+                return copy.deepcopy(self._pending[(section, key)])
+        return self.backend.get(section, key)
+
+    def apply(self, changes, wait: bool = None):
+        """Queue changes for the next group commit
+
+        Args:
+            changes (iterable): (section, key, value) tuples, value None deletes the record
+            wait (bool, optional): block until the changes are durable. Defaults to the
+                value given to the constructor.
+
+        Raises:
+            RuntimeError: if the backend has been closed
+        """
+        if wait is None:
+            wait = self.wait
+        with self._condition:
+            if self._closed:
+                raise RuntimeError("Storage backend is closed.")
+            for section, key, value in changes:
+                # Copy so later in-place edits by the caller cannot leak into the commit
+                self._pending[(section, key)] = copy.deepcopy(value)
+            if self._first_pending_at is None:
+                self._first_pending_at = time.monotonic()
+            batch = self._started + 1
+            self._condition.notify_all()
+            if wait:
+                self._wait_for(batch)
+
+    def save(self, data: dict):
+        """Flush pending changes and replace the whole stored document
+
+        Args:
+            data (dict): document to store
+        """
+        self.flush()
+        self.backend.save(copy.deepcopy(data))
+
+    def find_by_token(self, session_token: str):
+        """Flush pending changes and find the user owning a session token
+
+        Args:
+            session_token (str): session token
+
+        Returns:
+            str: username if the token is found, None otherwise
+        """
+        self.flush()
+        return self.backend.find_by_token(session_token)
+
+    def find_by_role(self, role: str):
+        """Flush pending changes and find all users holding a role
+
+        Args:
+            role (str): role name
+
+        Returns:
+            list: usernames holding the role
+        """
+        self.flush()
+        return self.backend.find_by_role(role)
+
+    def flush(self):
+        """Commit pending changes now and wait until they are durable"""
+        with self._condition:
+            if self._pending:
+                self._flush_requested = True
+                self._condition.notify_all()
+            self._wait_for(self._started + 1 if self._pending else self._started)
+        self.backend.flush()
+
+    def close(self):
+        """Flush pending changes, stop the committer and close the wrapped backend"""
+        with self._condition:
+            if self._closed:
+                return
+        self.flush()
+        with self._condition:
+            self._closed = True
+            self._condition.notify_all()
+        self._committer.join()
+        self.backend.close()
+        atexit.unregister(self.close)
+
+    def _wait_for(self, batch: int):
+        """Block until a batch is committed, the caller holds the condition
+
+        Args:
+            batch (int): batch number
+
+        Raises:
+            Exception: the error raised by the wrapped backend, if the commit failed
+        """
+        while self._committed < batch:
+            self._condition.wait()
+        if self._error is not None:
+            error, self._error = self._error, None
+            raise error
+
+    def _run(self):
+        """Committer thread, collects a batch per window and applies it"""
+        while True:
+            with self._condition:
+                while not self._pending and not self._closed:
+                    self._condition.wait()
+                if not self._pending:
+                    return
+                deadline = self._first_pending_at + self.window
+                while (len(self._pending) < self.max_ops and not self._flush_requested
+                       and not self._closed):
+                    remaining = deadline - time.monotonic()
+                    if remaining <= 0:
+                        break
+                    self._condition.wait(remaining)
+                pending, self._pending = self._pending, {}
+                self._first_pending_at = None
+                self._flush_requested = False
+                self._started += 1
+                batch = self._started
+            error = None
+            try:
+                self.backend.apply([(section, key, value) for (section, key), value in pending.items()])
+            except Exception as e:
+                error = e
+            with self._condition:
+                self._committed = batch
+                if error is not None:
+                    self._error = error
+                self._condition.notify_all()
+
+
+class HashRing:
+    """Consistent hash ring mapping keys to node names
+
+    Each node is placed on the ring at vnodes points, a key belongs to the
+    node of the first point at or after its hash. Adding a node only moves
+    the keys falling on its points, about 1/(N+1) of them.
+    """
+
+    def __init__(self, nodes, vnodes: int = 160):
+        """
+        Args:
+            nodes (iterable): node names
+            vnodes (int, optional): points per node, more points spread the keys more evenly. Defaults to 160.
+        """
+        self.nodes = tuple(nodes)
+        self.vnodes = vnodes
+        points = sorted((zlib.crc32(f"{node}#{index}".encode()), node)
+                        for node in self.nodes for index in range(vnodes))
+        self._hashes = [point for point, _ in points]
+        self._owners = [node for _, node in points]
+
+    def lookup(self, key: str):
+        """Find the node owning a key
+
+        Args:
+            key (str): key, e.g. a username
+
+        Returns:
+            str: node name
+        """
+        index = bisect.bisect_left(self._hashes, zlib.crc32(key.encode()))
+        return self._owners[index if index < len(self._owners) else 0]
+
+
+class ShardedBackend(StorageBackend):
+    """Partition records across several backends by consistent hashing on their key
+
+    Every record, whatever its section, lives in the shard owning its key
+    on a HashRing of the shard names: users by username, sessions by token,
+    roles by role name. Each shard is an ordinary backend (JSON, journal,
+    SQLite, ...) holding its part of the document, so a write only touches
+    the shard owning the record and every shard stays a fraction of the
+    size. The loaded document routes each lookup to the owning shard, the
+    managers use it like any other document.
+
+    add_shard puts a new shard on the ring at once. The records it now owns
+    are moved to it in batches by rebalance, while they wait they are still
+    found in their old shard and a write moves them. Run rebalance from the
+    manager (AuthManager.rebalance, RBACManager.rebalance) so each batch is
+    moved under the manager's writer lock. If the process stops before the
+    rebalance is done, open the store with the old shards, call add_shard
+    again and finish the rebalance: a record still present in an old shard
+    is always the current one.
+
+    Sharding makes each shard's file and each write smaller, it does not let
+    writes run in parallel: a transaction holds the transaction of every
+    shard, in shard order, because a manager method does not tell in advance
+    which records it changes, and the manager's writer lock serializes its
+    writers anyway. Writers scale by tenant instead (see tenants.py), each
+    tenant having its own store and locks.
+    """
+
+    def __init__(self, shards: dict, default: dict, vnodes: int = 160):
+        """
+        Args:
+            shards (dict): shard name mapped to its StorageBackend, the names place the
+                shards on the ring and must stay the same between runs
+            default (dict): empty document, every shard gets its sections
+            vnodes (int, optional): ring points per shard. Defaults to 160.
+        """
+        super().__init__(default)
+        self.shards = dict(shards)
+        self.vnodes = vnodes
+        self.lazy = any(shard.lazy for shard in self.shards.values())
+        self.ring = HashRing(self.shards, vnodes)
+        self.data = None
+        self._documents = {} # shard name -> document loaded from the shard
+        self._previous_ring = None # ring before add_shard, until rebalance is done
+        self._pending = None # iterator over the (shard name, section) pairs left to rebalance
+        self._moving = [] # keys of the current pair waiting to be moved
+        for shard in self.shards.values():
+            shard.add_listener(self._notify)
+
+    def load(self):
+        """Load every shard
+
+        Returns:
+            dict: the document, its sections route each record to its shard
+        """
+        if self.data is None:
+            for name, shard in self.shards.items():
+                self._open_shard(name, shard)
+            self.data = _ShardedDocument(self)
+            for section in self.default:
+                self.data.setdefault(section, {})
+        return self.data
+
+    def apply(self, changes):
+        """Hand each change to the shard owning its record
+
+        While a rebalance is pending, a change to a record not moved yet
+        also deletes it from its old shard.
+
+        Args:
+            changes (iterable): (section, key, value) tuples, value None deletes the record
+        """
+        self.load()
+        batches = {}
+        for section, key, value in changes:
+            owner = self.ring.lookup(key)
+            batches.setdefault(owner, []).append((section, key, value))
+            if self._previous_ring is not None:
+                previous = self._previous_ring.lookup(key)
+                if previous != owner and key in self._documents[previous].get(section, ()):
+                    self._documents[previous][section].pop(key, None)
+                    batches.setdefault(previous, []).append((section, key, None))
+        for name in self.shards:
+            if name in batches:
+                self.shards[name].apply(batches[name])
+
+    def save(self, data: dict):
+        """Split a document by owner and replace every shard's document with its part
+
+        Args:
+            data (dict): document to store
+        """
+        self.join()
+        parts = {name: {section: {} for section in data} for name in self.shards}
+        for section, records in data.items():
+            for key, value in records.items():
+                parts[self.ring.lookup(key)][section][key] = value
+        for name, shard in self.shards.items():
+            shard.save(parts[name])
+            self._open_shard(name, shard)
+        if self.data is not None:
+            for section in data:
+                self.data.setdefault(section)
+
+    def get(self, section: str, key: str):
+        """Look up a single record in the shard holding it
+
+        Args:
+            section (str): document section
+            key (str): record key
+
+        Returns:
+            the stored record, None if it does not exist
+        """
+        value = self.shards[self.ring.lookup(key)].get(section, key)
+        if value is None and self._previous_ring is not None:
+            value = self.shards[self._previous_ring.lookup(key)].get(section, key)
+        return value
+
+    def find_by_token(self, session_token: str):
+        """Find the user owning a session token in any shard
+
+        Args:
+            session_token (str): session token
+
+        Returns:
+            str: username if the token is found, None otherwise
+        """
+        for shard in self.shards.values():
+            username = shard.find_by_token(session_token)
+            if username is not None:
+                return username
+        return None
+
+    def find_by_role(self, role: str):
+        """Find all users holding a role in every shard
+
+        Args:
+            role (str): role name
+
+        Returns:
+            list: usernames holding the role
+        """
+        return [username for shard in self.shards.values() for username in shard.find_by_role(role)]
+
+    @contextlib.contextmanager
+    def transaction(self):
+        """Hold the transaction of every shard, so writers of a sharded store are serialized"""
+        with contextlib.ExitStack() as stack:
+            for shard in self.shards.values():
+                stack.enter_context(shard.transaction())
+            yield
+
+    def refresh(self):
+        """Pick up changes made by other processes in every shard"""
+        for shard in self.shards.values():
+            shard.refresh()
+
+    def refresh_due(self):
+        """Tell whether a shard has a refresh due
+
+        Returns:
+            bool: True if refresh would read from a shard
+        """
+        return any(shard.refresh_due() for shard in self.shards.values())
+
+    def attach_metrics(self, metrics):
+        """Record the size of the writes made by every shard
+
+        Args:
+            metrics (Metrics): registry, see metrics.py
+        """
+        self.metrics = metrics
+        for shard in self.shards.values():
+            shard.attach_metrics(metrics)
+
+    def add_shard(self, name: str, shard: StorageBackend):
+        """Put a new shard on the ring, the records it now owns move to it with rebalance
+
+        Args:
+            name (str): shard name, must be new
+            shard (StorageBackend): backend of the shard
+
+        Raises:
+            ValueError: if the name is taken or a rebalance is still pending
+        """
+        if name in self.shards:
+            raise ValueError(f"Shard '{name}' already exists.")
+        if self._previous_ring is not None:
+            raise ValueError("Finish the pending rebalance before adding another shard.")
+        self.load()
+        self._open_shard(name, shard)
+        shard.add_listener(self._notify)
+        if self.metrics is not None:
+            shard.attach_metrics(self.metrics)
+        self.lazy = self.lazy or shard.lazy
+        self._previous_ring = self.ring
+        self.shards[name] = shard
+        self.ring = HashRing(self.shards, self.vnodes)
+        self._pending = iter([(old, section) for old in self._previous_ring.nodes
+                              for section in list(self._documents[old])])
+        self._moving = []
+
+    def rebalance(self, batch_size: int = 1000):
+        """Move one batch of records to the shard owning them since add_shard
+
+        The caller holds the manager's writer lock, see AuthManager.rebalance.
+
+        Args:
+            batch_size (int, optional): records moved at most. Defaults to 1000.
+
+        Returns:
+            int: records moved, 0 once every record is in its shard
+        """
+        if self._previous_ring is None:
+            return 0
+        while not self._moving:
+            pair = next(self._pending, None)
+            if pair is None:
+                self._previous_ring = self._pending = None
+                return 0
+            old, section = pair
+            records = self._documents[old].get(section, {})
+            self._moving = [(old, section, key) for key in records if self.ring.lookup(key) != old]
+        batch, self._moving = self._moving[:batch_size], self._moving[batch_size:]
+        puts = {}
+        deletes = {}
+        for old, section, key in batch:
+            records = self._documents[old].get(section, {})
+            value = records.get(key)
+            if value is None:
+                continue # Written or deleted since, which moved it already
+            owner = self.ring.lookup(key)
+            # The new shard first, so lock-free readers find the record all along
+            self._documents[owner].setdefault(section, {})[key] = value
+            records.pop(key, None)
+            puts.setdefault(owner, []).append((section, key, value))
+            deletes.setdefault(old, []).append((section, key, None))
+        for name in self.shards:
+            if name in puts:
+                self.shards[name].apply(puts[name])
+        for name in self.shards:
+            if name in deletes:
+                self.shards[name].apply(deletes[name])
+        return len(batch)
+
+    def join(self):
+        """Wait for the background work of every shard, e.g. compactions"""
+        for shard in self.shards.values():
+            join = getattr(shard, "join", None)
+            if join is not None:
+                join()
+
+    def flush(self):
+        """Make sure every change applied to any shard is durable"""
+        for shard in self.shards.values():
+            shard.flush()
+
+    def close(self):
+        """Flush and release every shard"""
+        for shard in self.shards.values():
+            shard.close()
+
+    def _open_shard(self, name: str, shard: StorageBackend):
+        """Load a shard's document and give it every default section"""
+        document = shard.load()
+        for section in self.default:
+            document.setdefault(section, {})
+        self._documents[name] = document
+
+    def _holder(self, section: str, key: str):
+        """Get the shard section holding a record, the owner's if no shard holds it
+
+        Returns:
+            dict: section of the shard document
+        """
+        records = self._documents[self.ring.lookup(key)].setdefault(section, {})
+        if self._previous_ring is not None and key not in records:
+            previous = self._documents[self._previous_ring.lookup(key)].get(section, {})
+            if key in previous:
+                return previous
+        return records
+
+
+class _ShardedSection(collections.abc.MutableMapping):
+    """One section of a ShardedBackend document, each record is read from and written to its shard"""
+
+    def __init__(self, backend: ShardedBackend, name: str):
+        self.backend = backend
+        self.name = name
+
+    def __getitem__(self, key):
+        return self.backend._holder(self.name, key)[key]
+
+    def get(self, key, default=None):
+        return self.backend._holder(self.name, key).get(key, default)
+
+    def __contains__(self, key):
+        return key in self.backend._holder(self.name, key)
+
+    def __setitem__(self, key, value):
+        self.backend._documents[self.backend.ring.lookup(key)].setdefault(self.name, {})[key] = value
+
+    def __delitem__(self, key):
+        backend = self.backend
+        found = backend._documents[backend.ring.lookup(key)].get(self.name, {}).pop(key, _MISSING)
+        if backend._previous_ring is not None:
+            previous = backend._documents[backend._previous_ring.lookup(key)].get(self.name, {})
+            if previous.pop(key, _MISSING) is not _MISSING:
+                found = None
+        if found is _MISSING:
+            raise KeyError(key)
+
+    def __iter__(self):
+        for document in list(self.backend._documents.values()):
+            yield from list(document.get(self.name, {}))
+
+    def __len__(self):
+        return sum(len(document.get(self.name, {})) for document in self.backend._documents.values())
+
+    def items(self):
+        for document in list(self.backend._documents.values()):
+            yield from list(document.get(self.name, {}).items())
+
+    def __deepcopy__(self, memo):
+        return {key: copy.deepcopy(value, memo) for key, value in self.items()}
+
+
+class _ShardedDocument(dict):
+    """Document of a ShardedBackend, mapping each section name to a _ShardedSection"""
+
+    def __init__(self, backend: ShardedBackend):
+        super().__init__()
+        self._backend = backend
+        for document in backend._documents.values():
+            for section in document:
+                self.setdefault(section)
+
+    def setdefault(self, section, default=None):
+        if section not in self:
+            self[section] = _ShardedSection(self._backend, section)
+        return self[section]
+
+
+def _atomic_write(path: str, content: str):
+    """Write a file atomically through a temporary file and a rename
+
+    Args:
+        path (str): destination file path
+        content (str): file content
+
+    Returns:
+        int: number of characters written
+    """
+    directory = os.path.dirname(path) or "."
+    fd, temp_path = tempfile.mkstemp(dir=directory, prefix=os.path.basename(path), suffix=".tmp")
+    _keep_mode(path, fd)
+    try:
+        with os.fdopen(fd, 'w') as file:
+            file.write(content)
+            file.flush()
+            os.fsync(file.fileno())
+        os.replace(temp_path, path)
+    except BaseException:
+        os.remove(temp_path)
+        raise
+    return len(content)
+
+
+def _keep_mode(path: str, fd: int):
+    """Give a temporary file the permissions of the file it replaces
+
+    mkstemp creates files readable by their owner only, a new file gets the
+    permissions open would give it instead where the umask can be read
+    without changing it (see _read_umask), and keeps the mkstemp ones
+    otherwise.
+
+    Args:
+        path (str): file the temporary file will replace
+        fd (int): descriptor of the temporary file
+    """
+    try:
+        mode = stat.S_IMODE(os.stat(path).st_mode)
+    except FileNotFoundError:
+        umask = _read_umask()
+        if umask is None:
+            return
+        mode = 0o666 & ~umask
+    os.fchmod(fd, mode)
+
+
+def _read_umask():
+    """Read the umask of the process from /proc/self/status
+
+    os.umask can only be read by setting it, which would change the
+    permissions of files created meanwhile by other threads.
+
+    Returns:
+        int: the umask, None where /proc/self/status does not report it
+    """
+    try:
+        with open("/proc/self/status") as file:
+            for line in file:
+                if line.startswith("Umask:"):
+                    return int(line.split()[1], 8)
+    except OSError:
+        pass
+    return None
+
+
+def _is_mapped_file(path: str):
+    """Tell whether a file holds a snapshot in the indexed format of MappedFileBackend
+
+    Args:
+        path (str): file path
+
+    Returns:
+        bool: True if the file starts with the mapped snapshot magic, False otherwise or if it does not exist
+    """
+    try:
+        with open(path, 'rb') as file:
+            return file.read(len(_MAPPED_MAGIC)) == _MAPPED_MAGIC
+    except FileNotFoundError:
+        return False
+
+
+def _write_mapped_file(path: str, sections: dict):
+    """Write a mapped snapshot file atomically
+
+    Records are streamed to the file as they are produced, only the fixed
+    width index entries are held in memory until the end.
+
+    Args:
+        path (str): destination file path
+        sections (dict): section name mapped to an iterable of (key bytes,
+            serialized record) tuples in key order
+
+    Returns:
+        int: size of the file
+    """
+    directory = os.path.dirname(path) or "."
+    fd, temp_path = tempfile.mkstemp(dir=directory, prefix=os.path.basename(path), suffix=".tmp")
+    _keep_mode(path, fd)
+    try:
+        with os.fdopen(fd, 'wb') as file:
+            file.write(_MAPPED_MAGIC)
+            offset = len(_MAPPED_MAGIC)
+            indexes = {}
+            for name, entries in sections.items():
+                index = bytearray()
+                for key, serialized in entries:
+                    file.write(key)
+                    file.write(serialized)
+                    index += _INDEX_ENTRY.pack(offset, len(key), len(serialized))
+                    offset += len(key) + len(serialized)
+                indexes[name] = index
+            footer = {}
+            for name, index in indexes.items():
+                footer[name] = [offset, len(index) // _INDEX_ENTRY.size]
+                file.write(index)
+                offset += len(index)
+            file.write(json.dumps(footer).encode())
+            file.write(_TRAILER.pack(offset, _MAPPED_MAGIC))
+            file.flush()
+            os.fsync(file.fileno())
+            size = file.tell()
+        os.replace(temp_path, path)
+    except BaseException:
+        os.remove(temp_path)
+        raise
+    return size
+
+
+def _plain_entries(records: dict):
+    """Serialize the records of a plain section for _write_mapped_file
+
+    Args:
+        records (dict): section records
+
+    Returns:
+        iterator: (key bytes, serialized record) tuples in key order
+    """
+    for key in sorted(records):
+        yield key.encode(), json.dumps(records[key]).encode()
+
+
+def _merged_entries(index, changes: dict):
+    """Merge the records of a snapshot index with the changes made since, for _write_mapped_file
+
+    Unchanged records are copied without being parsed.
+
+    Args:
+        index (_SectionIndex): index of the section in the current snapshot
+        changes (dict): changed records, None for deleted ones
+
+    Returns:
+        iterator: (key bytes, serialized record) tuples in key order
+    """
+    changed = sorted((key.encode(), value) for key, value in changes.items())
+    position = 0
+    for key, serialized in index.entries():
+        while position < len(changed) and changed[position][0] < key:
+            if changed[position][1] is not None:
+                yield changed[position][0], json.dumps(changed[position][1]).encode()
+            position += 1
+        if position < len(changed) and changed[position][0] == key:
+            if changed[position][1] is not None:
+                yield key, json.dumps(changed[position][1]).encode()
+            position += 1
+        else:
+            yield key, serialized
+    for key, value in changed[position:]:
+        if value is not None:
+            yield key, json.dumps(value).encode()
+
+
+def _apply_change(data: dict, section: str, key: str, value):
+    """Apply a single change to a document
+
+    Args:
+        data (dict): document
+        section (str): document section
+        key (str): record key
+        value: new record, None deletes the record
+    """
+    records = data.setdefault(section, {})
+    if isinstance(records, _MappedSection):
+        records.record_change(key, value)
+    elif value is None:
+        records.pop(key, None)
+    else:
+        records[key] = value
+
+
+def _read_journal(journal_path: str, offset: int = 0):
+    """Read the changes recorded in a journal file
+
+    Lines are [section, key, value] or, when written by SharedJournalBackend,
+    [version, section, key, value]. Reading stops at the first incomplete or
+    unreadable line, such as a torn last line left behind by a crash.
+
+    Args:
+        journal_path (str): path to the journal file
+        offset (int, optional): byte offset to start reading at. Defaults to 0.
+
+    Returns:
+        tuple: (version, section, key, value) tuples in the order they were written,
+            version None for unversioned lines, and the byte offset after the last line read
+    """
+    try:
+        with open(journal_path, 'rb') as file:
+            file.seek(offset)
+            content = file.read()
+    except FileNotFoundError:
+        return [], 0
+    changes = []
+    lines = content.split(b"\n")
+    for line in lines[:-1]: # The last piece has no newline yet
+        try:
+            entry = json.loads(line)
+            version = entry[0] if len(entry) == 4 else None
+            section, key, value = entry[-3:]
+        except (ValueError, TypeError):
+            break
+        changes.append((version, section, key, value))
+        offset += len(line) + 1
+    return changes, offset
+
+
+def _record_roles(record):
+    """Extract the role names held by a user record
+
+    Auth records carry a single "role", RBAC records are either a plain list
+    of roles or a dict with a "roles" list.
+
+    Args:
+        record: user record
+
+    Returns:
+        list: role names
+    """
+    if isinstance(record, list):
+        return list(record)
+    if isinstance(record, dict):
+        roles = list(record.get("roles", []))
+        if record.get("role"):
+            roles.append(record["role"])
+        return roles
+    return []
@@ -0,0 +1,219 @@
+"""
+Tenant namespaces over sharded stores
+
+Each tenant gets its own directory under the root, holding its shard files
+and a shards.json manifest, and its own managers. Tenants therefore share no
+document and no lock: a busy tenant never waits on another one. Within a
+tenant the users, sessions, roles and permissions are spread over the shards
+by a ShardedBackend (see storage.py), by consistent hashing on their key.
+Shards keep each file and each write small, but the writes of one tenant
+are still serialized: writes only run in parallel across tenants.
+
+    data/tenants/<tenant>/shards.json
+    data/tenants/<tenant>/auth-<shard>.json
+    data/tenants/<tenant>/rbac-<shard>.json
+
+A shard added to a tenant takes over its records in batches (see rebalance)
+while the tenant stays in use. The manifest names the shard being filled
+until the rebalance is done, so a directory opened after an interrupted
+rebalance puts the shard back on the ring and the rebalance carries on.
+
+Processes sharing a tenant must use SharedJournalBackend, the only backend
+whose managers pick up each other's changes and lock each other out during
+a transaction, and add shards only while the other processes are stopped,
+they read the manifest when they open the tenant. The other backends serve
+a single process.
+
+Classes:
+    TenantDirectory:
+        Opens the sharded managers of each tenant and adds shards to tenants.
+"""
+import json
+import os
+import re
+import threading
+from rbac import RBACManager
+from session import SessionManager
+from storage import JournalBackend, SQLiteBackend, ShardedBackend
+
+TENANT_ROOT = "data/tenants"
+TENANT_PATTERN = re.compile(r"^[a-zA-Z0-9_-]+$")
+AUTH_DEFAULT = {"users": {}}
+RBAC_DEFAULT = {"users": {}, "roles": {}, "permissions": {}, "role_inheritance": {}}
+
+
+class TenantDirectory:
+    """Open the sharded managers of each tenant and add shards to tenants
+
+    Safe to share between threads, the managers of a tenant are opened once.
+    """
+
+    def __init__(self, root: str = TENANT_ROOT, shards: int = 4, backend=JournalBackend,
+                 vnodes: int = 160, **manager_options):
+        """
+        Args:
+            root (str, optional): directory holding a directory per tenant. Defaults to TENANT_ROOT.
+            shards (int, optional): shards of a new tenant. Defaults to 4.
+            backend (type, optional): StorageBackend class of the shards, built with a path and a
+                default document. Defaults to JournalBackend.
+            vnodes (int, optional): ring points per shard, see HashRing. Defaults to 160.
+            **manager_options: keyword arguments of the SessionManager (hasher, hash_pool,
+                throttle, signer, events, metrics), events and metrics are passed to the
+                RBACManager as well
+        """
+        self.root = root
+        self.shards = shards
+        self.backend = backend
+        self.vnodes = vnodes
+        self.manager_options = manager_options
+        self._tenants = {} # tenant -> (SessionManager, RBACManager)
+        self._lock = threading.Lock()
+
+    def session_manager(self, tenant: str):
+        """Get the session manager of a tenant, creating the tenant on first use
+
+        Args:
+            tenant (str): tenant name, letters, digits, "_" and "-"
+
+        Returns:
+            SessionManager: manager of the tenant's users and sessions
+        """
+        return self._open(tenant)[0]
+
+    def rbac_manager(self, tenant: str):
+        """Get the RBAC manager of a tenant, creating the tenant on first use
+
+        Args:
+            tenant (str): tenant name, letters, digits, "_" and "-"
+
+        Returns:
+            RBACManager: manager of the tenant's roles and permissions
+        """
+        return self._open(tenant)[1]
+
+    def tenants(self):
+        """List the tenants stored under the root
+
+        Returns:
+            list: tenant names, sorted
+        """
+        if not os.path.isdir(self.root):
+            return []
+        return sorted(name for name in os.listdir(self.root)
+                      if os.path.exists(os.path.join(self.root, name, "shards.json")))
+
+    def add_shard(self, tenant: str):
+        """Add a shard to a tenant, its records move to it with rebalance
+
+        Args:
+            tenant (str): tenant name
+
+        Returns:
+            str: name of the new shard
+
+        Raises:
+            ValueError: if the previous shard added to the tenant is not filled yet
+        """
+        sessions, rbac = self._open(tenant)
+        manifest = self._read_manifest(tenant)
+        if manifest["pending"] is not None:
+            raise ValueError(f"Shard '{manifest['pending']}' of tenant '{tenant}' is still being filled, "
+                             "run rebalance first.")
+        name = f"s{len(manifest['shards'])}"
+        with sessions._lock, rbac._lock:
+            sessions.storage.add_shard(name, self._shard(tenant, "auth", name, AUTH_DEFAULT))
+            rbac.storage.add_shard(name, self._shard(tenant, "rbac", name, RBAC_DEFAULT))
+        self._write_manifest(tenant, {"shards": manifest["shards"], "pending": name})
+        return name
+
+    def rebalance(self, tenant: str, batch_size: int = 1000):
+        """Move a batch of the tenant's records to the shard added last
+
+        Call it until it returns 0, the tenant stays usable in between.
+
+        Args:
+            tenant (str): tenant name
+            batch_size (int, optional): records moved at most per store. Defaults to 1000.
+
+        Returns:
+            int: records moved, 0 once the tenant is balanced
+        """
+        sessions, rbac = self._open(tenant)
+        moved = sessions.rebalance(batch_size) + rbac.rebalance(batch_size)
+        if not moved:
+            manifest = self._read_manifest(tenant)
+            if manifest["pending"] is not None:
+                self._write_manifest(tenant, {"shards": manifest["shards"] + [manifest["pending"]],
+                                              "pending": None})
+        return moved
+
+    def close(self):
+        """Persist pending changes and release the stores of every opened tenant"""
+        with self._lock:
+            for sessions, rbac in self._tenants.values():
+                sessions.close()
+                rbac.close()
+            self._tenants.clear()
+
+    def _open(self, tenant: str):
+        """Open the managers of a tenant once, resuming an interrupted rebalance
+
+        Raises:
+            ValueError: if the tenant name is invalid
+        """
+        managers = self._tenants.get(tenant)
+        if managers is not None:
+            return managers
+        if not TENANT_PATTERN.match(tenant):
+            raise ValueError(f"Invalid tenant name '{tenant}', use letters, digits, '_' and '-'.")
+        with self._lock:
+            if tenant not in self._tenants:
+                os.makedirs(os.path.join(self.root, tenant), exist_ok=True)
+                manifest = self._read_manifest(tenant)
+                if manifest is None:
+                    manifest = {"shards": [f"s{index}" for index in range(self.shards)], "pending": None}
+                    self._write_manifest(tenant, manifest)
+                auth_storage = self._sharded(tenant, "auth", manifest, AUTH_DEFAULT)
+                rbac_storage = self._sharded(tenant, "rbac", manifest, RBAC_DEFAULT)
+                options = self.manager_options
+                self._tenants[tenant] = (
+                    SessionManager(auth_storage, **options),
+                    RBACManager(rbac_storage, events=options.get("events"), metrics=options.get("metrics")),
+                )
+        return self._tenants[tenant]
+
+    def _sharded(self, tenant: str, store: str, manifest: dict, default: dict):
+        """Build the ShardedBackend of one store of a tenant, the pending shard added back"""
+        storage = ShardedBackend({name: self._shard(tenant, store, name, default) for name in manifest["shards"]},
+                                 default, self.vnodes)
+        if manifest["pending"] is not None:
+            storage.add_shard(manifest["pending"], self._shard(tenant, store, manifest["pending"], default))
+        return storage
+
+    def _shard(self, tenant: str, store: str, name: str, default: dict):
+        """Build the backend of one shard"""
+        extension = ".db" if issubclass(self.backend, SQLiteBackend) else ".json"
+        path = os.path.join(self.root, tenant, f"{store}-{name}{extension}")
+        return self.backend(path, {section: {} for section in default})
+
+    def _read_manifest(self, tenant: str):
+        """Read the shard list of a tenant
+
+        Returns:
+            dict: "shards" (names on the ring) and "pending" (shard being filled or None),
+                None for a new tenant
+        """
+        try:
+            with open(os.path.join(self.root, tenant, "shards.json"), encoding="utf-8") as file:
+                return json.load(file)
+        except FileNotFoundError:
+            return None
+
+    def _write_manifest(self, tenant: str, manifest: dict):
+        """Replace the shard list of a tenant atomically"""
+        path = os.path.join(self.root, tenant, "shards.json")
+        with open(path + ".tmp", "w", encoding="utf-8") as file:
+            json.dump(manifest, file)
+            file.flush()
+            os.fsync(file.fileno())
+        os.replace(path + ".tmp", path)
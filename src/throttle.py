@@ -0,0 +1,151 @@
+"""
+Login throttling and brute-force lockout
+
+This module counts failed logins per username and per source (e.g. the
+client address) with sliding-window counters, so over-limit attempts can be
+rejected before any password hashing is done. A key going over its limit is
+locked out, and every further lockout of the same key lasts lockout_factor
+times longer, up to max_lockout.
+
+Each counter keeps two fixed windows (the previous and the current one) and
+estimates the failures of the last window seconds by weighting the previous
+window with the part of it still inside the sliding window. Counters live in
+LRU maps holding at most max_entries keys each, so memory stays bounded
+however many distinct usernames an attacker sprays: the least recently
+failed keys are forgotten first, while keys under active attack stay.
+
+Classes:
+    LoginThrottle:
+        Per-username and per-source failure counters with progressive lockout.
+"""
+import threading
+import time
+from collections import OrderedDict
+
+
+class _Counter:
+    """Sliding-window failure counter and lockout state of one key"""
+    __slots__ = ("window_start", "previous", "current", "lockouts", "locked_until")
+
+    def __init__(self, window_start: float):
+        self.window_start = window_start
+        self.previous = 0
+        self.current = 0
+        self.lockouts = 0
+        self.locked_until = 0.0
+
+
+class LoginThrottle:
+    """Throttle failed logins per username and per source
+
+    Safe to share between threads.
+    """
+
+    def __init__(self, max_failures: int = 5, source_max_failures: int = 50, window: float = 300.0,
+                 lockout: float = 30.0, lockout_factor: float = 2.0, max_lockout: float = 3600.0,
+                 max_entries: int = 100000):
+        """
+        Args:
+            max_failures (int, optional): failures of a username within a window triggering a lockout. Defaults to 5.
+            source_max_failures (int, optional): failures from a source within a window triggering a
+                lockout of the source. Defaults to 50.
+            window (float, optional): sliding window length in seconds. Defaults to 300.
+            lockout (float, optional): duration of the first lockout in seconds. Defaults to 30.
+            lockout_factor (float, optional): growth of each further lockout of a key. Defaults to 2.
+            max_lockout (float, optional): longest lockout in seconds. Defaults to 3600.
+            max_entries (int, optional): keys tracked per map (usernames, sources). Defaults to 100000.
+        """
+        self.max_failures = max_failures
+        self.source_max_failures = source_max_failures
+        self.window = window
+        self.lockout = lockout
+        self.lockout_factor = lockout_factor
+        self.max_lockout = max_lockout
+        self.max_entries = max_entries
+        self._users = OrderedDict()
+        self._sources = OrderedDict()
+        self._lock = threading.Lock()
+
+    def retry_after(self, username: str, source: str = None, now: float = None):
+        """Tell how long a login attempt must wait
+
+        Args:
+            username (str): username the attempt is for
+            source (str, optional): origin of the attempt, e.g. the client address. Defaults to None.
+            now (float, optional): current time.monotonic() value. Defaults to now.
+
+        Returns:
+            float: seconds until the username and source are no longer locked out, 0 if the attempt may proceed
+        """
+        now = time.monotonic() if now is None else now
+        with self._lock:
+            wait = self._remaining(self._users.get(username), now)
+            if source is not None:
+                wait = max(wait, self._remaining(self._sources.get(source), now))
+        return wait
+
+    def record_failure(self, username: str, source: str = None, now: float = None):
+        """Count a failed login, locking the username or the source out once over its limit
+
+        Args:
+            username (str): username the attempt was for
+            source (str, optional): origin of the attempt. Defaults to None.
+            now (float, optional): current time.monotonic() value. Defaults to now.
+        """
+        now = time.monotonic() if now is None else now
+        with self._lock:
+            self._fail(self._users, username, self.max_failures, now)
+            if source is not None:
+                self._fail(self._sources, source, self.source_max_failures, now)
+
+    def record_success(self, username: str):
+        """Forget the failures and lockouts of a username after a successful login
+
+        The source keeps its count, a source guessing many usernames stays throttled.
+
+        Args:
+            username (str): username that logged in
+        """
+        with self._lock:
+            self._users.pop(username, None)
+
+    def _remaining(self, counter: _Counter, now: float):
+        """Get the remaining lockout of a key
+
+        Returns:
+            float: seconds left, 0 if the key is not locked out
+        """
+        if counter is None or counter.locked_until <= now:
+            return 0.0
+        return counter.locked_until - now
+
+    def _fail(self, counters: OrderedDict, key: str, limit: int, now: float):
+        """Count a failure of a key in one of the LRU maps, the caller holds the lock
+
+        Args:
+            counters (OrderedDict): key mapped to its _Counter, least recently failed first
+            key (str): username or source
+            limit (int): failures within a window triggering a lockout
+            now (float): current time
+        """
+        counter = counters.get(key)
+        if counter is None:
+            counter = counters[key] = _Counter(now)
+            if len(counters) > self.max_entries:
+                counters.popitem(last=False)
+        else:
+            counters.move_to_end(key)
+        elapsed = now - counter.window_start
+        if elapsed >= self.window:
+            # Slide forward, the previous window is the one just ended if it is adjacent
+            counter.previous = counter.current if elapsed < 2 * self.window else 0
+            counter.current = 0
+            counter.window_start = now - elapsed % self.window
+            elapsed = now - counter.window_start
+        counter.current += 1
+        estimate = counter.previous * (1 - elapsed / self.window) + counter.current
+        if estimate >= limit:
+            counter.lockouts += 1
+            duration = self.lockout * self.lockout_factor ** min(counter.lockouts - 1, 64)
+            counter.locked_until = now + min(duration, self.max_lockout)
+            counter.previous = counter.current = 0
@@ -0,0 +1,149 @@
+"""
+Signed (stateless) session tokens
+
+A signed token carries its own claims and an HMAC-SHA256 signature, so it
+can be validated with CPU work alone, without looking up a session record.
+
+    <key id>.<claims>.<signature>
+
+The claims are a base64url encoded JSON list, the signature covers the key
+id and the claims. Several keys can be known at once: new tokens are signed
+with the active key, tokens signed with an older key keep validating until
+that key is retired, which is how keys are rotated without logging everyone out.
+
+Classes:
+    TokenSigner:
+        Signs and verifies tokens with a rotating set of HMAC keys.
+"""
+import base64
+import binascii
+import hashlib
+import hmac
+import json
+import secrets
+import threading
+
+
+class TokenSigner:
+    """Sign and verify tokens with a rotating set of HMAC keys
+
+    Safe to share between threads.
+    """
+    KEY_BYTES = 32
+
+    def __init__(self, keys: dict = None, active_key_id: str = None):
+        """
+        Args:
+            keys (dict, optional): key id mapped to secret key bytes. Defaults to one fresh random key.
+                Processes validating each other's tokens must share the keys.
+            active_key_id (str, optional): id of the key signing new tokens. Defaults to the last key of keys.
+        """
+        self._keys = dict(keys or {})
+        self._lock = threading.Lock()
+        for key_id in self._keys:
+            if "." in key_id:
+                raise ValueError(f"Key id '{key_id}' must not contain '.'")
+        if not self._keys:
+            self.rotate()
+        else:
+            active_key_id = active_key_id or list(self._keys)[-1]
+            self._active = (active_key_id, self._keys[active_key_id])
+
+    @property
+    def active_key_id(self):
+        """str: id of the key signing new tokens"""
+        return self._active[0]
+
+    def rotate(self, key_id: str = None, key: bytes = None):
+        """Make a new key the active one, earlier keys keep verifying their tokens
+
+        Args:
+            key_id (str, optional): id of the new key. Defaults to a random id.
+            key (bytes, optional): secret key. Defaults to KEY_BYTES random bytes.
+
+        Returns:
+            str: id of the new active key
+        """
+        key_id = key_id or secrets.token_hex(4)
+        if "." in key_id:
+            raise ValueError(f"Key id '{key_id}' must not contain '.'")
+        with self._lock:
+            keys = dict(self._keys)
+            keys[key_id] = key or secrets.token_bytes(self.KEY_BYTES)
+            self._keys = keys # Published whole, verify never sees a half updated key set
+            self._active = (key_id, keys[key_id])
+        return key_id
+
+    def retire(self, key_id: str):
+        """Stop accepting tokens signed with a key
+
+        Args:
+            key_id (str): id of the key, must not be the active one
+
+        Returns:
+            bool: True if the key was retired, False if it is unknown or active
+        """
+        with self._lock:
+            if key_id == self._active[0] or key_id not in self._keys:
+                return False
+            keys = dict(self._keys)
+            del keys[key_id]
+            self._keys = keys
+        return True
+
+    def sign(self, claims: list):
+        """Build a signed token
+
+        Args:
+            claims (list): JSON serializable claims
+
+        Returns:
+            str: the token
+        """
+        key_id, key = self._active
+        body = key_id + "." + _b64encode(json.dumps(claims, separators=(",", ":")).encode())
+        return body + "." + _b64encode(self._signature(key, body))
+
+    def verify(self, token: str):
+        """Check the signature of a token and decode its claims
+
+        Args:
+            token (str): token built by sign
+
+        Returns:
+            list: the claims, None if the token is malformed, its key unknown or its signature wrong
+        """
+        body, _, signature = token.rpartition(".")
+        key = self._keys.get(body.partition(".")[0])
+        if key is None:
+            return None
+        try:
+            if not hmac.compare_digest(self._signature(key, body), _b64decode(signature)):
+                return None
+            claims = json.loads(_b64decode(body.partition(".")[2]))
+        except (ValueError, binascii.Error):
+            return None
+        return claims if isinstance(claims, list) else None
+
+    @staticmethod
+    def is_signed(token: str):
+        """Tell a signed token from an opaque random one
+
+        Args:
+            token (str): session token
+
+        Returns:
+            bool: True if the token has the signed token layout
+        """
+        return token.count(".") == 2
+
+    def _signature(self, key: bytes, body: str):
+        return hmac.new(key, body.encode(), hashlib.sha256).digest()
+
+
+def _b64encode(value: bytes):
+    return base64.urlsafe_b64encode(value).decode().rstrip("=")
+
+
+def _b64decode(value: str):
+    return base64.urlsafe_b64decode(value + "=" * (-len(value) % 4))
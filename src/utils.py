@@ -4,6 +4,8 @@ Helper utilities (hashing, JSON I/O, JSON schema validation.)
 Functions:
     hash_password(input_string: str) -> str:
         Generates a SHA-256 hash for the given input string.
+        Only used to verify legacy password hashes, new passwords are hashed
+        by the hashers in hashing.py.
 
     read_json_file(file_path: str) -> dict:
         Reads a JSON file from the specified file path and returns its contents as a dictionary.
@@ -16,12 +18,33 @@ Functions:
         
     validate_json_schema(data: dict, schema: dict) -> bool:
         Validates the given dictionary against the provided JSON schema.
+
+    validate_records(section: str, records: dict, schema_file: str) -> bool:
+        Validates some records of one section (a single record or a delta)
+        without the rest of the document.
+
+The schema is compiled once and cached, it is only read again after the
+schema file's modification time changed. It is compiled to Python code with
+fastjsonschema when available, with jsonschema otherwise.
 """
 import json
+import os
+import threading
 import jsonschema
-from jsonschema import validate
 import jsonschema.exceptions
 import hashlib
+try:
+    import fastjsonschema
+except ImportError:
+    fastjsonschema = None
+
+_VALIDATION_ERRORS = (jsonschema.exceptions.ValidationError,)
+if fastjsonschema is not None:
+    _VALIDATION_ERRORS += (fastjsonschema.JsonSchemaValueException,)
+
+SCHEMA_FILE = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), "schema.json")
+_validators = {} # schema file path -> (mtime, document validator, section validators)
+_validators_lock = threading.Lock()
 
 def read_json_file(file_path: str):
     """Load user data from JSON file
@@ -68,19 +91,108 @@ def hash_password(password: str):
     """
     return hashlib.sha256(password.encode()).hexdigest()
 
-def validate_json_schema(data: dict, schema_file = 'schema.json'):
+def validate_json_schema(data: dict, schema_file = SCHEMA_FILE):
     """Validate JSON data against the defined schema
 
     Args:
         data (dict): actual userdata in the form of JSON
-        schema_file (str, optional): schema defined for the user data JSON file. Defaults to 'schema.json'.
+        schema_file (str, optional): schema defined for the user data JSON file. Defaults to SCHEMA_FILE.
 
     Returns:
         bool: True if data matches the schema, False if data varies from the schema
     """
-    schema = load_json_schema(schema_file)
+    validator, _ = _compiled_schema(schema_file)
+    try:
+        validator(data)
+        return True, 'JSON is valid'
+    except _VALIDATION_ERRORS as e:
+        return False, f'JSON validation error: {e.message}'
+
+def validate_records(section: str, records: dict, schema_file = SCHEMA_FILE):
+    """Validate records of one section, e.g. the record about to be written
+
+    Only the given records are checked against the section's schema, so a
+    write costs the same however large the stored document is.
+
+    Args:
+        section (str): document section, e.g. "users"
+        records (dict): record key mapped to record
+        schema_file (str, optional): schema defined for the user data JSON file. Defaults to SCHEMA_FILE.
+
+    Returns:
+        bool: True if the records match the schema, False otherwise
+    """
+    _, section_validators = _compiled_schema(schema_file)
+    validator = section_validators.get(section)
+    if validator is None:
+        return False, f'JSON validation error: unknown section {section!r}'
     try:
-        validate(instance=data, schema=schema)
+        validator(records)
         return True, 'JSON is valid'
-    except jsonschema.exceptions.ValidationError as e:
-        return False, f'JSON validation error: {e.message}'        
\ No newline at end of file
+    except _VALIDATION_ERRORS as e:
+        return False, f'JSON validation error: {e.message}'
+
+def _compiled_schema(schema_file: str):
+    """Get the compiled validators of a schema file, compiling them when the file changed
+
+    Args:
+        schema_file (str): schema file path
+
+    Returns:
+        tuple: validation function of the whole document, dict of validation functions per section
+    """
+    mtime = os.stat(schema_file).st_mtime_ns
+    cached = _validators.get(schema_file)
+    if cached is not None and cached[0] == mtime:
+        return cached[1:]
+    with _validators_lock:
+        schema = load_json_schema(schema_file)
+        definitions = schema.get("definitions", {})
+        section_validators = {}
+        for section, section_schema in schema.get("properties", {}).items():
+            section_schema = _inline_definitions(section_schema, definitions)
+            if "$schema" in schema:
+                section_schema["$schema"] = schema["$schema"]
+            section_validators[section] = _compile_schema(section_schema)
+        _validators[schema_file] = (mtime, _compile_schema(schema), section_validators)
+        return _validators[schema_file][1:]
+
+def _compile_schema(schema: dict):
+    """Compile a schema into a validation function
+
+    Args:
+        schema (dict): JSON schema
+
+    Returns:
+        callable: function raising a validation error for data not matching the schema
+    """
+    if fastjsonschema is not None:
+        return fastjsonschema.compile(schema)
+    validator_class = jsonschema.validators.validator_for(schema)
+    validator_class.check_schema(schema)
+    return validator_class(schema).validate
+
+def _inline_definitions(schema, definitions: dict):
+    """Replace "#/definitions/..." references by the definitions they point to
+
+    Resolving a reference is by far the most expensive step of a validation,
+    the definitions of our schema are not recursive so they can be inlined.
+
+    Args:
+        schema: schema or part of a schema
+        definitions (dict): definitions of the root schema
+
+    Returns:
+        the schema without references to the definitions
+    """
+    if isinstance(schema, list):
+        return [_inline_definitions(item, definitions) for item in schema]
+    if not isinstance(schema, dict):
+        return schema
+    reference = schema.get("$ref", "")
+    if reference.startswith("#/definitions/"):
+        inlined = dict(schema)
+        del inlined["$ref"]
+        inlined.update(definitions[reference[len("#/definitions/"):]])
+        return _inline_definitions(inlined, definitions)
+    return {key: _inline_definitions(value, definitions) for key, value in schema.items()}        
\ No newline at end of file
@@ -0,0 +1,197 @@
+"""
+Unit tests for the asyncio API
+
+This module contains unit tests for the async counterparts of the session and
+RBAC managers.
+
+Classes:
+    TestAsyncSessionManager: Contains unit tests for AsyncSessionManager.
+    TestAsyncRBACManager: Contains unit tests for AsyncRBACManager.
+
+Methods:
+    test_login_and_sessions(self): Tests accounts, logins and sessions through the async API.
+    test_rehash_on_login(self): Tests that an outdated hash is replaced after an async login.
+    test_concurrent_first_use(self): Tests that concurrent first callers share one loaded manager.
+    test_shared_logins(self): Tests that logins pick up accounts of other processes off the event loop.
+    test_checks(self): Tests mutations and permission checks through the async API.
+    test_shared_store(self): Tests that checks pick up other processes' changes off the event loop.
+"""
+import asyncio
+import json
+import os
+import shutil
+import sys
+import tempfile
+import threading
+import unittest
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "src"))
+
+from async_api import AsyncRBACManager, AsyncSessionManager
+from events import EventLog
+from hashing import PBKDF2Hasher
+from rbac import RBACManager
+from session import SessionManager
+from storage import JSONFileBackend, SharedJournalBackend
+
+RBAC_DEFAULT = {"users": {}, "roles": {}, "permissions": {}, "role_inheritance": {}}
+
+
+class _QuietSessionManager(SessionManager):
+    VERBOSE = False
+
+
+class _QuietRBACManager(RBACManager):
+    VERBOSE = False
+
+
+class TestAsyncSessionManager(unittest.TestCase):
+
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+        self.path = os.path.join(self.directory, "auth.json")
+
+    def tearDown(self):
+        shutil.rmtree(self.directory)
+
+    def _open_manager(self, hasher=None):
+        return AsyncSessionManager(JSONFileBackend(self.path, {"users": {}}), hasher=hasher or PBKDF2Hasher(1000))
+
+    def test_login_and_sessions(self):
+        async def scenario():
+            manager = self._open_manager()
+            self.assertTrue(await manager.create_account("alice", "password123"))
+            self.assertFalse(await manager.create_account("alice", "other"))
+            self.assertTrue(await manager.login_user("alice", "password123"))
+            self.assertFalse(await manager.login_user("alice", "wrong"))
+            self.assertFalse(await manager.login_user("nobody", "password123"))
+            session_token = await manager.create_session("alice")
+            self.assertTrue(await manager.validate_session("alice", session_token))
+            self.assertEqual(await manager.validate_token(session_token), "alice")
+            self.assertTrue(await manager.terminate_session(session_token))
+            self.assertIsNone(await manager.validate_token(session_token))
+            self.assertTrue(await manager.logout_user("alice"))
+            await manager.close()
+
+        asyncio.run(scenario())
+
+    def test_rehash_on_login(self):
+        async def scenario():
+            manager = self._open_manager()
+            await manager.create_account("alice", "password123")
+            await manager.close()
+            manager = self._open_manager(PBKDF2Hasher(2000))
+            self.assertTrue(await manager.login_user("alice", "password123"))
+            await manager.close()
+
+        asyncio.run(scenario())
+        with open(self.path) as file:
+            self.assertIn("pbkdf2_sha256$2000$", file.read())
+
+    def test_concurrent_first_use(self):
+        async def scenario():
+            manager = self._open_manager()
+            managers = await asyncio.gather(*(manager._get_manager() for _ in range(10)))
+            self.assertEqual(len({id(loaded) for loaded in managers}), 1)
+            await manager.close()
+
+        asyncio.run(scenario())
+
+    def test_shared_logins(self):
+        writer = _QuietSessionManager(SharedJournalBackend(self.path, {"users": {}}, refresh_interval=0),
+                                      hasher=PBKDF2Hasher(1000))
+        events_path = os.path.join(self.directory, "events.jsonl")
+        events = EventLog(events_path, flush_interval=60)
+
+        async def scenario():
+            manager = AsyncSessionManager(SharedJournalBackend(self.path, {"users": {}}, refresh_interval=0),
+                                          hasher=PBKDF2Hasher(1000), events=events)
+            loaded = await manager._get_manager()
+            refresh_data, refresh_threads = loaded._refresh_data, []
+
+            def record_refresh():
+                refresh_threads.append(threading.current_thread())
+                return refresh_data()
+
+            loaded._refresh_data = record_refresh
+            self.assertFalse(await manager.login_user("alice", "password123"))
+            writer.create_account("alice", "password123")
+            self.assertTrue(await manager.verify_user("alice", "password123"))
+            self.assertFalse(await manager.login_user("alice", "wrong"))
+            self.assertTrue(await manager.login_user("alice", "password123"))
+            self.assertFalse(await manager.create_account("alice", "other"))
+            self.assertTrue(refresh_threads)
+            self.assertNotIn(threading.current_thread(), refresh_threads)
+            await manager.close()
+
+        asyncio.run(scenario())
+        writer.close()
+        events.close()
+        with open(events_path) as file:
+            records = [json.loads(line) for line in file]
+        self.assertEqual([record.get("reason") for record in records if record["event"] == "login.failure"],
+                         ["unknown_user", "password"])
+
+
+class TestAsyncRBACManager(unittest.TestCase):
+
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+
+    def tearDown(self):
+        shutil.rmtree(self.directory)
+
+    def test_checks(self):
+        async def scenario():
+            manager = AsyncRBACManager(JSONFileBackend(os.path.join(self.directory, "rbac.json"), RBAC_DEFAULT))
+            for role in ("viewer", "editor"):
+                self.assertTrue(await manager.add_role(role))
+            for permission_name in ("view", "edit"):
+                self.assertTrue(await manager.add_permission(permission_name))
+            await manager.assign_permission_to_role("viewer", "view")
+            await manager.assign_permission_to_role("editor", "edit")
+            self.assertTrue(await manager.add_role_inheritance("editor", "viewer"))
+            await manager.assign_role_to_user("alice", "editor")
+            self.assertTrue(await manager.check_user_permission("alice", "view"))
+            self.assertFalse(await manager.check_user_permission("nobody", "view"))
+            self.assertTrue(await manager.check_user_permissions("alice", ["view", "edit"]))
+            self.assertEqual(await manager.check_many([("alice", "edit"), ("bob", "edit")]), [True, False])
+            self.assertEqual(await manager.permissions_for_users(["alice"]), {"alice": {"view", "edit"}})
+            await manager.remove_role_from_user("alice", "editor")
+            self.assertFalse(await manager.check_user_permission("alice", "view"))
+            await manager.close()
+
+        asyncio.run(scenario())
+
+    def test_shared_store(self):
+        path = os.path.join(self.directory, "rbac.json")
+        writer = _QuietRBACManager(SharedJournalBackend(path, RBAC_DEFAULT, refresh_interval=0))
+        writer.add_role("viewer")
+        writer.add_permission("view")
+        writer.assign_permission_to_role("viewer", "view")
+
+        async def scenario():
+            manager = AsyncRBACManager(SharedJournalBackend(path, RBAC_DEFAULT, refresh_interval=0))
+            loaded = await manager._get_manager()
+            refresh_data, refresh_threads = loaded._refresh_data, []
+
+            def record_refresh():
+                refresh_threads.append(threading.current_thread())
+                return refresh_data()
+
+            loaded._refresh_data = record_refresh
+            self.assertFalse(await manager.check_user_permission("alice", "view"))
+            writer.assign_role_to_user("alice", "viewer")
+            self.assertTrue(await manager.check_user_permission("alice", "view"))
+            self.assertEqual(await manager.check_many([("alice", "view")]), [True])
+            self.assertEqual(await manager.permissions_for_users(["alice"]), {"alice": {"view"}})
+            self.assertTrue(refresh_threads)
+            self.assertNotIn(threading.current_thread(), refresh_threads)
+            await manager.close()
+
+        asyncio.run(scenario())
+        writer.close()
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -2,18 +2,174 @@
 Unit tests for authentication.
 
 This module contains unit tests for the authentication functionality of the application.
-It includes tests for user login, logout, and session management.
+It includes tests for account creation, user login and logout.
 
 Classes:
     TestLogin: Contains unit tests for the login functionality.
     TestLogout: Contains unit tests for the logout functionality.
-    TestSessionManagement: Contains unit tests for session management.
+    TestThrottle: Contains unit tests for the failed login throttling.
 
 Functions:
     setUp: Prepares the test environment before each test.
     tearDown: Cleans up the test environment after each test.
+    test_create_account: Tests account creation and duplicate usernames.
     test_login_success: Tests successful login.
     test_login_failure: Tests login failure with incorrect credentials.
+    test_sqlite_storage: Tests that accounts persist through a SQLite backend.
+    test_rehash_on_login: Tests that a hash made with other settings is replaced after login.
+    test_legacy_hash: Tests that an unsalted SHA-256 hash is verified and upgraded.
+    test_invalid_account: Tests that accounts not matching the schema are rejected.
+    test_account_names: Tests that names with punctuation and custom roles are stored.
     test_logout: Tests successful logout.
-    test_session_expiry: Tests session expiry after a certain period of inactivity.
-"""
\ No newline at end of file
+    test_lockout: Tests that a locked out user is rejected even with the right password.
+    test_lockout_expiry: Tests that lockouts expire and grow with every further lockout.
+    test_source_lockout: Tests that a source guessing many usernames is locked out.
+"""
+import os
+import shutil
+import sys
+import tempfile
+import unittest
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "src"))
+
+from auth import AuthManager
+from hashing import PBKDF2Hasher
+from storage import JSONFileBackend, SQLiteBackend
+from throttle import LoginThrottle
+from utils import hash_password
+
+
+class _QuietAuthManager(AuthManager):
+    VERBOSE = False
+
+
+def _open_manager(directory: str, throttle=None):
+    storage = JSONFileBackend(os.path.join(directory, "auth.json"), {"users": {}})
+    return _QuietAuthManager(storage, hasher=PBKDF2Hasher(1000), throttle=throttle)
+
+
+class TestLogin(unittest.TestCase):
+
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+        self.manager = _open_manager(self.directory)
+        self.manager.create_account("alice", "password123")
+
+    def tearDown(self):
+        self.manager.close()
+        shutil.rmtree(self.directory)
+
+    def test_create_account(self):
+        self.assertFalse(self.manager.create_account("alice", "other"))
+        self.assertTrue(self.manager.create_account("bob", "password456", "admin"))
+        users = _open_manager(self.directory).data["users"]
+        self.assertEqual(sorted(users), ["alice", "bob"])
+        self.assertEqual(users["bob"]["role"], "admin")
+        self.assertNotIn("password456", users["bob"]["password"])
+
+    def test_login_success(self):
+        self.assertTrue(self.manager.login_user("alice", "password123"))
+
+    def test_login_failure(self):
+        self.assertFalse(self.manager.login_user("alice", "wrong"))
+        self.assertFalse(self.manager.login_user("nobody", "password123"))
+
+    def test_sqlite_storage(self):
+        path = os.path.join(self.directory, "auth.db")
+        manager = _QuietAuthManager(SQLiteBackend(path, {"users": {}}), hasher=PBKDF2Hasher(1000))
+        manager.create_account("bob", "password456", "admin")
+        manager.close()
+        manager = _QuietAuthManager(SQLiteBackend(path, {"users": {}}), hasher=PBKDF2Hasher(1000))
+        self.assertTrue(manager.login_user("bob", "password456"))
+        self.assertEqual(manager.storage.find_by_role("admin"), ["bob"])
+        manager.close()
+
+    def test_rehash_on_login(self):
+        old_hash = self.manager.data["users"]["alice"]["password"]
+        self.manager.hasher = PBKDF2Hasher(2000)
+        self.assertTrue(self.manager.login_user("alice", "password123"))
+        new_hash = self.manager.data["users"]["alice"]["password"]
+        self.assertNotEqual(new_hash, old_hash)
+        self.assertFalse(self.manager.hasher.needs_rehash(new_hash))
+        self.assertTrue(self.manager.login_user("alice", "password123"))
+
+    def test_legacy_hash(self):
+        self.manager.data["users"]["alice"]["password"] = hash_password("password123")
+        self.assertFalse(self.manager.login_user("alice", "wrong"))
+        self.assertTrue(self.manager.login_user("alice", "password123"))
+        self.assertTrue(self.manager.data["users"]["alice"]["password"].startswith("pbkdf2_sha256$"))
+        self.assertTrue(_open_manager(self.directory).login_user("alice", "password123"))
+
+    def test_invalid_account(self):
+        self.assertFalse(self.manager.create_account("bad name", "password456"))
+        self.assertFalse(self.manager.create_account("", "password456"))
+        self.assertNotIn("bad name", self.manager.data["users"])
+        self.manager.VALIDATE_WRITES = False
+        self.assertTrue(self.manager.create_account("bad name", "password456"))
+
+    def test_account_names(self):
+        self.assertTrue(self.manager.create_account("a+b@example.com", "password456", role="editor"))
+        self.assertEqual(_open_manager(self.directory).data["users"]["a+b@example.com"]["role"], "editor")
+        self.assertTrue(self.manager.login_user("a+b@example.com", "password456"))
+
+
+class TestLogout(unittest.TestCase):
+
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+        self.manager = _open_manager(self.directory)
+        self.manager.create_account("alice", "password123")
+
+    def tearDown(self):
+        self.manager.close()
+        shutil.rmtree(self.directory)
+
+    def test_logout(self):
+        self.assertTrue(self.manager.logout_user("alice"))
+        self.assertIsNone(self.manager.data["users"]["alice"]["session_token"])
+        self.assertFalse(self.manager.logout_user("nobody"))
+
+
+class TestThrottle(unittest.TestCase):
+
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+
+    def tearDown(self):
+        shutil.rmtree(self.directory)
+
+    def test_lockout(self):
+        manager = _open_manager(self.directory, throttle=LoginThrottle(max_failures=3, lockout=60))
+        manager.create_account("alice", "password123")
+        for _ in range(3):
+            self.assertFalse(manager.login_user("alice", "wrong"))
+        self.assertGreater(manager.throttle.retry_after("alice"), 0)
+        self.assertFalse(manager.login_user("alice", "password123"))
+        self.assertEqual(manager.throttle.retry_after("carol"), 0)
+        manager.close()
+
+    def test_lockout_expiry(self):
+        throttle = LoginThrottle(max_failures=2, window=100, lockout=10, lockout_factor=2, max_lockout=15)
+        for now in (0, 1):
+            throttle.record_failure("alice", now=now)
+        self.assertEqual(throttle.retry_after("alice", now=1), 10)
+        self.assertEqual(throttle.retry_after("alice", now=11), 0)
+        for now in (12, 13):
+            throttle.record_failure("alice", now=now)
+        self.assertEqual(throttle.retry_after("alice", now=13), 15) # Doubled, capped at max_lockout
+        throttle.record_success("alice")
+        self.assertEqual(throttle.retry_after("alice", now=13), 0)
+
+    def test_source_lockout(self):
+        throttle = LoginThrottle(max_failures=5, source_max_failures=3, lockout=10)
+        for username in ("alice", "bob", "carol"):
+            throttle.record_failure(username, "10.0.0.1", now=0)
+        self.assertEqual(throttle.retry_after("dave", now=1), 0)
+        self.assertEqual(throttle.retry_after("dave", "10.0.0.1", now=1), 9)
+        throttle.record_success("alice")
+        self.assertEqual(throttle.retry_after("alice", "10.0.0.1", now=1), 9)
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,104 @@
+"""
+Unit tests for the benchmark suite
+
+This module contains unit tests running the benchmark suite on a tiny dataset.
+
+Classes:
+    TestBenchmark: Contains unit tests for the benchmark suite.
+
+Methods:
+    test_build_dataset(self): Tests that a dataset is reproducible from its seed.
+    test_run_benchmarks(self): Tests a short run of every operation.
+    test_dataset_unchanged(self): Tests that a run leaves the dataset as it was built.
+    test_skipped_writes(self): Tests that writes from several processes only run on the shared store.
+    test_compare_results(self): Tests that throughput drops and p99 rises are flagged.
+"""
+import os
+import shutil
+import sys
+import tempfile
+import unittest
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "src"))
+
+from benchmark import OPERATIONS, build_dataset, compare_results, load_results, run_benchmarks, save_results
+
+
+class TestBenchmark(unittest.TestCase):
+
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+
+    def tearDown(self):
+        shutil.rmtree(self.directory)
+
+    def _build(self, name: str, store: str = "journal", seed: int = 0):
+        return build_dataset(os.path.join(self.directory, name), users=50, roles=10, permissions=40,
+                             permissions_per_role=5, store=store, seed=seed, scrypt_n=2 ** 4)
+
+    def _read_rbac_store(self, name: str, manifest: dict):
+        with open(os.path.join(self.directory, name, manifest["rbac_store"]), "rb") as file:
+            return file.read()
+
+    def _read_directory(self, directory: str):
+        files = {}
+        for name in os.listdir(directory):
+            with open(os.path.join(directory, name), "rb") as file:
+                files[name] = file.read()
+        return files
+
+    def test_build_dataset(self):
+        manifest = self._build("first")
+        self.assertEqual(manifest["users"], 50)
+        self.assertTrue(os.path.exists(os.path.join(self.directory, "first", manifest["auth_store"])))
+        first = self._read_rbac_store("first", manifest)
+        self.assertEqual(self._read_rbac_store("second", self._build("second")), first)
+        self.assertNotEqual(self._read_rbac_store("other", self._build("other", seed=1)), first)
+        with self.assertRaises(ValueError):
+            self._build("unknown", store="unknown")
+
+    def test_run_benchmarks(self):
+        self._build("dataset")
+        results = run_benchmarks(os.path.join(self.directory, "dataset"), modes=("single", "threads"),
+                                 workers=2, duration=0.05, max_ops=20, warmup=0)
+        rows = {(row["operation"], row["mode"]): row for row in results["results"]}
+        self.assertEqual(set(rows), {(operation, mode) for operation in OPERATIONS for mode in ("single", "threads")})
+        for row in rows.values():
+            if "skipped" not in row:
+                self.assertGreater(row["ops"], 0)
+                self.assertGreaterEqual(row["p99"], row["p50"])
+        path = os.path.join(self.directory, "results.json")
+        save_results(results, path)
+        self.assertEqual(load_results(path)["results"], results["results"])
+        with self.assertRaises(ValueError):
+            run_benchmarks(os.path.join(self.directory, "dataset"), modes=("unknown",))
+
+    def test_dataset_unchanged(self):
+        self._build("dataset")
+        directory = os.path.join(self.directory, "dataset")
+        built = self._read_directory(directory)
+        run_benchmarks(directory, operations=("create_account", "create_session"), modes=("single",),
+                       duration=0.05, max_ops=20, warmup=0)
+        self.assertEqual(self._read_directory(directory), built)
+        self.assertEqual(os.listdir(self.directory), ["dataset"])
+
+    def test_skipped_writes(self):
+        for store in ("sqlite", "journal"):
+            with self.subTest(store=store):
+                self._build(store, store=store)
+                results = run_benchmarks(os.path.join(self.directory, store), operations=("create_account",),
+                                         modes=("processes",), workers=2, duration=0.05, max_ops=5, warmup=0)
+                self.assertIn("skipped", results["results"][0])
+
+    def test_compare_results(self):
+        row = {"operation": "login_user", "mode": "single", "workers": 1, "throughput": 100.0, "p99": 0.01}
+        baseline = {"results": [row]}
+        slower = {"results": [dict(row, throughput=80.0)]}
+        steady = {"results": [dict(row, throughput=95.0, p99=0.0105)]}
+        self.assertTrue(compare_results(baseline, slower)[0]["regression"])
+        self.assertFalse(compare_results(baseline, steady)[0]["regression"])
+        self.assertEqual(compare_results(baseline, {"results": []}), [])
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,138 @@
+"""
+Unit tests for bulk user import and export
+
+This module contains unit tests for importing users from CSV and JSON Lines
+files and exporting them again.
+
+Classes:
+    TestBulk: Contains unit tests for the bulk import and export.
+
+Methods:
+    test_import_csv(self): Tests importing plain text passwords from a CSV file.
+    test_import_jsonl(self): Tests importing password hashes from a JSON Lines file.
+    test_invalid_records(self): Tests that invalid and duplicate records are skipped and counted.
+    test_export_round_trip(self): Tests that an export can be imported again, in both formats.
+    test_export_during_writes(self): Tests that an export streams the records while accounts are created.
+    test_add_users_silent(self): Tests that a batch with invalid records prints nothing.
+"""
+import contextlib
+import io
+import os
+import shutil
+import sys
+import tempfile
+import unittest
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "src"))
+
+from auth import AuthManager
+from bulk import export_users, import_users, read_users, write_users
+from hashing import PBKDF2Hasher
+from storage import JSONFileBackend, SQLiteBackend
+
+
+class _QuietAuthManager(AuthManager):
+    VERBOSE = False
+
+
+def _open_manager(directory: str, name: str = "auth.json"):
+    storage = JSONFileBackend(os.path.join(directory, name), {"users": {}})
+    return _QuietAuthManager(storage, hasher=PBKDF2Hasher(1000))
+
+
+class TestBulk(unittest.TestCase):
+
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+        self.manager = _open_manager(self.directory)
+
+    def tearDown(self):
+        self.manager.close()
+        shutil.rmtree(self.directory)
+
+    def test_import_csv(self):
+        file = io.StringIO("username,password,role\nalice,password123,admin\nbob,password456,\n")
+        summary = import_users(self.manager, read_users(file, "csv"), batch_size=1)
+        self.assertEqual(summary, {"imported": 2, "skipped": 0, "invalid": 0})
+        self.assertEqual(self.manager.data["users"]["alice"]["role"], "admin")
+        self.assertEqual(self.manager.data["users"]["bob"]["role"], "user")
+        self.assertTrue(self.manager.verify_user("alice", "password123"))
+        self.assertTrue(self.manager.verify_user("bob", "password456"))
+
+    def test_import_jsonl(self):
+        password_hash = PBKDF2Hasher(1000).hash("password123")
+        file = io.StringIO('{"username": "alice", "password_hash": "%s", "role": "admin"}\n\n'
+                           '{"username": "bob", "password": "password456"}\n' % password_hash)
+        summary = import_users(self.manager, read_users(file, "jsonl"))
+        self.assertEqual(summary, {"imported": 2, "skipped": 0, "invalid": 0})
+        self.assertEqual(self.manager.data["users"]["alice"]["password"], password_hash)
+        self.assertTrue(self.manager.verify_user("alice", "password123"))
+        self.assertTrue(self.manager.verify_user("bob", "password456"))
+
+    def test_invalid_records(self):
+        self.manager.create_account("alice", "password123")
+        file = io.StringIO("\n".join([
+            '{"username": "alice", "password": "other"}', # Existing user
+            '{"username": "bob", "password": "password456"}',
+            '{"username": "bob", "password": "other"}', # Duplicate in the file
+            'not json',
+            '{"username": "carol"}',
+            '{"username": "dave", "password": "x", "password_hash": "y"}',
+            '{"username": "erin", "password_hash": "not-a-hash"}',
+            '{"username": "frank", "password": 12345}',
+        ]) + "\n")
+        output, errors = io.StringIO(), io.StringIO()
+        with contextlib.redirect_stdout(output), contextlib.redirect_stderr(errors):
+            summary = import_users(self.manager, read_users(file, "jsonl"), batch_size=3)
+        self.assertEqual(summary, {"imported": 1, "skipped": 2, "invalid": 5})
+        self.assertEqual(output.getvalue(), "")
+        self.assertIn("Line 4: unreadable record, skipped.", errors.getvalue())
+        self.assertEqual(sorted(self.manager.data["users"]), ["alice", "bob"])
+        self.assertTrue(self.manager.verify_user("alice", "password123"))
+
+    def test_export_round_trip(self):
+        self.manager.create_account("alice", "password123", "admin")
+        self.manager.create_account("bob", "password456")
+        for file_format in ("csv", "jsonl"):
+            with self.subTest(file_format=file_format):
+                file = io.StringIO()
+                self.assertEqual(write_users(export_users(self.manager.storage), file, file_format), 2)
+                file.seek(0)
+                target = _open_manager(self.directory, f"{file_format}.json")
+                summary = import_users(target, read_users(file, file_format))
+                self.assertEqual(summary, {"imported": 2, "skipped": 0, "invalid": 0})
+                self.assertEqual(list(export_users(target.storage)), list(export_users(self.manager.storage)))
+                self.assertTrue(target.verify_user("alice", "password123"))
+                target.close()
+
+    def test_export_during_writes(self):
+        for name, storage in (("json", JSONFileBackend(os.path.join(self.directory, "writes.json"), {"users": {}})),
+                              ("sqlite", SQLiteBackend(os.path.join(self.directory, "writes.db"), {"users": {}}))):
+            with self.subTest(backend=name):
+                manager = _QuietAuthManager(storage, hasher=PBKDF2Hasher(1000))
+                for username in ("alice", "bob", "carol"):
+                    manager.create_account(username, "password123")
+                records = export_users(storage)
+                self.assertEqual(next(records)["username"], "alice")
+                manager.create_account("dave", "password123")
+                self.assertEqual([record["username"] for record in records][:2], ["bob", "carol"])
+                manager.close()
+        storage = SQLiteBackend(os.path.join(self.directory, "writes.db"), {"users": {}})
+        self.assertEqual([key for key, _ in storage.iter_records("users", batch_size=2)],
+                         ["alice", "bob", "carol", "dave"])
+        storage.close()
+
+    def test_add_users_silent(self):
+        manager = AuthManager(JSONFileBackend(os.path.join(self.directory, "verbose.json"), {"users": {}}),
+                              hasher=PBKDF2Hasher(1000))
+        output = io.StringIO()
+        with contextlib.redirect_stdout(output):
+            added = manager.add_users([("alice", PBKDF2Hasher(1000).hash("password123"), "user"),
+                                       ("bad name", PBKDF2Hasher(1000).hash("password123"), "user")])
+        self.assertEqual(added, ["alice"])
+        self.assertEqual(output.getvalue(), "")
+        manager.close()
+
+
+if __name__ == "__main__":
+    unittest.main()
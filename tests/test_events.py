@@ -0,0 +1,141 @@
+"""
+Unit tests for the event log
+
+This module contains unit tests for the structured event log and the events
+the managers report to it.
+
+Classes:
+    TestEventLog: Contains unit tests for EventLog.
+    TestManagerEvents: Contains unit tests for the events reported by the managers.
+
+Methods:
+    test_write(self): Tests that emitted events are written as JSON lines.
+    test_level_and_sampling(self): Tests that filtered and sampled out events are not written.
+    test_full_queue(self): Tests that events are dropped and counted once the queue is full.
+    test_closed(self): Tests that events emitted after closing are ignored.
+    test_login_events(self): Tests the events of account creation, logins and sessions.
+    test_rbac_events(self): Tests the events of role and permission changes and checks.
+"""
+import json
+import os
+import shutil
+import sys
+import tempfile
+import unittest
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "src"))
+
+from events import DEBUG, INFO, WARNING, EventLog
+from hashing import PBKDF2Hasher
+from rbac import RBACManager
+from session import SessionManager
+from storage import JSONFileBackend
+
+
+class _QuietSessionManager(SessionManager):
+    VERBOSE = False
+
+
+class _QuietRBACManager(RBACManager):
+    VERBOSE = False
+
+
+def _read_events(path: str):
+    with open(path) as file:
+        return [json.loads(line) for line in file]
+
+
+class TestEventLog(unittest.TestCase):
+
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+        self.path = os.path.join(self.directory, "events.jsonl")
+
+    def tearDown(self):
+        shutil.rmtree(self.directory)
+
+    def test_write(self):
+        events = EventLog(self.path, flush_interval=60)
+        self.assertTrue(events.emit("login.success", username="alice"))
+        self.assertTrue(events.emit("login.failure", WARNING, username="bob", reason="password"))
+        events.flush()
+        records = _read_events(self.path)
+        self.assertEqual([(record["event"], record["level"]) for record in records],
+                         [("login.success", "INFO"), ("login.failure", "WARNING")])
+        self.assertEqual(records[1]["reason"], "password")
+        self.assertIn("ts", records[0])
+        events.close()
+
+    def test_level_and_sampling(self):
+        events = EventLog(self.path, level=INFO, sample={"permission.granted": 0}, flush_interval=60)
+        self.assertFalse(events.emit("session.validated", DEBUG))
+        self.assertFalse(events.emit("permission.granted", INFO))
+        self.assertTrue(events.emit("permission.denied", INFO))
+        self.assertFalse(events.enabled(DEBUG))
+        events.close()
+        self.assertEqual([record["event"] for record in _read_events(self.path)], ["permission.denied"])
+
+    def test_full_queue(self):
+        events = EventLog(self.path, max_queue=10, batch_size=100, flush_interval=60)
+        for index in range(25):
+            events.emit("check", index=index)
+        self.assertEqual(events.dropped, 15)
+        events.close()
+        self.assertEqual([record["index"] for record in _read_events(self.path)], list(range(10)))
+
+    def test_closed(self):
+        events = EventLog(self.path)
+        events.close()
+        self.assertFalse(events.emit("login.success"))
+        events.close()
+        self.assertEqual(_read_events(self.path), [])
+
+
+class TestManagerEvents(unittest.TestCase):
+
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+        self.path = os.path.join(self.directory, "events.jsonl")
+        self.events = EventLog(self.path, level=DEBUG, flush_interval=60)
+
+    def tearDown(self):
+        self.events.close()
+        shutil.rmtree(self.directory)
+
+    def test_login_events(self):
+        storage = JSONFileBackend(os.path.join(self.directory, "auth.json"), {"users": {}})
+        manager = _QuietSessionManager(storage, hasher=PBKDF2Hasher(1000), events=self.events)
+        manager.create_account("alice", "password123")
+        manager.login_user("alice", "wrong")
+        manager.login_user("nobody", "password123")
+        manager.login_user("alice", "password123")
+        session_token = manager.create_session("alice")
+        manager.validate_session("alice", session_token)
+        manager.terminate_session(session_token)
+        manager.close()
+        self.events.flush()
+        records = _read_events(self.path)
+        self.assertEqual([record["event"] for record in records],
+                         ["user.created", "login.failure", "login.failure", "login.success", "session.created",
+                          "session.validated", "session.terminated"])
+        self.assertEqual([record.get("reason") for record in records[1:3]], ["password", "unknown_user"])
+
+    def test_rbac_events(self):
+        default = {"users": {}, "roles": {}, "permissions": {}, "role_inheritance": {}}
+        manager = _QuietRBACManager(JSONFileBackend(os.path.join(self.directory, "rbac.json"), default),
+                                    events=self.events)
+        manager.add_role("editor")
+        manager.add_permission("edit")
+        manager.assign_permission_to_role("editor", "edit")
+        manager.assign_role_to_user("alice", "editor")
+        manager.check_user_permission("alice", "edit")
+        manager.check_user_permission("alice", "view")
+        manager.close()
+        self.events.flush()
+        self.assertEqual([record["event"] for record in _read_events(self.path)],
+                         ["role.added", "permission.added", "permission.assigned", "role.assigned",
+                          "permission.granted", "permission.denied"])
+
+
+if __name__ == "__main__":
+    unittest.main()
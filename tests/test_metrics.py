@@ -0,0 +1,163 @@
+"""
+Unit tests for the metrics registry
+
+This module contains unit tests for the histograms, the instrumented managers
+and the Prometheus exposition.
+
+Classes:
+    TestHistogram: Contains unit tests for Histogram.
+    TestMetrics: Contains unit tests for the metrics recorded by the managers and backends.
+
+Methods:
+    test_buckets(self): Tests that every value falls in a bucket whose bounds hold it.
+    test_quantiles(self): Tests the quantile estimates and the summary.
+    test_manager_metrics(self): Tests the latencies, failures and write sizes of an instrumented manager.
+    test_cache_hit_ratio(self): Tests that only the lookups of the user mask cache count towards its hit ratio.
+    test_uninstrumented(self): Tests that managers built without a registry are left untouched.
+    test_prometheus(self): Tests the text exposition format.
+    test_reset(self): Tests that resetting keeps the metrics registered.
+"""
+import os
+import shutil
+import sys
+import tempfile
+import unittest
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "src"))
+
+from hashing import PBKDF2Hasher
+from metrics import Histogram, Metrics, _bucket, _upper_bound
+from rbac import RBACManager
+from session import SessionManager
+from storage import JournalBackend, JSONFileBackend
+
+RBAC_DEFAULT = {"users": {}, "roles": {}, "permissions": {}, "role_inheritance": {}}
+
+
+class _QuietSessionManager(SessionManager):
+    VERBOSE = False
+
+
+class _QuietRBACManager(RBACManager):
+    VERBOSE = False
+
+
+class TestHistogram(unittest.TestCase):
+
+    def test_buckets(self):
+        for value in list(range(5000)) + [2 ** 40 + 12345, 2 ** 63]:
+            index = _bucket(value)
+            self.assertGreaterEqual(_upper_bound(index), value)
+            if index:
+                self.assertLess(_upper_bound(index - 1), value)
+
+    def test_quantiles(self):
+        histogram = Histogram()
+        self.assertEqual(histogram.snapshot()["p99"], 0.0)
+        for value in range(1, 1001):
+            histogram.record(value * 1000)
+        summary = histogram.snapshot()
+        self.assertEqual(summary["count"], 1000)
+        self.assertAlmostEqual(summary["mean"], 500.5e-6)
+        for name, exact in (("p50", 500e-6), ("p90", 900e-6), ("p99", 990e-6)):
+            self.assertGreaterEqual(summary[name], exact)
+            self.assertLess(summary[name], exact * 1.13) # Within one of 8 sub-buckets per power of two
+        self.assertGreaterEqual(summary["max"], 1e-3)
+
+
+class TestMetrics(unittest.TestCase):
+
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+
+    def tearDown(self):
+        shutil.rmtree(self.directory)
+
+    def _open_managers(self, metrics=None):
+        sessions = _QuietSessionManager(JournalBackend(os.path.join(self.directory, "auth.json"), {"users": {}}),
+                                        hasher=PBKDF2Hasher(1000), metrics=metrics)
+        rbac = _QuietRBACManager(JSONFileBackend(os.path.join(self.directory, "rbac.json"), RBAC_DEFAULT),
+                                 metrics=metrics)
+        return sessions, rbac
+
+    def test_manager_metrics(self):
+        metrics = Metrics()
+        sessions, rbac = self._open_managers(metrics)
+        sessions.create_account("alice", "password123")
+        sessions.login_user("alice", "wrong")
+        sessions.login_user("alice", "password123")
+        session_token = sessions.create_session("alice")
+        sessions.validate_token(session_token)
+        sessions.validate_token("unknown")
+        rbac.add_role("editor")
+        rbac.add_permission("edit")
+        rbac.assign_permission_to_role("editor", "edit")
+        rbac.assign_role_to_user("alice", "editor")
+        for _ in range(10):
+            rbac.check_user_permission("alice", "edit")
+        rbac.check_user_permission("alice", "view")
+        snapshot = metrics.snapshot()
+        counters, histograms = snapshot["counters"], snapshot["histograms"]
+        self.assertEqual(histograms["login_user_seconds"]["count"], 2)
+        self.assertEqual(counters["login_user_failures_total"], 1)
+        self.assertEqual(counters["validate_token_failures_total"], 1)
+        self.assertEqual(histograms["check_user_permission_seconds"]["count"], 11)
+        self.assertEqual(counters["check_user_permission_failures_total"], 1)
+        self.assertGreater(histograms["storage_append_bytes"]["count"], 0)
+        self.assertGreater(histograms["storage_snapshot_bytes"]["count"], 0)
+        self.assertIn("user_mask", snapshot["caches"])
+        sessions.close()
+        rbac.close()
+
+    def test_cache_hit_ratio(self):
+        metrics = Metrics()
+        sessions, rbac = self._open_managers(metrics)
+        rbac.add_role("editor")
+        for permission_name in ("view", "edit"):
+            rbac.add_permission(permission_name)
+        rbac.assign_permission_to_role("editor", "edit")
+        rbac.assign_role_to_user("alice", "editor")
+        rbac.check_user_permission("nobody", "edit")
+        rbac.check_user_permission("alice", "edit")
+        rbac.check_user_permission("alice", "view")
+        rbac.check_many([("alice", "edit"), ("bob", "edit"), ("alice", "view")])
+        rbac.permissions_for_users(["alice", "nobody"])
+        self.assertEqual(metrics.snapshot()["caches"]["user_mask"], {"lookups": 4, "misses": 1, "hit_ratio": 0.75})
+        self.assertIn("auth_user_mask_cache_hit_ratio 0.75\n", metrics.prometheus())
+        sessions.close()
+        rbac.close()
+
+    def test_uninstrumented(self):
+        sessions, rbac = self._open_managers()
+        self.assertNotIn("login_user", vars(sessions))
+        self.assertNotIn("check_user_permission", vars(rbac))
+        self.assertIsNone(sessions.storage.metrics)
+        sessions.close()
+        rbac.close()
+
+    def test_prometheus(self):
+        metrics = Metrics(namespace="test")
+        metrics.inc("logins_total", 3)
+        histogram = metrics.histogram("check_seconds")
+        for value in (1500, 3000, 5000000):
+            histogram.record(value)
+        text = metrics.prometheus()
+        self.assertIn("# TYPE test_logins_total counter\ntest_logins_total 3\n", text)
+        self.assertIn('test_check_seconds_bucket{le="2.048e-06"} 1\n', text)
+        self.assertIn('test_check_seconds_bucket{le="+Inf"} 3\n', text)
+        self.assertIn("test_check_seconds_count 3\n", text)
+
+    def test_reset(self):
+        metrics = Metrics()
+        timed = metrics.timed("check", lambda value: value)
+        timed(True)
+        timed(False)
+        self.assertEqual(metrics.counter("check_failures_total").value, 1)
+        metrics.reset()
+        timed(True)
+        self.assertEqual(metrics.histogram("check_seconds").count, 1)
+        self.assertEqual(metrics.counter("check_failures_total").value, 0)
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -5,12 +5,386 @@ This module contains unit tests for the Role-Based Access Control (RBAC) system.
 
 Classes:
     TestRBAC: Contains unit tests for the RBAC system.
+    TestSharedRBAC: Contains unit tests for managers sharing a store between processes.
 
 Methods:
     setUp(self): Sets up the test environment.
     test_add_role(self): Tests adding a role to the RBAC system.
     test_remove_role(self): Tests removing a role from the RBAC system.
     test_assign_permission(self): Tests assigning a permission to a role.
-    test_revoke_permission(self): Tests revoking a permission from a role.
-    test_check_permission(self): Tests checking if a role has a specific permission.
-"""
\ No newline at end of file
+    test_revoke_permission(self): Tests revoking a permission from every role and user.
+    test_check_permission(self): Tests checking if a user has a specific permission.
+    test_check_permissions(self): Tests checking several permissions at once.
+    test_user_permissions(self): Tests permissions granted to a user directly.
+    test_check_many(self): Tests checking a batch of (user, permission) pairs.
+    test_permissions_for_users(self): Tests resolving the permissions of several users.
+    test_assign_role(self): Tests assigning roles to users and removing them.
+    test_inheritance(self): Tests that roles inherit the permissions of the roles they inherit.
+    test_inheritance_cycle(self): Tests that an inheritance creating a cycle is rejected.
+    test_remove_inherited_role(self): Tests that removing a role drops its inheritance edges.
+    test_revocation_updates_cached_checks(self): Tests that every revocation updates the cached permissions.
+    test_reload(self): Tests that a reopened store holds the same data.
+    test_concurrent_checks(self): Tests that checks running next to writer threads stay consistent.
+    test_checks_during_reload(self): Tests that checks running next to full index rebuilds never fail.
+    test_check_during_write(self): Tests that a check filling the mask cache does not wait for a writer.
+    test_invalid_names(self): Tests that names not matching the schema are rejected.
+    test_names(self): Tests that names with punctuation are stored.
+    test_policy_changes(self): Tests publishing the policy changes to subscribers and iterators.
+    test_change_file(self): Tests following the policy changes through the change file.
+    test_changes_from_other_process(self): Tests that cached checks follow the changes of another manager.
+"""
+import json
+import os
+import shutil
+import sys
+import tempfile
+import threading
+import time
+import unittest
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "src"))
+
+from changes import ChangeFeed, tail_changes
+from rbac import RBACManager
+from storage import JSONFileBackend, SharedJournalBackend
+
+DEFAULT = {"users": {}, "roles": {}, "permissions": {}, "role_inheritance": {}}
+
+
+class _QuietRBACManager(RBACManager):
+    VERBOSE = False
+
+
+def _open_manager(directory: str):
+    return _QuietRBACManager(JSONFileBackend(os.path.join(directory, "rbac.json"), DEFAULT))
+
+
+class TestRBAC(unittest.TestCase):
+
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+        self.manager = _open_manager(self.directory)
+        for role in ("viewer", "editor", "admin"):
+            self.manager.add_role(role)
+        for permission_name in ("view", "edit", "delete"):
+            self.manager.add_permission(permission_name)
+        self.manager.assign_permission_to_role("viewer", "view")
+        self.manager.assign_permission_to_role("editor", "edit")
+        self.manager.assign_permission_to_role("admin", "delete")
+
+    def tearDown(self):
+        self.manager.close()
+        shutil.rmtree(self.directory)
+
+    def test_add_role(self):
+        self.assertTrue(self.manager.add_role("auditor"))
+        self.assertFalse(self.manager.add_role("auditor"))
+        self.assertEqual(self.manager.data["roles"]["auditor"], [])
+
+    def test_remove_role(self):
+        self.manager.assign_role_to_user("alice", "viewer")
+        self.assertTrue(self.manager.check_user_permission("alice", "view"))
+        self.assertTrue(self.manager.remove_role("viewer"))
+        self.assertFalse(self.manager.remove_role("viewer"))
+        self.assertNotIn("viewer", self.manager.data["roles"])
+        self.assertFalse(self.manager.check_user_permission("alice", "view"))
+
+    def test_assign_permission(self):
+        self.assertTrue(self.manager.assign_permission_to_role("viewer", "edit"))
+        self.assertFalse(self.manager.assign_permission_to_role("viewer", "edit"))
+        self.assertFalse(self.manager.assign_permission_to_role("viewer", "unknown"))
+        self.assertFalse(self.manager.assign_permission_to_role("unknown", "edit"))
+        self.assertEqual(sorted(self.manager.data["roles"]["viewer"]), ["edit", "view"])
+
+    def test_revoke_permission(self):
+        self.manager.assign_role_to_user("alice", "viewer")
+        self.assertTrue(self.manager.remove_permission("view"))
+        self.assertFalse(self.manager.remove_permission("view"))
+        self.assertNotIn("view", self.manager.data["permissions"])
+        self.assertEqual(self.manager.data["roles"]["viewer"], [])
+        self.assertFalse(self.manager.check_user_permission("alice", "view"))
+
+    def test_check_permission(self):
+        self.manager.assign_role_to_user("alice", "editor")
+        self.assertTrue(self.manager.check_user_permission("alice", "edit"))
+        self.assertFalse(self.manager.check_user_permission("alice", "view"))
+        self.assertFalse(self.manager.check_user_permission("nobody", "edit"))
+
+    def test_check_permissions(self):
+        self.manager.assign_role_to_user("alice", "editor")
+        self.manager.assign_role_to_user("alice", "viewer")
+        self.assertTrue(self.manager.check_user_permissions("alice", ["edit", "view"]))
+        self.assertFalse(self.manager.check_user_permissions("alice", ["edit", "delete"]))
+        self.assertTrue(self.manager.check_user_permissions("alice", ["edit", "delete"], require_all=False))
+        self.assertFalse(self.manager.check_user_permissions("alice", ["delete", "unknown"], require_all=False))
+        self.assertFalse(self.manager.check_user_permissions("alice", ["edit", "unknown"]))
+        self.assertFalse(self.manager.check_user_permissions("nobody", ["edit"]))
+
+    def test_user_permissions(self):
+        self.manager.close()
+        with open(os.path.join(self.directory, "rbac.json"), "w") as file:
+            json.dump({"users": {"alice": {"roles": ["viewer"], "permissions": ["export"]}, "bob": ["editor"]},
+                       "roles": {"viewer": ["view"], "editor": ["edit"]},
+                       "permissions": {"view": [], "edit": [], "export": []}}, file)
+        self.manager = _open_manager(self.directory)
+        self.assertTrue(self.manager.check_user_permission("alice", "export"))
+        self.assertTrue(self.manager.check_user_permission("alice", "view"))
+        self.assertTrue(self.manager.check_user_permission("bob", "edit"))
+        self.manager.remove_permission("export")
+        self.assertFalse(self.manager.check_user_permission("alice", "export"))
+        self.assertEqual(self.manager.data["users"]["alice"]["permissions"], [])
+
+    def test_check_many(self):
+        self.manager.assign_role_to_user("alice", "editor")
+        self.manager.assign_role_to_user("bob", "viewer")
+        pairs = [("alice", "edit"), ("alice", "view"), ("bob", "view"), ("nobody", "view"), ("bob", "unknown")]
+        self.assertEqual(self.manager.check_many(pairs), [True, False, True, False, False])
+        self.assertEqual(self.manager.check_many(pairs),
+                         [self.manager.check_user_permission(username, name) for username, name in pairs])
+        self.assertEqual(self.manager.check_many([]), [])
+
+    def test_permissions_for_users(self):
+        self.manager.assign_role_to_user("alice", "editor")
+        self.manager.assign_role_to_user("alice", "admin")
+        self.manager.assign_role_to_user("bob", "viewer")
+        self.assertEqual(self.manager.permissions_for_users(["alice", "bob", "nobody", "alice"]),
+                         {"alice": {"edit", "delete"}, "bob": {"view"}, "nobody": set()})
+
+    def test_assign_role(self):
+        self.assertTrue(self.manager.assign_role_to_user("alice", "viewer"))
+        self.assertFalse(self.manager.assign_role_to_user("alice", "viewer"))
+        self.assertFalse(self.manager.assign_role_to_user("alice", "unknown"))
+        self.assertTrue(self.manager.remove_role_from_user("alice", "viewer"))
+        self.assertFalse(self.manager.remove_role_from_user("alice", "viewer"))
+        self.assertFalse(self.manager.remove_role_from_user("nobody", "viewer"))
+
+    def test_inheritance(self):
+        self.assertTrue(self.manager.add_role_inheritance("editor", "viewer"))
+        self.assertTrue(self.manager.add_role_inheritance("admin", "editor"))
+        self.assertFalse(self.manager.add_role_inheritance("admin", "editor"))
+        self.assertFalse(self.manager.add_role_inheritance("admin", "unknown"))
+        self.manager.assign_role_to_user("alice", "admin")
+        self.manager.assign_role_to_user("bob", "editor")
+        self.assertEqual(self.manager.permissions_for_users(["alice", "bob"]),
+                         {"alice": {"view", "edit", "delete"}, "bob": {"view", "edit"}})
+        # A permission given to a junior role reaches every senior role
+        self.manager.add_permission("export")
+        self.manager.assign_permission_to_role("viewer", "export")
+        self.assertEqual(self.manager.check_many([("alice", "export"), ("bob", "export")]), [True, True])
+
+    def test_inheritance_cycle(self):
+        self.manager.add_role_inheritance("admin", "editor")
+        self.manager.add_role_inheritance("editor", "viewer")
+        self.assertFalse(self.manager.add_role_inheritance("viewer", "admin"))
+        self.assertFalse(self.manager.add_role_inheritance("viewer", "viewer"))
+        self.assertEqual(self.manager.data["role_inheritance"].get("viewer", []), [])
+
+    def test_remove_inherited_role(self):
+        self.manager.add_role_inheritance("admin", "editor")
+        self.manager.add_role_inheritance("editor", "viewer")
+        self.manager.assign_role_to_user("alice", "admin")
+        self.assertTrue(self.manager.check_user_permission("alice", "view"))
+        self.manager.remove_role("editor")
+        self.assertNotIn("editor", self.manager.data["role_inheritance"])
+        self.assertEqual(self.manager.data["role_inheritance"].get("admin", []), [])
+        self.assertEqual([self.manager.check_user_permission("alice", name) for name in ("view", "edit", "delete")],
+                         [False, False, True])
+
+    def test_revocation_updates_cached_checks(self):
+        self.manager.add_role_inheritance("admin", "editor")
+        self.manager.add_role_inheritance("editor", "viewer")
+        self.manager.assign_role_to_user("alice", "admin")
+        self.manager.assign_role_to_user("bob", "viewer")
+        pairs = [("alice", "view"), ("alice", "edit"), ("alice", "delete"), ("bob", "view")]
+        self.assertEqual(self.manager.check_many(pairs), [True, True, True, True])
+        self.manager.remove_role_inheritance("editor", "viewer")
+        self.assertEqual(self.manager.check_many(pairs), [False, True, True, True])
+        self.manager.remove_role_from_user("alice", "admin")
+        self.assertEqual(self.manager.check_many(pairs), [False, False, False, True])
+        self.manager.assign_role_to_user("alice", "editor")
+        self.manager.remove_role("editor")
+        self.assertEqual(self.manager.check_many(pairs), [False, False, False, True])
+        self.manager.remove_permission("view")
+        self.assertEqual(self.manager.check_many(pairs), [False, False, False, False])
+
+    def test_reload(self):
+        self.manager.add_role_inheritance("admin", "editor")
+        self.manager.assign_role_to_user("alice", "admin")
+        self.manager.assign_role_to_user("bob", "viewer")
+        reopened = _open_manager(self.directory)
+        self.assertEqual(reopened.data, self.manager.data)
+        users = ["alice", "bob", "carol"]
+        self.assertEqual(reopened.permissions_for_users(users), self.manager.permissions_for_users(users))
+
+    def test_concurrent_checks(self):
+        roles = ["viewer", "editor", "admin"]
+        users = [f"user{index}" for index in range(50)]
+        for username in users:
+            self.manager.assign_role_to_user(username, "viewer")
+        stop, errors = threading.Event(), []
+
+        def check():
+            while not stop.is_set():
+                try:
+                    results = self.manager.check_many([(username, "view") for username in users])
+                    self.assertTrue(all(isinstance(result, bool) for result in results))
+                    self.manager.permissions_for_users(users[:10])
+                except Exception as error:
+                    errors.append(error)
+                    return
+                time.sleep(0.001)
+
+        def write(offset: int):
+            for index in range(150):
+                username, role = users[(index * 7 + offset) % len(users)], roles[(index + offset) % len(roles)]
+                if index % 2:
+                    self.manager.assign_role_to_user(username, role)
+                else:
+                    self.manager.remove_role_from_user(username, role)
+                if index % 50 == 0:
+                    self.manager.add_role_inheritance("admin", "editor")
+                    self.manager.remove_role_inheritance("admin", "editor")
+
+        readers = [threading.Thread(target=check) for _ in range(3)]
+        writers = [threading.Thread(target=write, args=(offset,)) for offset in range(3)]
+        for thread in readers + writers:
+            thread.start()
+        for thread in writers:
+            thread.join()
+        stop.set()
+        for thread in readers:
+            thread.join()
+        self.assertEqual(errors, [])
+        self.assertEqual(self.manager.permissions_for_users(users),
+                         _open_manager(self.directory).permissions_for_users(users))
+
+    def test_checks_during_reload(self):
+        self.manager.add_role_inheritance("admin", "editor")
+        users = [f"user{index}" for index in range(50)]
+        for username in users:
+            self.manager.assign_role_to_user(username, "admin")
+        permission_ids = dict(self.manager._permission_ids)
+        stop, errors = threading.Event(), []
+
+        def check():
+            while not stop.is_set():
+                try:
+                    results = self.manager.check_many([(username, "edit") for username in users])
+                    if results != [True] * len(users):
+                        errors.append(results)
+                except Exception as error:
+                    errors.append(error)
+                    return
+
+        readers = [threading.Thread(target=check) for _ in range(3)]
+        for thread in readers:
+            thread.start()
+        for _ in range(200):
+            with self.manager._lock:
+                self.manager._on_storage_changes(None) # What a full reload of a shared store does
+        stop.set()
+        for thread in readers:
+            thread.join()
+        self.assertEqual(errors, [])
+        self.assertEqual(self.manager._permission_ids, permission_ids)
+
+    def test_check_during_write(self):
+        self.manager.assign_role_to_user("alice", "editor")
+        self.manager._invalidate_users(["alice"])
+        writing, done = threading.Event(), threading.Event()
+
+        def write():
+            with self.manager._lock:
+                writing.set()
+                done.wait(5)
+
+        writer = threading.Thread(target=write)
+        writer.start()
+        writing.wait()
+        started = time.monotonic()
+        self.assertTrue(self.manager.check_user_permission("alice", "edit"))
+        self.assertLess(time.monotonic() - started, 1)
+        done.set()
+        writer.join()
+        self.assertIn("alice", self.manager._user_masks)
+
+    def test_invalid_names(self):
+        self.assertFalse(self.manager.add_role("bad role"))
+        self.assertFalse(self.manager.add_permission("bad permission"))
+        self.assertFalse(self.manager.assign_role_to_user("bad user", "viewer"))
+        self.assertNotIn("bad role", self.manager.data["roles"])
+        self.assertNotIn("bad permission", self.manager.data["permissions"])
+        self.assertNotIn("bad user", self.manager.data["users"])
+
+    def test_names(self):
+        self.assertTrue(self.manager.add_permission("posts:read"))
+        self.assertTrue(self.manager.add_role("content-editor"))
+        self.assertTrue(self.manager.assign_permission_to_role("content-editor", "posts:read"))
+        self.assertTrue(self.manager.assign_role_to_user("a+b@example.com", "content-editor"))
+        reopened = _open_manager(self.directory)
+        self.assertTrue(reopened.check_user_permission("a+b@example.com", "posts:read"))
+        reopened.close()
+
+    def test_policy_changes(self):
+        version = self.manager.policy_version
+        received = []
+        self.manager.subscribe(received.append, users=["alice"])
+        self.manager.assign_role_to_user("alice", "viewer")
+        self.manager.assign_role_to_user("bob", "viewer")
+        self.manager.assign_permission_to_role("viewer", "edit")
+        self.assertEqual(self.manager.policy_version, version + 3)
+        self.assertEqual([entry["change"] for entry in received], ["role.assigned", "permission.assigned"])
+        self.assertEqual([entry["version"] for entry in self.manager.changes(since=version, timeout=0)],
+                         [version + 1, version + 2, version + 3])
+        self.assertEqual([entry["users"] for entry in self.manager.changes(since=version, roles=["editor"],
+                                                                           timeout=0.05)], [])
+        self.assertEqual(_open_manager(self.directory).policy_version, version + 3)
+
+    def test_change_file(self):
+        path = os.path.join(self.directory, "changes.jsonl")
+        self.manager.close()
+        self.manager = _QuietRBACManager(JSONFileBackend(os.path.join(self.directory, "rbac.json"), DEFAULT),
+                                         feed=ChangeFeed(path, history=2))
+        version = self.manager.policy_version
+        for username in ("alice", "bob", "carol"):
+            self.manager.assign_role_to_user(username, "viewer")
+        self.assertEqual([entry["users"] for entry in tail_changes(path, since=version, timeout=0)],
+                         [["alice"], ["bob"], ["carol"]])
+        # Further behind than the history kept in memory
+        self.assertEqual([entry["change"] for entry in self.manager.changes(since=version, timeout=0.05)],
+                         ["policy.reset", "role.assigned", "role.assigned"])
+
+
+class TestSharedRBAC(unittest.TestCase):
+
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+
+    def tearDown(self):
+        shutil.rmtree(self.directory)
+
+    def _open_manager(self):
+        return _QuietRBACManager(SharedJournalBackend(os.path.join(self.directory, "rbac.json"), DEFAULT,
+                                                      refresh_interval=0))
+
+    def test_changes_from_other_process(self):
+        writer, reader = self._open_manager(), self._open_manager()
+        writer.add_role("viewer")
+        writer.add_permission("view")
+        writer.assign_permission_to_role("viewer", "view")
+        writer.assign_role_to_user("alice", "viewer")
+        self.assertTrue(reader.check_user_permission("alice", "view"))
+        writer.add_role("admin")
+        writer.add_role_inheritance("admin", "viewer")
+        writer.assign_role_to_user("bob", "admin")
+        self.assertTrue(reader.check_user_permission("bob", "view"))
+        writer.remove_role_inheritance("admin", "viewer")
+        writer.remove_role_from_user("alice", "viewer")
+        self.assertEqual(reader.check_many([("alice", "view"), ("bob", "view")]), [False, False])
+        self.assertEqual(reader.policy_version, writer.policy_version)
+        writer.close()
+        reader.close()
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -6,10 +6,288 @@ in the application.
 
 Classes:
     TestSessionHandling: Contains test cases for session handling.
+    TestSignedSessions: Contains test cases for stateless signed sessions.
 
 Methods:
     test_create_session(self): Tests the creation of a new session.
     test_terminate_session(self): Tests the termination of an existing session.
     test_session_timeout(self): Tests the session timeout functionality.
     test_session_data_persistence(self): Tests the persistence of session data.
-"""
\ No newline at end of file
+    test_concurrent_sessions(self): Tests that a user keeps several sessions open at once.
+    test_validate_token(self): Tests resolving the user of a session token.
+    test_legacy_session(self): Tests that a session stored on the user record is carried over.
+    test_reap_expired_sessions(self): Tests purging the expired sessions from the store.
+    test_lazy_reaping(self): Tests that creating a session purges expired ones.
+    test_sliding_renewal(self): Tests that validation extends a session and persists it once it moved enough.
+    test_shared_sessions(self): Tests that sessions created by another manager are picked up.
+    test_concurrent_renewal(self): Tests that a renewal running next to a termination cannot bring a session back.
+    test_signed_session(self): Tests issuing and validating a signed token.
+    test_key_rotation(self): Tests that tokens keep validating after a key rotation until their key is retired.
+    test_revocation(self): Tests terminating a signed session and logging the user out.
+    test_shared_revocations(self): Tests that signed token checks pick up other processes' revocations on a timer.
+"""
+import json
+import os
+import shutil
+import sys
+import tempfile
+import threading
+import time
+import unittest
+from unittest import mock
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "src"))
+
+from hashing import PBKDF2Hasher
+from session import SessionManager
+from storage import JSONFileBackend, SharedJournalBackend
+from tokens import TokenSigner
+
+
+class _QuietSessionManager(SessionManager):
+    VERBOSE = False
+
+
+def _open_manager(directory: str, signer=None):
+    storage = JSONFileBackend(os.path.join(directory, "auth.json"), {"users": {}})
+    return _QuietSessionManager(storage, hasher=PBKDF2Hasher(1000), signer=signer)
+
+
+def _stored_sessions(directory: str):
+    return JSONFileBackend(os.path.join(directory, "auth.json"), {"users": {}}).load().get("sessions", {})
+
+
+class TestSessionHandling(unittest.TestCase):
+
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+        self.manager = _open_manager(self.directory)
+        self.manager.create_account("alice", "password123")
+        self.manager.create_account("bob", "password456")
+
+    def tearDown(self):
+        self.manager.close()
+        shutil.rmtree(self.directory)
+
+    def test_create_session(self):
+        session_token = self.manager.create_session("alice")
+        self.assertTrue(self.manager.validate_session("alice", session_token))
+        self.assertFalse(self.manager.validate_session("bob", session_token))
+        self.assertFalse(self.manager.validate_session("nobody", session_token))
+        self.assertIsNone(self.manager.create_session("nobody"))
+
+    def test_terminate_session(self):
+        first = self.manager.create_session("alice")
+        second = self.manager.create_session("alice")
+        other = self.manager.create_session("bob")
+        self.assertTrue(self.manager.terminate_session(first))
+        self.assertFalse(self.manager.terminate_session(first))
+        self.assertIsNone(self.manager.validate_token(first))
+        self.assertEqual(self.manager.validate_token(second), "alice")
+        self.manager.logout_user("alice")
+        self.assertIsNone(self.manager.validate_token(second))
+        self.assertEqual(self.manager.validate_token(other), "bob")
+
+    def test_session_timeout(self):
+        session_token = self.manager.create_session("alice")
+        expires_at = self.manager.data["sessions"][session_token]["expires_at"]
+        with mock.patch("time.time", return_value=expires_at + 1):
+            self.assertFalse(self.manager.validate_session("alice", session_token))
+            self.assertIsNone(self.manager.validate_token(session_token))
+
+    def test_session_data_persistence(self):
+        session_token = self.manager.create_session("alice")
+        reopened = _open_manager(self.directory)
+        self.assertTrue(reopened.validate_session("alice", session_token))
+        self.manager.logout_user("alice")
+        self.assertFalse(_open_manager(self.directory).validate_session("alice", session_token))
+
+    def test_concurrent_sessions(self):
+        first = self.manager.create_session("alice")
+        second = self.manager.create_session("alice")
+        self.assertNotEqual(first, second)
+        self.assertTrue(self.manager.validate_session("alice", first))
+        self.assertTrue(self.manager.validate_session("alice", second))
+        self.assertEqual(self.manager.storage.find_by_token(second), "alice")
+        self.manager.logout_user("alice")
+        self.assertFalse(self.manager.validate_session("alice", first))
+        self.assertFalse(self.manager.validate_session("alice", second))
+        self.assertEqual(self.manager.data["sessions"], {})
+
+    def test_validate_token(self):
+        session_token = self.manager.create_session("bob")
+        self.assertEqual(self.manager.validate_token(session_token), "bob")
+        self.assertIsNone(self.manager.validate_token("unknown"))
+        self.manager.SESSION_DURATION = -10
+        self.assertIsNone(self.manager.validate_token(self.manager.create_session("bob")))
+
+    def test_legacy_session(self):
+        self.manager.close()
+        path = os.path.join(self.directory, "auth.json")
+        with open(path) as file:
+            data = json.load(file)
+        data.pop("sessions", None)
+        data["users"]["alice"]["session_token"] = "legacy-token"
+        data["users"]["alice"]["expires_at"] = "2999-01-01T00:00:00+00:00"
+        with open(path, "w") as file:
+            json.dump(data, file)
+        self.manager = _open_manager(self.directory)
+        self.assertTrue(self.manager.validate_session("alice", "legacy-token"))
+        self.assertEqual(self.manager.validate_token("legacy-token"), "alice")
+
+    def test_reap_expired_sessions(self):
+        active = self.manager.create_session("bob")
+        self.manager.REAP_BATCH_SIZE = 0 # No lazy reaping when sessions are created
+        self.manager.SESSION_DURATION = -10 # Expired as soon as created
+        expired = [self.manager.create_session("alice") for _ in range(3)]
+        del self.manager.REAP_BATCH_SIZE, self.manager.SESSION_DURATION
+        self.assertEqual(len(self.manager.data["sessions"]), 4)
+        self.assertEqual(self.manager.reap_expired_sessions(), 3)
+        self.assertEqual(self.manager.reap_expired_sessions(), 0)
+        self.assertEqual(list(self.manager.data["sessions"]), [active])
+        self.assertNotIn("alice", self.manager._user_sessions)
+        self.assertEqual(list(_stored_sessions(self.directory)), [active])
+        for session_token in expired:
+            self.assertIsNone(self.manager.validate_token(session_token))
+
+    def test_lazy_reaping(self):
+        self.manager.SESSION_DURATION = -10
+        expired = self.manager.create_session("alice")
+        del self.manager.SESSION_DURATION
+        self.assertIn(expired, self.manager.data["sessions"])
+        active = self.manager.create_session("alice")
+        self.assertEqual(list(self.manager.data["sessions"]), [active])
+
+    def test_sliding_renewal(self):
+        now = time.time()
+        session_token = self.manager.create_session("alice")
+        created_expiry = self.manager.data["sessions"][session_token]["expires_at"]
+        with mock.patch("time.time", return_value=now + 30):
+            self.assertTrue(self.manager.validate_session("alice", session_token))
+        self.assertGreater(self.manager.data["sessions"][session_token]["expires_at"], created_expiry)
+        self.assertEqual(_stored_sessions(self.directory)[session_token]["expires_at"], created_expiry)
+        with mock.patch("time.time", return_value=now + 100):
+            self.assertEqual(self.manager.validate_token(session_token), "alice")
+        renewed_expiry = self.manager.data["sessions"][session_token]["expires_at"]
+        self.assertEqual(_stored_sessions(self.directory)[session_token]["expires_at"], renewed_expiry)
+        with mock.patch("time.time", return_value=created_expiry + 50): # Expired without the renewals
+            self.assertTrue(self.manager.validate_session("alice", session_token))
+        expires_at = self.manager.data["sessions"][session_token]["expires_at"]
+        with mock.patch("time.time", return_value=expires_at + 1):
+            self.assertFalse(self.manager.validate_session("alice", session_token))
+
+    def test_shared_sessions(self):
+        path = os.path.join(self.directory, "shared.json")
+        first, second = (_QuietSessionManager(SharedJournalBackend(path, {"users": {}}, refresh_interval=0),
+                                              hasher=PBKDF2Hasher(1000)) for _ in range(2))
+        first.create_account("carol", "password789")
+        self.assertTrue(second.login_user("carol", "password789"))
+        session_token = first.create_session("carol")
+        self.assertEqual(second.validate_token(session_token), "carol")
+        second.logout_user("carol")
+        self.assertIsNone(first.validate_token(session_token))
+        first.close()
+        second.close()
+
+    def test_concurrent_renewal(self):
+        self.manager.RENEWAL_GRANULARITY = 0 # Persist every renewal
+        session_tokens = [self.manager.create_session("alice") for _ in range(20)]
+        errors = []
+
+        def validate():
+            for index in range(500):
+                try:
+                    self.assertIn(self.manager.validate_token(session_tokens[index % 20]), ("alice", None))
+                except Exception as error:
+                    errors.append(error)
+
+        def terminate():
+            for session_token in session_tokens[:10]:
+                self.manager.terminate_session(session_token)
+                time.sleep(0.001)
+
+        threads = [threading.Thread(target=validate) for _ in range(3)] + [threading.Thread(target=terminate)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        self.assertEqual(errors, [])
+        self.assertEqual(sorted(self.manager.data["sessions"]), sorted(session_tokens[10:]))
+        self.assertEqual(sorted(_stored_sessions(self.directory)), sorted(session_tokens[10:]))
+
+
+class TestSignedSessions(unittest.TestCase):
+
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+        self.signer = TokenSigner()
+        self.manager = _open_manager(self.directory, self.signer)
+        self.manager.create_account("alice", "password123")
+
+    def tearDown(self):
+        self.manager.close()
+        shutil.rmtree(self.directory)
+
+    def test_signed_session(self):
+        session_token = self.manager.create_session("alice")
+        self.assertTrue(TokenSigner.is_signed(session_token))
+        self.assertEqual(self.manager.data["sessions"], {})
+        self.assertEqual(self.manager.validate_token(session_token), "alice")
+        self.assertTrue(self.manager.validate_session("alice", session_token))
+        tampered = session_token[:-2] + ("AA" if session_token[-2:] != "AA" else "BB")
+        self.assertIsNone(self.manager.validate_token(tampered))
+        self.assertIsNone(_open_manager(self.directory, TokenSigner()).validate_token(session_token))
+
+    def test_key_rotation(self):
+        old_key_id = self.signer.active_key_id
+        old_token = self.manager.create_session("alice")
+        self.signer.rotate()
+        self.assertNotEqual(self.signer.active_key_id, old_key_id)
+        new_token = self.manager.create_session("alice")
+        self.assertEqual(self.manager.validate_token(old_token), "alice")
+        self.assertEqual(self.manager.validate_token(new_token), "alice")
+        self.signer.retire(old_key_id)
+        self.assertIsNone(self.manager.validate_token(old_token))
+        self.assertEqual(self.manager.validate_token(new_token), "alice")
+
+    def test_revocation(self):
+        first = self.manager.create_session("alice")
+        second = self.manager.create_session("alice")
+        self.assertTrue(self.manager.terminate_session(first))
+        self.assertIsNone(self.manager.validate_token(first))
+        self.assertEqual(self.manager.validate_token(second), "alice")
+        time.sleep(0.002) # Revocations of a logout cover the tokens issued up to its millisecond
+        self.manager.logout_user("alice")
+        self.assertIsNone(self.manager.validate_token(second))
+        time.sleep(0.002)
+        third = self.manager.create_session("alice")
+        self.assertEqual(self.manager.validate_token(third), "alice")
+        self.manager.flush()
+        reopened = _open_manager(self.directory, self.signer)
+        self.assertIsNone(reopened.validate_token(first))
+        self.assertIsNone(reopened.validate_token(second))
+        self.assertEqual(reopened.validate_token(third), "alice")
+
+    def test_shared_revocations(self):
+        path = os.path.join(self.directory, "shared.json")
+        writer, reader = (_QuietSessionManager(SharedJournalBackend(path, {"users": {}}, refresh_interval=0),
+                                               hasher=PBKDF2Hasher(1000), signer=self.signer) for _ in range(2))
+        writer.create_account("bob", "password123")
+        session_token = writer.create_session("bob")
+        with mock.patch.object(reader, "_refresh_data", wraps=reader._refresh_data) as refresh_data:
+            for _ in range(100):
+                self.assertEqual(reader.validate_token(session_token), "bob")
+            self.assertTrue(reader.validate_session("bob", session_token))
+            self.assertEqual(refresh_data.call_count, 0)
+            time.sleep(0.002)
+            writer.logout_user("bob")
+            self.assertEqual(reader.validate_token(session_token), "bob") # Until the next refresh
+            reader.REVOCATION_REFRESH_INTERVAL = 0
+            self.assertIsNone(reader.validate_token(session_token))
+            self.assertEqual(refresh_data.call_count, 1)
+        writer.close()
+        reader.close()
+
+
+if __name__ == "__main__":
+    unittest.main()
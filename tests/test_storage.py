@@ -0,0 +1,468 @@
+"""
+Unit tests for the storage backends
+
+This module contains unit tests for the storage backends persisting the
+authentication and RBAC data.
+
+Classes:
+    TestBackends: Contains unit tests run against every backend.
+    TestJournalBackend: Contains unit tests for the journal and its compaction.
+    TestGroupCommitBackend: Contains unit tests for the group commits.
+    TestSharedJournalBackend: Contains unit tests for a journal shared between processes.
+    TestMappedFileBackend: Contains unit tests for the memory-mapped snapshot.
+    TestShardedBackend: Contains unit tests for the consistent-hash sharding.
+
+Methods:
+    test_round_trip(self): Tests storing records and reading them back.
+    test_reload(self): Tests reopening a store, including a batch of several changes.
+    test_find_by_token_and_role(self): Tests the record lookups.
+    test_file_mode(self): Tests the permissions of new snapshots and that rewriting one keeps them.
+    test_replay(self): Tests that changes are appended to the journal and replayed on load.
+    test_compaction(self): Tests folding the journal into the snapshot.
+    test_compaction_threshold(self): Tests that a large journal is compacted in the background.
+    test_coalescing(self): Tests that the changes of a window reach the wrapped backend in one call.
+    test_wait(self): Tests that a waiting apply returns once the change is committed.
+    test_closed(self): Tests that changes are rejected once the backend is closed.
+    test_manager_flush(self): Tests that flushing a manager persists its pending changes.
+    test_catch_up(self): Tests that a reader picks up the changes of another writer.
+    test_reload_batch(self): Tests that every change of a batch is replayed by another process.
+    test_conflict(self): Tests that a change based on an outdated record is rejected.
+    test_concurrent_writers(self): Tests transactions of several processes on the same store.
+    test_mapped_compaction(self): Tests compacting into the indexed snapshot and reading it back.
+    test_json_conversion(self): Tests that a JSON store is copied into the mapped format and left untouched.
+    test_hash_ring(self): Tests that keys spread evenly and adding a node only moves keys to it.
+    test_routing(self): Tests that every record is stored in the shard owning its key.
+    test_add_shard(self): Tests moving the records of a new shard while the store stays in use.
+"""
+import json
+import multiprocessing
+import os
+import shutil
+import stat
+import sys
+import tempfile
+import unittest
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "src"))
+
+from auth import AuthManager
+from storage import (GroupCommitBackend, HashRing, JournalBackend, JSONFileBackend, MappedFileBackend,
+                     ShardedBackend, SharedJournalBackend, SQLiteBackend, StorageConflictError, _read_umask)
+
+DEFAULT = {"users": {}, "sessions": {}}
+
+BATCH = [
+    ("users", "bob", {"password": "hash-b", "role": "user", "session_token": "t-bob", "expires_at": None}),
+    ("users", "carol", {"password": "hash-c", "role": "admin", "session_token": None, "expires_at": None}),
+    ("sessions", "t-bob", {"username": "bob", "expires_at": 2000000000}),
+    ("users", "alice", None),
+]
+
+EXPECTED = {
+    "users": {
+        "bob": {"password": "hash-b", "role": "user", "session_token": "t-bob", "expires_at": None},
+        "carol": {"password": "hash-c", "role": "admin", "session_token": None, "expires_at": None},
+    },
+    "sessions": {"t-bob": {"username": "bob", "expires_at": 2000000000}},
+}
+
+
+def _open_json(directory):
+    return JSONFileBackend(os.path.join(directory, "auth.json"), DEFAULT)
+
+
+def _open_journal(directory):
+    return JournalBackend(os.path.join(directory, "auth.json"), DEFAULT)
+
+
+def _open_mapped(directory):
+    return MappedFileBackend(os.path.join(directory, "auth.json"), DEFAULT)
+
+
+def _open_shared(directory):
+    return SharedJournalBackend(os.path.join(directory, "auth.json"), DEFAULT, refresh_interval=0)
+
+
+def _open_sqlite(directory):
+    return SQLiteBackend(os.path.join(directory, "auth.db"), DEFAULT)
+
+
+def _open_group_commit(directory):
+    return GroupCommitBackend(_open_json(directory), window=0.001)
+
+
+def _open_sharded(directory):
+    return ShardedBackend({name: JournalBackend(os.path.join(directory, f"{name}.json"), DEFAULT)
+                           for name in ("a", "b", "c")}, DEFAULT)
+
+
+BACKENDS = {
+    "json": _open_json,
+    "journal": _open_journal,
+    "shared": _open_shared,
+    "mapped": _open_mapped,
+    "sqlite": _open_sqlite,
+    "group_commit": _open_group_commit,
+    "sharded": _open_sharded,
+}
+
+
+class _CountingBackend(JSONFileBackend):
+    """JSON file backend counting the apply calls it receives"""
+
+    def __init__(self, path: str, default: dict):
+        super().__init__(path, default)
+        self.applied = []
+
+    def apply(self, changes):
+        changes = list(changes)
+        self.applied.append(len(changes))
+        super().apply(changes)
+
+
+def _plain(data: dict):
+    """Copy the sections of a loaded document into plain dicts"""
+    return {section: {key: value for key, value in data[section].items()} for section in DEFAULT}
+
+
+def _count(path: str, worker: int, increments: int):
+    """Increment a shared counter and add one record per increment, in a child process"""
+    backend = SharedJournalBackend(path, DEFAULT, max_journal_bytes=4096, refresh_interval=0)
+    for index in range(increments):
+        with backend.transaction():
+            counter = backend.get("sessions", "counter") or {"username": "counter", "expires_at": 0}
+            backend.apply([("sessions", "counter", dict(counter, expires_at=counter["expires_at"] + 1)),
+                           ("users", f"w{worker}-{index}", {"password": "x", "role": "user"})])
+    backend.close()
+
+
+class TestBackends(unittest.TestCase):
+
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+
+    def tearDown(self):
+        shutil.rmtree(self.directory)
+
+    def _directory(self, name: str):
+        directory = os.path.join(self.directory, name)
+        os.mkdir(directory)
+        return directory
+
+    def _fill(self, backend):
+        backend.put("users", "alice", {"password": "hash-a", "role": "user", "session_token": None,
+                                       "expires_at": None})
+        backend.apply(BATCH)
+
+    def test_round_trip(self):
+        for name, open_backend in BACKENDS.items():
+            with self.subTest(backend=name):
+                backend = open_backend(self._directory(name))
+                self.assertEqual(_plain(backend.load()), DEFAULT)
+                self._fill(backend)
+                self.assertEqual(_plain(backend.load()), EXPECTED)
+                self.assertEqual(backend.get("users", "carol"), EXPECTED["users"]["carol"])
+                self.assertIsNone(backend.get("users", "alice"))
+                backend.delete("users", "carol")
+                self.assertIsNone(backend.get("users", "carol"))
+                backend.close()
+
+    def test_reload(self):
+        for name, open_backend in BACKENDS.items():
+            with self.subTest(backend=name):
+                directory = self._directory(name)
+                backend = open_backend(directory)
+                backend.load()
+                self._fill(backend)
+                backend.close()
+                backend = open_backend(directory)
+                self.assertEqual(_plain(backend.load()), EXPECTED)
+                backend.close()
+
+    def test_find_by_token_and_role(self):
+        for name, open_backend in BACKENDS.items():
+            with self.subTest(backend=name):
+                backend = open_backend(self._directory(name))
+                backend.load()
+                self._fill(backend)
+                self.assertEqual(backend.find_by_token("t-bob"), "bob")
+                self.assertIsNone(backend.find_by_token("t-unknown"))
+                self.assertEqual(backend.find_by_role("admin"), ["carol"])
+                backend.close()
+
+    def test_file_mode(self):
+        umask = _read_umask()
+        new_mode = 0o600 if umask is None else 0o666 & ~umask # What open gives a new file, where readable
+        for name, open_backend, file_name in (("json", _open_json, "auth.json"),
+                                              ("mapped", _open_mapped, "auth.json.map")):
+            with self.subTest(backend=name):
+                directory = self._directory(name)
+                backend = open_backend(directory)
+                backend.load()
+                backend.save(EXPECTED)
+                path = os.path.join(directory, file_name)
+                self.assertEqual(stat.S_IMODE(os.stat(path).st_mode), new_mode)
+                os.chmod(path, 0o640)
+                backend.save(EXPECTED)
+                backend.close()
+                self.assertEqual(stat.S_IMODE(os.stat(path).st_mode), 0o640)
+
+
+class TestJournalBackend(unittest.TestCase):
+
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+        self.path = os.path.join(self.directory, "auth.json")
+
+    def tearDown(self):
+        shutil.rmtree(self.directory)
+
+    def test_replay(self):
+        backend = _open_journal(self.directory)
+        backend.load()
+        backend.apply(BATCH)
+        backend.close()
+        self.assertFalse(os.path.exists(self.path))
+        with open(self.path + ".journal") as journal:
+            self.assertEqual(len(journal.readlines()), len(BATCH))
+        self.assertEqual(_plain(_open_journal(self.directory).load()), EXPECTED)
+
+    def test_compaction(self):
+        backend = _open_journal(self.directory)
+        backend.load()
+        backend.put("users", "alice", {"password": "hash-a", "role": "user"})
+        backend.apply(BATCH)
+        backend.compact()
+        backend.close()
+        self.assertFalse(os.path.exists(self.path + ".journal"))
+        self.assertFalse(os.path.exists(self.path + ".journal.old"))
+        with open(self.path) as file:
+            self.assertEqual(json.load(file), EXPECTED)
+        self.assertEqual(_plain(_open_json(self.directory).load()), EXPECTED)
+
+    def test_compaction_threshold(self):
+        backend = JournalBackend(self.path, DEFAULT, max_journal_bytes=512)
+        backend.load()
+        for index in range(20):
+            backend.put("users", f"user{index}", {"password": "x" * 32, "role": "user"})
+        backend.close()
+        with open(self.path) as file:
+            self.assertGreater(len(json.load(file)["users"]), 0)
+        self.assertEqual(len(_open_journal(self.directory).load()["users"]), 20)
+
+
+class TestGroupCommitBackend(unittest.TestCase):
+
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+        self.path = os.path.join(self.directory, "auth.json")
+
+    def tearDown(self):
+        shutil.rmtree(self.directory)
+
+    def test_coalescing(self):
+        inner = _CountingBackend(self.path, DEFAULT)
+        backend = GroupCommitBackend(inner, window=60)
+        for index in range(100):
+            backend.put("users", f"user{index}", {"password": "x", "role": "user"})
+        backend.put("users", "user0", {"password": "y", "role": "admin"})
+        self.assertEqual(inner.applied, [])
+        self.assertEqual(backend.get("users", "user0"), {"password": "y", "role": "admin"})
+        backend.flush()
+        self.assertEqual(inner.applied, [100])
+        backend.close()
+        with open(self.path) as file:
+            users = json.load(file)["users"]
+        self.assertEqual(len(users), 100)
+        self.assertEqual(users["user0"]["role"], "admin")
+
+    def test_wait(self):
+        inner = _CountingBackend(self.path, DEFAULT)
+        backend = GroupCommitBackend(inner, window=0.05)
+        backend.apply(BATCH, wait=True)
+        self.assertEqual(inner.applied, [len(BATCH)])
+        backend.close()
+
+    def test_closed(self):
+        backend = _open_group_commit(self.directory)
+        backend.close()
+        with self.assertRaises(RuntimeError):
+            backend.put("users", "alice", {"password": "hash-a", "role": "user"})
+
+    def test_manager_flush(self):
+        manager = AuthManager(GroupCommitBackend(JSONFileBackend(self.path, {"users": {}}), window=60))
+        manager.create_account("alice", "password123")
+        self.assertFalse(os.path.exists(self.path))
+        manager.flush()
+        with open(self.path) as file:
+            self.assertIn("alice", json.load(file)["users"])
+        manager.close()
+
+
+class TestSharedJournalBackend(unittest.TestCase):
+
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+        self.path = os.path.join(self.directory, "auth.json")
+
+    def tearDown(self):
+        shutil.rmtree(self.directory)
+
+    def test_catch_up(self):
+        writer, reader = _open_shared(self.directory), _open_shared(self.directory)
+        writer.load()
+        reader.load()
+        reported = []
+        reader.add_listener(reported.append)
+        writer.put("users", "alice", {"password": "hash-a", "role": "user"})
+        writer.delete("users", "alice")
+        writer.put("users", "bob", {"password": "hash-b", "role": "admin"})
+        reader.refresh()
+        self.assertEqual(reader.get("users", "bob"), {"password": "hash-b", "role": "admin"})
+        self.assertIsNone(reader.get("users", "alice"))
+        self.assertEqual([key for changes in reported for _, key, _ in changes], ["alice", "alice", "bob"])
+        writer.close()
+        reader.close()
+
+    def test_reload_batch(self):
+        writer, reader = _open_shared(self.directory), _open_shared(self.directory)
+        writer.load()
+        reader.load()
+        reported = []
+        reader.add_listener(reported.append)
+        writer.put("users", "alice", {"password": "hash-a", "role": "user"})
+        writer.apply(BATCH)
+        reader.refresh()
+        self.assertEqual(_plain(reader.load()), EXPECTED)
+        self.assertEqual(sorted(key for changes in reported for _, key, _ in changes),
+                         ["alice", "alice", "bob", "carol", "t-bob"])
+        writer.close()
+        reader.close()
+
+    def test_conflict(self):
+        first, second = _open_shared(self.directory), _open_shared(self.directory)
+        first.load()
+        second.load()
+        first.put("users", "alice", {"password": "hash-a", "role": "user"})
+        with self.assertRaises(StorageConflictError):
+            second.put("users", "alice", {"password": "hash-b", "role": "user"})
+        self.assertEqual(second.get("users", "alice"), {"password": "hash-a", "role": "user"})
+        first.close()
+        second.close()
+
+    def test_concurrent_writers(self):
+        workers, increments = 4, 25
+        processes = [multiprocessing.Process(target=_count, args=(self.path, worker, increments))
+                     for worker in range(workers)]
+        for process in processes:
+            process.start()
+        for process in processes:
+            process.join()
+            self.assertEqual(process.exitcode, 0)
+        data = _open_shared(self.directory).load()
+        self.assertEqual(data["sessions"]["counter"]["expires_at"], workers * increments)
+        self.assertEqual(len(data["users"]), workers * increments)
+
+
+class TestMappedFileBackend(unittest.TestCase):
+
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+        self.path = os.path.join(self.directory, "auth.json")
+
+    def tearDown(self):
+        shutil.rmtree(self.directory)
+
+    def test_mapped_compaction(self):
+        backend = _open_mapped(self.directory)
+        backend.load()
+        for index in range(50):
+            backend.put("users", f"user{index:02}", {"password": f"hash-{index}", "role": "user"})
+        backend.compact()
+        backend.apply(BATCH)
+        backend.put("users", "user07", None)
+        backend.compact()
+        backend.close()
+        self.assertFalse(os.path.exists(self.path + ".map.journal"))
+        data = _open_mapped(self.directory).load()
+        self.assertEqual(len(data["users"]), 51)
+        self.assertNotIn("user07", data["users"])
+        self.assertEqual(data["users"]["user42"], {"password": "hash-42", "role": "user"})
+        self.assertEqual(data["users"]["carol"], EXPECTED["users"]["carol"])
+        self.assertEqual(dict(data["sessions"]), EXPECTED["sessions"])
+
+    def test_json_conversion(self):
+        backend = _open_json(self.directory)
+        backend.load()
+        backend.apply(BATCH)
+        backend.close()
+        backend = _open_mapped(self.directory)
+        self.assertEqual(_plain(backend.load()), EXPECTED)
+        backend.put("users", "dave", {"password": "hash-d", "role": "user"})
+        backend.close()
+        self.assertTrue(os.path.exists(self.path + ".map"))
+        self.assertEqual(_plain(_open_json(self.directory).load()), EXPECTED) # The JSON store is left untouched
+        self.assertEqual(_open_mapped(self.directory).load()["users"]["dave"], {"password": "hash-d", "role": "user"})
+
+
+class TestShardedBackend(unittest.TestCase):
+
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+
+    def tearDown(self):
+        shutil.rmtree(self.directory)
+
+    def _shard(self, name: str):
+        return JournalBackend(os.path.join(self.directory, f"{name}.json"), DEFAULT)
+
+    def test_hash_ring(self):
+        keys = [f"user{index}" for index in range(10000)]
+        ring = HashRing(["s0", "s1", "s2", "s3"])
+        counts = {}
+        for key in keys:
+            counts[ring.lookup(key)] = counts.get(ring.lookup(key), 0) + 1
+        self.assertEqual(sorted(counts), ["s0", "s1", "s2", "s3"])
+        self.assertGreater(min(counts.values()), 1500)
+        grown = HashRing(["s0", "s1", "s2", "s3", "s4"])
+        moved = [key for key in keys if ring.lookup(key) != grown.lookup(key)]
+        self.assertLess(len(moved), 3500)
+        self.assertTrue(all(grown.lookup(key) == "s4" for key in moved))
+
+    def test_routing(self):
+        backend = _open_sharded(self.directory)
+        backend.load()
+        for index in range(30):
+            backend.put("users", f"user{index}", {"password": "x", "role": "user"})
+        backend.close()
+        for name in ("a", "b", "c"):
+            users = self._shard(name).load()["users"]
+            self.assertGreater(len(users), 0)
+            self.assertTrue(all(backend.ring.lookup(username) == name for username in users))
+
+    def test_add_shard(self):
+        backend = _open_sharded(self.directory)
+        data = backend.load()
+        for index in range(100):
+            backend.put("users", f"user{index}", {"password": f"hash-{index}", "role": "user"})
+        backend.add_shard("d", self._shard("d"))
+        backend.put("users", "user0", {"password": "changed", "role": "admin"})
+        backend.delete("users", "user1")
+        batches = 0
+        while backend.rebalance(10):
+            batches += 1
+            self.assertEqual(data["users"]["user42"], {"password": "hash-42", "role": "user"})
+        self.assertGreater(batches, 1)
+        backend.close()
+        reopened = ShardedBackend({name: self._shard(name) for name in ("a", "b", "c", "d")}, DEFAULT)
+        users = reopened.load()["users"]
+        self.assertEqual(len(users), 99)
+        self.assertEqual(users["user0"], {"password": "changed", "role": "admin"})
+        self.assertNotIn("user1", users)
+        for name, shard in reopened.shards.items():
+            self.assertTrue(all(reopened.ring.lookup(username) == name for username in shard.load()["users"]))
+        reopened.close()
+
+
+if __name__ == "__main__":
+    unittest.main()
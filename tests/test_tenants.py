@@ -0,0 +1,110 @@
+"""
+Unit tests for tenant namespaces
+
+This module contains unit tests for the tenant directories and their sharded
+managers.
+
+Classes:
+    TestTenantDirectory: Contains unit tests for TenantDirectory.
+
+Methods:
+    test_isolation(self): Tests that tenants share no users, sessions or roles.
+    test_add_shard(self): Tests adding a shard to a tenant in use and reopening it.
+    test_interrupted_rebalance(self): Tests that a rebalance carries on after the tenant is reopened.
+    test_invalid_tenant(self): Tests that tenant names outside the allowed characters are rejected.
+"""
+import json
+import os
+import shutil
+import sys
+import tempfile
+import unittest
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "src"))
+
+from hashing import PBKDF2Hasher
+from tenants import TenantDirectory
+
+
+class TestTenantDirectory(unittest.TestCase):
+
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+        self.tenants = self._open_directory()
+
+    def tearDown(self):
+        self.tenants.close()
+        shutil.rmtree(self.directory)
+
+    def _open_directory(self):
+        return TenantDirectory(self.directory, shards=3, hasher=PBKDF2Hasher(1000))
+
+    def _fill(self, users: int = 60):
+        sessions, rbac = self.tenants.session_manager("acme"), self.tenants.rbac_manager("acme")
+        for manager in (sessions, rbac):
+            manager.VERBOSE = False
+        for index in range(users):
+            sessions.create_account(f"user{index}", "password123")
+        rbac.add_role("editor")
+        rbac.add_permission("edit")
+        rbac.assign_permission_to_role("editor", "edit")
+        for index in range(users):
+            rbac.assign_role_to_user(f"user{index}", "editor")
+        return sessions, rbac
+
+    def test_isolation(self):
+        sessions, rbac = self._fill(5)
+        session_token = sessions.create_session("user1")
+        other_sessions, other_rbac = self.tenants.session_manager("other"), self.tenants.rbac_manager("other")
+        self.assertTrue(sessions.login_user("user1", "password123"))
+        self.assertFalse(other_sessions.login_user("user1", "password123"))
+        self.assertIsNone(other_sessions.validate_token(session_token))
+        self.assertFalse(other_rbac.check_user_permission("user1", "edit"))
+        self.assertEqual(self.tenants.tenants(), ["acme", "other"])
+
+    def test_add_shard(self):
+        sessions, rbac = self._fill()
+        self.assertEqual(self.tenants.add_shard("acme"), "s3")
+        with self.assertRaises(ValueError):
+            self.tenants.add_shard("acme")
+        sessions.logout_user("user0")
+        rbac.remove_role_from_user("user2", "editor")
+        sessions.create_account("late", "password123")
+        while self.tenants.rebalance("acme", 10):
+            self.assertTrue(sessions.login_user("user11", "password123"))
+            self.assertTrue(rbac.check_user_permission("user12", "edit"))
+        with open(os.path.join(self.directory, "acme", "shards.json")) as file:
+            self.assertEqual(json.load(file), {"shards": ["s0", "s1", "s2", "s3"], "pending": None})
+        self.tenants.close()
+        self.tenants = self._open_directory()
+        sessions, rbac = self.tenants.session_manager("acme"), self.tenants.rbac_manager("acme")
+        self.assertEqual(len(sessions.storage.shards), 4)
+        self.assertEqual(len(sessions.data["users"]), 61)
+        self.assertTrue(sessions.login_user("late", "password123"))
+        self.assertFalse(rbac.check_user_permission("user2", "edit"))
+        self.assertTrue(rbac.check_user_permission("user59", "edit"))
+
+    def test_interrupted_rebalance(self):
+        self._fill()
+        self.tenants.add_shard("acme")
+        self.tenants.rebalance("acme", 5)
+        self.tenants.close()
+        self.tenants = self._open_directory()
+        sessions, rbac = self.tenants.session_manager("acme"), self.tenants.rbac_manager("acme")
+        self.assertEqual(len(sessions.data["users"]), 60)
+        while self.tenants.rebalance("acme", 10):
+            pass
+        self.assertEqual(len(sessions.data["users"]), 60)
+        self.assertTrue(sessions.login_user("user30", "password123"))
+        self.assertTrue(rbac.check_user_permission("user30", "edit"))
+        for name, shard in sessions.storage.shards.items():
+            self.assertTrue(all(sessions.storage.ring.lookup(username) == name for username in shard.load()["users"]))
+
+    def test_invalid_tenant(self):
+        for tenant in ("../escape", "", "a b"):
+            with self.assertRaises(ValueError):
+                self.tenants.session_manager(tenant)
+
+
+if __name__ == "__main__":
+    unittest.main()